@@ -0,0 +1,138 @@
+import socket
+import struct
+import threading
+import time
+
+ARTNET_PORT = 6454
+ARTNET_ID = b'Art-Net\x00'
+OP_POLL = 0x2000
+OP_POLL_REPLY = 0x2100
+ARTPOLLREPLY_MIN_SIZE = 194 # Fino a SwOut compreso (i nodi più vecchi mandano pacchetti corti)
+
+def build_artpoll():
+    """Pacchetto ArtPoll: ID + OpCode (LE) + ProtVer 14 + Flags + DiagPriority."""
+    flags = 0x02 # Il nodo invia ArtPollReply anche quando cambia configurazione
+    return ARTNET_ID + struct.pack('<H', OP_POLL) + b'\x00\x0e' + bytes([flags, 0x00])
+
+def parse_artpollreply(data):
+    """
+    Decodifica un ArtPollReply. Ritorna un dict con IP, nomi e Port-Address delle porte
+    di uscita (Net:SubNet:Universe a 15 bit, come l'universo dei pacchetti ArtDMX),
+    oppure None se il pacchetto non è un ArtPollReply valido.
+    """
+    if len(data) < ARTPOLLREPLY_MIN_SIZE or data[:8] != ARTNET_ID: return None
+    if struct.unpack_from('<H', data, 8)[0] != OP_POLL_REPLY: return None
+
+    ip = socket.inet_ntoa(data[10:14])
+    port = struct.unpack_from('<H', data, 14)[0] or ARTNET_PORT
+    net = data[18] & 0x7f
+    sub = data[19] & 0x0f
+    short_name = data[26:44].split(b'\x00', 1)[0].decode('latin-1')
+    long_name = data[44:108].split(b'\x00', 1)[0].decode('latin-1')
+    num_ports = min(4, data[173])
+
+    universes = []
+    for i in range(num_ports):
+        port_type = data[174 + i]
+        if port_type & 0x80: # La porta può emettere DMX ricevuto dalla rete
+            universes.append((net << 8) | (sub << 4) | (data[190 + i] & 0x0f))
+
+    bind_index = data[211] if len(data) > 211 else 0
+    return {"ip": ip, "port": port, "short_name": short_name, "long_name": long_name,
+            "universes": universes, "bind_index": bind_index}
+
+class ArtNetDiscovery:
+    """
+    Discovery dei nodi Art-Net (ArtPoll/ArtPollReply) in un thread di background.
+    La tabella dei nodi viene ricostruita e sostituita in blocco: il thread di invio DMX legge
+    'routes' ({universo: [(ip, porta), ...]}) senza lock e senza mai attendere la rete.
+    """
+    def __init__(self, poll_address="255.255.255.255", interval=3.0, timeout=10.0,
+                 bind_ip="", port=ARTNET_PORT, poll_port=ARTNET_PORT):
+        self.poll_address = poll_address
+        self.poll_port = poll_port
+        self.interval = interval # ArtPoll periodico (la specifica suggerisce 2.5-3s)
+        self.timeout = timeout   # Un nodo che non risponde per 'timeout' secondi viene rimosso
+
+        self.nodes = {} # {(ip, bind_index): info + 'last_seen'}
+        self.routes = {}
+        self._lock = threading.Lock()
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.socket.bind((bind_ip, port))
+        self.socket.settimeout(0.2)
+        self._poll_packet = build_artpoll()
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running: return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def poll(self):
+        """Invia subito un ArtPoll."""
+        try:
+            self.socket.sendto(self._poll_packet, (self.poll_address, self.poll_port))
+        except OSError as e:
+            print(f"[ARTNET] Errore ArtPoll: {e}")
+
+    def _loop(self):
+        next_poll = 0
+        while self.running:
+            now = time.monotonic()
+            if now >= next_poll:
+                self.poll()
+                self._expire(now)
+                next_poll = now + self.interval
+            try:
+                data, addr = self.socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.running: break
+                time.sleep(0.2)
+                continue
+            self._handle(data, addr)
+
+    def _handle(self, data, addr):
+        info = parse_artpollreply(data)
+        if not info: return
+        # Alcuni nodi dietro NAT o mal configurati riportano 0.0.0.0: si usa l'indirizzo sorgente
+        if info["ip"] == "0.0.0.0": info["ip"] = addr[0]
+        info["last_seen"] = time.monotonic()
+        with self._lock:
+            self.nodes[(info["ip"], info["bind_index"])] = info
+            self._rebuild_routes()
+
+    def _expire(self, now):
+        with self._lock:
+            stale = [k for k, n in self.nodes.items() if now - n["last_seen"] > self.timeout]
+            for k in stale: del self.nodes[k]
+            if stale: self._rebuild_routes()
+
+    def _rebuild_routes(self):
+        routes = {}
+        for n in self.nodes.values():
+            dest = (n["ip"], ARTNET_PORT)
+            for uni in n["universes"]:
+                lst = routes.setdefault(uni, [])
+                if dest not in lst: lst.append(dest)
+        self.routes = routes # Sostituzione atomica: i lettori vedono sempre una tabella completa
+
+    def nodes_for_universe(self, universe):
+        return list(self.routes.get(universe, []))
+
+    def get_nodes(self):
+        with self._lock:
+            return [dict(n) for n in self.nodes.values()]
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread.is_alive():
+            self.thread.join(1.0)
+        self.socket.close()
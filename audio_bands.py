@@ -0,0 +1,157 @@
+import math
+import numpy as np
+from dmx_engine import frame_index, MERGE_HTP
+
+BAND_LAYER = "audio" # Layer DMX dei canali pilotati dalle bande
+
+def band_layout(chunk, rate, bands_per_octave=3, f_min=40.0, f_max=16000.0):
+    """
+    Bande a frazione d'ottava (centri ISO su base 1 kHz) ridotte ai bin della FFT.
+    Le bande più strette di un bin (bassi con finestre corte) vengono fuse con le vicine:
+    ogni banda ha almeno un bin. Ritorna (bin iniziali, bin finale, frequenze centrali).
+    """
+    freqs = np.fft.rfftfreq(chunk, 1.0 / rate)
+    half = 2 ** (0.5 / bands_per_octave)
+    k_lo = math.ceil(bands_per_octave * math.log2(f_min / 1000.0))
+    k_hi = math.floor(bands_per_octave * math.log2(min(f_max, rate / 2 / half) / 1000.0))
+    centers = [1000.0 * 2 ** (k / bands_per_octave) for k in range(k_lo, k_hi + 1)]
+
+    starts, kept, first = [], [], []
+    for fc in centers:
+        lo = max(1, int(np.searchsorted(freqs, fc / half))) # Il bin DC non appartiene a nessuna banda
+        if starts and lo <= starts[-1]: # Banda più stretta di un bin: fusa con la precedente
+            kept[-1] = math.sqrt(first[-1] * fc) # Centro geometrico delle bande fuse
+            continue
+        starts.append(lo)
+        kept.append(fc)
+        first.append(fc)
+    end = max(starts[-1] + 1, int(np.searchsorted(freqs, centers[-1] * half)))
+    return np.array(starts, dtype=np.intp), min(end, len(freqs)), kept
+
+class BandAnalyzer:
+    """
+    Analizzatore a N bande sul modulo di SpectrumAnalyzer, con envelope follower attack/release
+    e normalizzazione automatica del guadagno per banda (picco con decadimento lento).
+    'levels' (0..1, float32) è lo stesso array a ogni hop: chi lo legge da un altro thread
+    (mappatura DMX, GUI) vede sempre un valore valido per banda, senza liste nuove per frame.
+    """
+    def __init__(self, chunk, rate, frame_rate, bands_per_octave=3, f_min=40.0, f_max=16000.0,
+                 attack_ms=10.0, release_ms=300.0, agc_s=8.0, floor=2000.0):
+        self.frame_rate = frame_rate
+        self.starts, self.end, self.centers = band_layout(chunk, rate, bands_per_octave, f_min, f_max)
+        n = len(self.starts)
+        self.counts = np.diff(np.append(self.starts, self.end)).astype(np.float32)
+        self.floor = floor # Picco minimo: nel silenzio il rumore di fondo non viene amplificato
+
+        self.energies = np.zeros(n, dtype=np.float32) # Media del modulo per banda
+        self.envelope = np.zeros(n, dtype=np.float32)
+        self.peak = np.full(n, floor, dtype=np.float32)
+        self.levels = np.zeros(n, dtype=np.float32)
+        self._coef = np.zeros(n, dtype=np.float32)
+        self._delta = np.zeros(n, dtype=np.float32)
+        self._rising = np.zeros(n, dtype=bool)
+        self._agc_decay = math.exp(-1.0 / (agc_s * frame_rate))
+        self.set_times(attack_ms, release_ms)
+
+    def set_times(self, attack_ms, release_ms):
+        """Tempi di salita/discesa degli envelope (costanti di tempo in ms)."""
+        self._attack = 1.0 - math.exp(-1000.0 / (max(0.1, attack_ms) * self.frame_rate))
+        self._release = 1.0 - math.exp(-1000.0 / (max(0.1, release_ms) * self.frame_rate))
+
+    def reset(self):
+        self.envelope[:] = 0
+        self.peak[:] = self.floor
+        self.levels[:] = 0
+
+    def process(self, magnitude):
+        """Aggiorna energie, envelope e livelli normalizzati dal modulo della FFT; ritorna 'levels'."""
+        return self.follow(self.band_energies(magnitude))
+
+    def band_energies(self, magnitude):
+        """Media del modulo per banda (in 'energies')."""
+        np.add.reduceat(magnitude[:self.end], self.starts, out=self.energies)
+        np.divide(self.energies, self.counts, out=self.energies)
+        return self.energies
+
+    def follow(self, energies):
+        """Envelope e AGC su un vettore di energie per banda; ritorna 'levels'."""
+        env, coef, delta = self.envelope, self._coef, self._delta
+        # Envelope follower: coefficiente di attacco dove l'energia sale, di rilascio dove scende
+        np.greater(energies, env, out=self._rising)
+        coef.fill(self._release)
+        coef[self._rising] = self._attack
+        np.subtract(energies, env, out=delta)
+        np.multiply(delta, coef, out=delta)
+        np.add(env, delta, out=env)
+
+        # AGC: il picco segue subito l'envelope e decade lentamente (mai sotto la soglia di rumore)
+        np.multiply(self.peak, self._agc_decay, out=self.peak)
+        np.maximum(self.peak, env, out=self.peak)
+        np.maximum(self.peak, self.floor, out=self.peak)
+        np.divide(env, self.peak, out=self.levels)
+        return self.levels
+
+class BandMapper:
+    """
+    Bande audio -> canali dei gruppi, applicate nel thread DMX (pre-hook del frame).
+    data_store["audio_map"] = {gruppo: {"band": i, "lo": 0, "hi": 255}}: ogni frame il livello
+    della banda viene scalato tra lo e hi e scritto nel layer HTP 'audio' sui canali del gruppo.
+    La tabella compilata (indici NumPy) viene sostituita in blocco da rebuild().
+    Dopo blackout() il layer resta spento finché non si chiama release().
+    """
+    def __init__(self, dmx, data_store, reactor):
+        self.dmx = dmx
+        self.data = data_store
+        self.reactor = reactor # Sorgente di band_levels (AudioReactor)
+        self.dmx.add_layer(BAND_LAYER, MERGE_HTP)
+        self.routes = ()
+        self._used = np.zeros(0, dtype=np.intp)
+        self._dirty = False
+        self.muted = False
+        self.rebuild()
+
+    def rebuild(self):
+        """Da chiamare dopo ogni modifica di audio_map o dei gruppi."""
+        routes, used = [], []
+        groups = self.data.get("groups", {})
+        size = self.dmx.layer_frames(BAND_LAYER).size # Canali oltre gli universi attivi ignorati
+        for name, cfg in self.data.get("audio_map", {}).items():
+            channels = groups.get(name)
+            if not channels: continue
+            index = np.array(sorted({i for i in map(frame_index, channels) if i < size}), dtype=np.intp)
+            lo, hi = cfg.get("lo", 0), cfg.get("hi", 255)
+            routes.append((int(cfg.get("band", 0)), index, float(lo), float(hi - lo)))
+            used.append(index)
+        self._used = np.unique(np.concatenate(used)) if used else np.zeros(0, dtype=np.intp)
+        self._size = size
+        self.routes = tuple(routes)
+        self._dirty = True
+
+    def blackout(self):
+        """Spegne il layer delle bande (anche con la cattura audio attiva)."""
+        self.muted = True
+        self._dirty = True
+
+    def release(self):
+        self.muted = False
+
+    def start(self):
+        self.dmx.add_frame_hook(self._frame)
+
+    def stop(self):
+        self.dmx.remove_frame_hook(self._frame)
+
+    def _frame(self, t_ns):
+        flat = self.dmx.layer_frames(BAND_LAYER).reshape(-1)
+        if len(flat) != self._size: self.rebuild() # Numero di universi cambiato
+        if self._dirty: # Canali tolti dalla mappatura: spenti una volta sola
+            flat[:] = 0
+            self._dirty = False
+        flat[self._used] = 0
+        if self.muted or not self.reactor.running: return
+
+        levels = self.reactor.band_levels
+        for band, index, lo, span in self.routes:
+            if band >= len(levels): continue
+            value = int(lo + span * min(1.0, float(levels[band])))
+            flat[index] = np.maximum(flat[index], value) # HTP anche tra bande sullo stesso canale
@@ -2,32 +2,203 @@ import time
 import numpy as np
 import pyaudio
 from PyQt6.QtCore import QThread, pyqtSignal
+from beat_tracker import OnsetDetector, TempoTracker
+from audio_bands import BandAnalyzer, band_layout
+
+# Bande di frequenza (Hz)
+# Bassi: < 150Hz
+# Medi: 150Hz - 2500Hz
+# Alti: > 2500Hz
+BASS_HZ = 150
+MID_HZ = 2500
+
+class SpectrumAnalyzer:
+    """
+    Pipeline di analisi preallocata per una coppia (CHUNK, RATE).
+    Finestra, indici delle bande e buffer di lavoro si calcolano una volta sola; a ogni hop
+    i nuovi campioni entrano nella finestra scorrevole di CHUNK campioni (hop <= CHUNK, quindi
+    finestre sovrapposte) e FFT, modulo e somme delle bande scrivono in array riutilizzati.
+    Le bande sono intervalli contigui di bin: somme su slice, niente maschere booleane.
+    """
+    def __init__(self, chunk=1024, rate=44100, hop=None):
+        self.chunk = chunk
+        self.rate = rate
+        self.hop = min(chunk, hop or chunk)
+        
+        # Hann normalizzata sul guadagno coerente: le ampiezze restano confrontabili con le soglie storiche
+        window = np.hanning(chunk).astype(np.float32)
+        self.window = window / window.mean()
+        
+        freqs = np.fft.rfftfreq(chunk, 1.0 / rate)
+        b1 = int(np.searchsorted(freqs, BASS_HZ))
+        b2 = int(np.searchsorted(freqs, MID_HZ))
+        self.bands = [(0, b1), (b1, b2), (b2, len(freqs))]
+        
+        self.frame = np.zeros(chunk, dtype=np.float32) # Finestra scorrevole (campioni grezzi)
+        self.work = np.zeros(chunk, dtype=np.float32)  # Campioni finestrati
+        self.spectrum = np.zeros(len(freqs), dtype=np.complex64)
+        self.magnitude = np.zeros(len(freqs), dtype=np.float32)
+        self.energies = np.zeros(len(self.bands), dtype=np.float32)
+        try:
+            np.fft.rfft(self.work, out=self.spectrum)
+            self._rfft_out = True
+        except TypeError: # NumPy < 2.0: niente 'out' nelle FFT
+            self._rfft_out = False
+
+    def process(self, samples):
+        """
+        Aggiunge 'hop' campioni int16 e analizza la finestra corrente.
+        Ritorna (rms, energie delle bande) con energies riutilizzato tra le chiamate.
+        """
+        frame, n = self.frame, len(samples)
+        if n >= self.chunk:
+            np.copyto(frame, samples[-self.chunk:], casting="unsafe")
+        else:
+            frame[:-n] = frame[n:] # Scorrimento (memmove), poi i nuovi campioni in coda
+            np.copyto(frame[-n:], samples, casting="unsafe")
+        
+        rms = float(np.sqrt(np.dot(frame, frame) / self.chunk))
+        
+        np.multiply(frame, self.window, out=self.work)
+        if self._rfft_out: np.fft.rfft(self.work, out=self.spectrum)
+        else: self.spectrum[:] = np.fft.rfft(self.work)
+        np.abs(self.spectrum, out=self.magnitude)
+        
+        mag = self.magnitude
+        for i, (lo, hi) in enumerate(self.bands):
+            self.energies[i] = mag[lo:hi].mean() if hi > lo else 0.0
+        return rms, self.energies
+
+class AudioRing:
+    """
+    Ring buffer int16 preallocato tra il callback di PortAudio (produttore) e l'analisi (consumatore).
+    Un solo scrittore e un solo lettore: ognuno aggiorna solo il proprio contatore (campioni totali
+    scritti/letti, interi Python assegnati in blocco), quindi niente lock nel callback audio.
+    Se l'analisi resta indietro di più della capacità, i campioni più vecchi vengono scartati e contati.
+    """
+    def __init__(self, capacity):
+        self.buf = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        self.written = 0 # Scritto solo dal produttore
+        self.read_pos = 0 # Scritto solo dal consumatore
+        self.dropped = 0  # Campioni persi per overrun (aggiornato dal consumatore)
+        self.stamp = (0, 0) # (campioni scritti, perf_counter_ns) all'ultimo callback
+
+    def write(self, samples, t_ns=None):
+        n = len(samples)
+        if n > self.capacity: samples, n = samples[-self.capacity:], self.capacity
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start + first] = samples[:first]
+        if first < n: self.buf[:n - first] = samples[first:]
+        self.written += n # Pubblica i campioni solo dopo averli copiati
+        if t_ns is not None: self.stamp = (self.written, t_ns)
+
+    def time_of(self, position, rate):
+        """Istante (perf_counter_ns) stimato del campione 'position' dall'ultimo callback."""
+        written, t_ns = self.stamp
+        return t_ns - int((written - position) * 1e9 / rate)
+
+    def available(self):
+        return self.written - self.read_pos
+
+    def read(self, out):
+        """Copia len(out) campioni in out se disponibili; ritorna False altrimenti."""
+        n = len(out)
+        written = self.written
+        if written - self.read_pos > self.capacity - n: # Overrun: il produttore ha superato il lettore
+            skip = written - self.read_pos - (self.capacity - n)
+            self.dropped += skip
+            self.read_pos += skip
+        if written - self.read_pos < n: return False
+        start = self.read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.buf[start:start + first]
+        if first < n: out[first:] = self.buf[:n - first]
+        self.read_pos += n
+        return True
 
 class AudioReactor(QThread):
     # Segnale emesso ~40 volte al secondo:
-    # is_beat (bool): True se è stato rilevato un colpo di cassa
+    # is_beat (bool): True sul beat del tempo stimato (o su un onset se il tempo non è agganciato)
     # volume (int): 0-255 livello volume generale
-    # spectrum (list): [bassi, medi, alti] valori 0-255
-    data_processed = pyqtSignal(bool, int, list)
+    # bands (ndarray): livelli 0..1 delle bande (band_levels, array riusato: solo lettura)
+    data_processed = pyqtSignal(bool, int, object)
     
-    def __init__(self):
+    def __init__(self, tempo=None):
         super().__init__()
         self.running = False
         self.device_index = None
         self.gain = 1.0
         
         # Parametri Audio
-        self.CHUNK = 1024
+        self.CHUNK = 1024 # Finestra di analisi
+        self.HOP = 256    # Campioni nuovi per analisi (finestre sovrapposte)
+        self.EMIT_HZ = 43 # Aggiornamenti verso la GUI (~ un CHUNK, come in origine)
+        self.CAPTURE_FRAMES = 128 # Blocco del callback PortAudio (latenza di cattura)
+        self.RING_S = 1.0 # Capacità del ring buffer in secondi
         self.FORMAT = pyaudio.paInt16
         self.CHANNELS = 1
         self.RATE = 44100
         
         self.p = pyaudio.PyAudio()
         
-        # Variabili per Beat Detection
-        self.bass_history = []
-        self.last_beat_time = 0
-        self.beat_threshold = 1.3 # Quanto deve essere più forte della media per essere un beat
+        # Analizzatore a bande (1/3 d'ottava di default) con envelope e AGC per banda
+        self.BANDS_PER_OCTAVE = 3
+        self.BAND_MIN_HZ = 40.0
+        self.BAND_MAX_HZ = 16000.0
+        self.attack_ms = 10.0
+        self.release_ms = 300.0
+        self.band_analyzer = None
+        self.band_levels = np.zeros(len(self.band_centers()), dtype=np.float32)
+        
+        # Onset (flusso spettrale) e tempo/fase: il tracker è condiviso con il PlaybackEngine
+        self.tempo = tempo or TempoTracker()
+        self.onset_threshold = 1.5 # Deviazioni standard del flusso sopra la media mobile
+        self.onset_min_rms = 150   # Sotto questo volume (rumore di fondo) non si cercano onset
+        
+        # Cattura in callback mode
+        self.ring = None
+        self.reset_capture_stats()
+
+    def reset_capture_stats(self):
+        self.input_overflows = 0  # Flag PortAudio: il driver ha perso campioni in ingresso
+        self.input_underflows = 0
+        self.capture_stalls = 0   # L'analisi ha atteso dati che non sono arrivati (cattura ferma)
+        self.callbacks = 0
+
+    def get_capture_stats(self):
+        """Contatori di overflow/underflow della cattura e campioni persi dal ring buffer."""
+        ring = self.ring
+        return {
+            "callbacks": self.callbacks,
+            "input_overflows": self.input_overflows,
+            "input_underflows": self.input_underflows,
+            "ring_dropped_samples": ring.dropped if ring else 0,
+            "ring_backlog_samples": ring.available() if ring else 0,
+            "capture_stalls": self.capture_stalls,
+            "hop": self.HOP,
+        }
+
+    def band_centers(self):
+        """Frequenze centrali (Hz) delle bande con la configurazione corrente."""
+        return band_layout(self.CHUNK, self.RATE, self.BANDS_PER_OCTAVE, self.BAND_MIN_HZ, self.BAND_MAX_HZ)[2]
+
+    def set_band_times(self, attack_ms, release_ms):
+        self.attack_ms, self.release_ms = attack_ms, release_ms
+        if self.band_analyzer: self.band_analyzer.set_times(attack_ms, release_ms)
+
+    def set_hop(self, hop):
+        """Hop di analisi in campioni (applicato al prossimo avvio)."""
+        self.HOP = max(32, min(self.CHUNK, int(hop)))
+
+    def _capture(self, in_data, frame_count, time_info, status):
+        """Callback PortAudio: solo copia nel ring buffer e contatori, nessuna analisi."""
+        self.callbacks += 1
+        if status & pyaudio.paInputOverflow: self.input_overflows += 1
+        if status & pyaudio.paInputUnderflow: self.input_underflows += 1
+        self.ring.write(np.frombuffer(in_data, dtype=np.int16), time.perf_counter_ns())
+        return (None, pyaudio.paContinue)
 
     def get_devices(self):
         """Ritorna lista dispositivi input (indice, nome)"""
@@ -52,60 +223,72 @@ class AudioReactor(QThread):
         stream = None
         
         try:
+            analyzer = SpectrumAnalyzer(self.CHUNK, self.RATE, self.HOP)
+            hop = analyzer.hop
+            hop_buf = np.zeros(hop, dtype=np.int16)
+            self.ring = AudioRing(max(self.CHUNK * 2, int(self.RATE * self.RING_S)))
+            frame_rate = self.RATE / hop
+            onsets = OnsetDetector(len(analyzer.magnitude), frame_rate, low_bins=analyzer.bands[0][1], k=self.onset_threshold)
+            # Un transitorio pesa nella finestra quando ne raggiunge il centro: mezza finestra di ritardo
+            self.tempo.configure(frame_rate, latency_s=self.CHUNK / 2 / self.RATE)
+            last_beat = None
+            bands = BandAnalyzer(self.CHUNK, self.RATE, frame_rate, self.BANDS_PER_OCTAVE, self.BAND_MIN_HZ,
+                                 self.BAND_MAX_HZ, self.attack_ms, self.release_ms)
+            self.band_analyzer = bands
+            self.band_levels = bands.levels # Stesso array per tutta la sessione (letto dal thread DMX)
+            emit_every = max(1, int(round(self.RATE / hop / self.EMIT_HZ)))
+            poll_s = hop / self.RATE / 4
+            n_hops = 0
+            beat_pending = False
+            waited = 0.0
+            
             stream = self.p.open(format=self.FORMAT,
                                  channels=self.CHANNELS,
                                  rate=self.RATE,
                                  input=True,
                                  input_device_index=self.device_index,
-                                 frames_per_buffer=self.CHUNK)
+                                 frames_per_buffer=self.CAPTURE_FRAMES,
+                                 stream_callback=self._capture)
+            stream.start_stream()
             
             while self.running:
                 try:
-                    data = stream.read(self.CHUNK, exception_on_overflow=False)
-                    audio_data = np.frombuffer(data, dtype=np.int16)
-                    
-                    # 1. Volume RMS (Root Mean Square)
-                    rms = np.sqrt(np.mean(audio_data.astype(np.float32)**2))
-                    vol_norm = min(255, int((rms / 1000) * 255 * self.gain))
+                    # Finestre sovrapposte: un'analisi per ogni hop di campioni nuovi nel ring buffer
+                    if not self.ring.read(hop_buf):
+                        time.sleep(poll_s)
+                        waited += poll_s
+                        if waited > 0.5: # Mezzo secondo senza audio: cattura ferma
+                            self.capture_stalls += 1
+                            waited = 0.0
+                        continue
+                    waited = 0.0
+                    audio_data = hop_buf
                     
-                    # 2. FFT (Analisi Spettro)
-                    fft_data = np.fft.rfft(audio_data)
-                    fft_freq = np.fft.rfftfreq(self.CHUNK, 1.0/self.RATE)
-                    magnitude = np.abs(fft_data)
+                    # 1. Volume RMS + 2. FFT (Analisi Spettro) sulla finestra scorrevole
+                    rms, _ = analyzer.process(audio_data)
+                    bands.process(analyzer.magnitude) # Livelli N bande (array riusato)
                     
-                    # Bande di frequenza
-                    # Bassi: < 150Hz
-                    # Medi: 150Hz - 2500Hz
-                    # Alti: > 2500Hz
-                    bass_mask = (fft_freq < 150)
-                    mid_mask = (fft_freq >= 150) & (fft_freq < 2500)
-                    high_mask = (fft_freq >= 2500)
+                    # 3. Onset (flusso spettrale) e tempo a ogni hop
+                    flux, onset = onsets.process(analyzer.magnitude)
+                    onset = onset and rms > self.onset_min_rms
+                    t_hop = self.ring.time_of(self.ring.read_pos, self.RATE)
+                    self.tempo.push(flux, onset, t_hop, onsets.low_flux)
                     
-                    bass_energy = np.mean(magnitude[bass_mask]) if np.any(bass_mask) else 0
-                    mid_energy = np.mean(magnitude[mid_mask]) if np.any(mid_mask) else 0
-                    high_energy = np.mean(magnitude[high_mask]) if np.any(high_mask) else 0
+                    if self.tempo.locked:
+                        # Beat regolari dalla fase stimata invece che dai singoli colpi
+                        beat = int(self.tempo.position(t_hop))
+                        if last_beat is not None and beat != last_beat: beat_pending = True
+                        last_beat = beat
+                    else:
+                        last_beat = None
+                        if onset: beat_pending = True
                     
-                    # Normalizzazione visuale (valori empirici)
-                    b_val = min(255, int((bass_energy / 10000) * 255 * self.gain))
-                    m_val = min(255, int((mid_energy / 5000) * 255 * self.gain))
-                    h_val = min(255, int((high_energy / 2000) * 255 * self.gain))
+                    n_hops += 1
+                    if n_hops % emit_every: continue # La GUI non ha bisogno di un segnale per hop
                     
-                    # 3. Beat Detection (Semplice)
-                    is_beat = False
-                    self.bass_history.append(bass_energy)
-                    if len(self.bass_history) > 20: # ~0.5 secondi di storia
-                        self.bass_history.pop(0)
-                        
-                    avg_energy = np.mean(self.bass_history)
-                    
-                    # Se l'energia attuale supera la media * threshold e c'è abbastanza volume
-                    if bass_energy > avg_energy * self.beat_threshold and bass_energy > 2000:
-                        # Debounce (max 1 beat ogni 0.25s)
-                        if (time.time() - self.last_beat_time) > 0.25:
-                            is_beat = True
-                            self.last_beat_time = time.time()
-                    
-                    self.data_processed.emit(is_beat, vol_norm, [b_val, m_val, h_val])
+                    vol_norm = min(255, int((rms / 1000) * 255 * self.gain))
+                    self.data_processed.emit(beat_pending, vol_norm, bands.levels)
+                    beat_pending = False
                     
                 except Exception as e:
                     print(f"Audio processing error: {e}")
@@ -118,6 +301,7 @@ class AudioReactor(QThread):
             if stream:
                 stream.stop_stream()
                 stream.close()
+            if self.band_analyzer: self.band_analyzer.reset() # Canali mappati a zero quando l'ascolto si ferma
 
     def stop(self):
         self.running = False
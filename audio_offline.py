@@ -0,0 +1,246 @@
+import os
+import time
+import wave
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from audio_engine import SpectrumAnalyzer
+from audio_bands import BandAnalyzer
+from beat_tracker import OnsetDetector, tempo_prior, estimate_period
+
+ANALYSIS_DIR = "analysis"
+ANALYSIS_VERSION = 1 # Da incrementare se cambia l'analisi: le cache vecchie vengono ignorate
+
+def file_hash(path):
+    """SHA-256 del contenuto del file (chiave della cache)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_wav(path):
+    """Legge un WAV PCM (8/16/24/32 bit) come int16 mono. Ritorna (campioni, rate)."""
+    with wave.open(path, "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.int32) - 128) << 8
+    elif width == 2:
+        data = np.frombuffer(raw, dtype="<i2").astype(np.int32)
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        data = ((b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8) >> 16 # Segno dal byte alto
+    elif width == 4:
+        data = np.frombuffer(raw, dtype="<i4") >> 16
+    else:
+        raise ValueError(f"WAV a {width * 8} bit non supportato")
+    data = data.reshape(-1, channels).mean(axis=1) if channels > 1 else data
+    return data.astype(np.int16), rate
+
+def _analyze_segment(task):
+    """
+    Worker: stessa pipeline per hop di AudioReactor (finestra scorrevole, flusso spettrale, energie
+    delle bande) su un tratto di file. I primi 'skip' hop servono solo a riempire la finestra.
+    """
+    samples, rate, chunk, hop, skip = task
+    analyzer = SpectrumAnalyzer(chunk, rate, hop)
+    frame_rate = rate / hop
+    onsets = OnsetDetector(len(analyzer.magnitude), frame_rate, low_bins=analyzer.bands[0][1])
+    bands = BandAnalyzer(chunk, rate, frame_rate)
+    n = len(samples) // hop
+    flux = np.zeros(n, dtype=np.float32)
+    low_flux = np.zeros(n, dtype=np.float32)
+    rms = np.zeros(n, dtype=np.float32)
+    energies = np.zeros((n, len(bands.starts)), dtype=np.float32)
+    for i in range(n):
+        rms[i], _ = analyzer.process(samples[i * hop:(i + 1) * hop])
+        flux[i] = onsets.spectral_flux(analyzer.magnitude)
+        low_flux[i] = onsets.low_flux
+        energies[i] = bands.band_energies(analyzer.magnitude)
+    return flux[skip:], low_flux[skip:], rms[skip:], energies[skip:]
+
+def track_beats(strength, period, tightness=100.0):
+    """
+    Griglia dei beat per programmazione dinamica: ogni beat somma la forza degli onset e il
+    miglior beat precedente, penalizzato quanto più la distanza si allontana dal periodo.
+    Ritorna gli indici di hop dei beat.
+    """
+    n = len(strength)
+    lo, hi = max(1, int(round(period / 2))), int(round(period * 2))
+    if n <= hi: return np.zeros(0, dtype=np.intp)
+    offsets = np.arange(lo, hi + 1)
+    penalty = -tightness * np.log(offsets / period) ** 2
+    score = strength / (strength.std() or 1.0)
+    back = np.full(n, -1, dtype=np.intp)
+    for t in range(lo, n):
+        prev = t - offsets
+        valid = prev >= 0
+        cand = score[prev[valid]] + penalty[valid]
+        k = int(np.argmax(cand))
+        if cand[k] > 0:
+            score[t] += cand[k]
+            back[t] = prev[valid][k]
+
+    t = n - hi + int(np.argmax(score[n - hi:])) # Ultimo beat: il migliore nell'ultimo periodo abbondante
+    beats = []
+    while t >= 0:
+        beats.append(t)
+        t = back[t]
+    return np.array(beats[::-1], dtype=np.intp)
+
+class AudioAnalysis:
+    """Risultato dell'analisi di un file: griglia dei beat, onset (secondi) e envelope delle bande (uint8 per hop)."""
+    FIELDS = ("digest", "rate", "chunk", "hop", "duration", "bpm", "confidence",
+              "beats", "onsets", "envelopes", "band_centers")
+
+    def __init__(self, **fields):
+        for k in self.FIELDS: setattr(self, k, fields[k])
+
+    @property
+    def frame_rate(self):
+        return self.rate / self.hop
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, version=ANALYSIS_VERSION, **{k: getattr(self, k) for k in self.FIELDS})
+        os.replace(tmp, path) # Mai una cache scritta a metà
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            if int(z["version"]) != ANALYSIS_VERSION: raise ValueError("versione cache diversa")
+            fields = {k: z[k] for k in cls.FIELDS}
+        fields["digest"] = str(fields["digest"])
+        for k in ("rate", "chunk", "hop"): fields[k] = int(fields[k])
+        for k in ("duration", "bpm", "confidence"): fields[k] = float(fields[k])
+        return cls(**fields)
+
+def cache_path(digest, chunk, hop, segment_s, onset_min_rms, prior_bpm, cache_dir=ANALYSIS_DIR):
+    """File di cache: hash del file, versione e tutti i parametri da cui dipende il risultato."""
+    params = f"v{ANALYSIS_VERSION}_{chunk}_{hop}_{segment_s:g}_{onset_min_rms:g}_{prior_bpm:g}"
+    return os.path.join(cache_dir, f"{digest[:32]}_{params}.npz")
+
+def analyze_file(path, workers=None, cache_dir=ANALYSIS_DIR, chunk=1024, hop=256, segment_s=30.0,
+                 onset_min_rms=150, prior_bpm=120.0):
+    """
+    Analisi offline di un WAV, molto più veloce del tempo reale: il file è diviso in tratti
+    analizzati in parallelo su più processi (con una finestra di pre-roll, così i risultati
+    coincidono con l'analisi continua); soglie degli onset, envelope e griglia dei beat si
+    calcolano poi in sequenza sulle curve unite. Il risultato è in cache per hash del file.
+    """
+    digest = file_hash(path)
+    cached = cache_path(digest, chunk, hop, segment_s, onset_min_rms, prior_bpm, cache_dir)
+    if os.path.exists(cached):
+        try:
+            return AudioAnalysis.load(cached)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[AUDIO] Cache analisi non valida, ricalcolo: {e}")
+
+    t0 = time.perf_counter()
+    samples, rate = load_wav(path)
+    frame_rate = rate / hop
+    n_hops = len(samples) // hop
+    seg_hops = max(1, int(segment_s * frame_rate))
+    preroll = -(-chunk // hop) + 1 # Hop per riempire la finestra e avere lo spettro precedente
+    tasks = []
+    for h0 in range(0, n_hops, seg_hops):
+        skip = min(h0, preroll)
+        h1 = min(n_hops, h0 + seg_hops)
+        tasks.append((samples[(h0 - skip) * hop:h1 * hop], rate, chunk, hop, skip))
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1:
+        # spawn: i processi figli non ereditano i thread (DMX, MIDI) del processo principale
+        with ProcessPoolExecutor(min(workers, len(tasks)), mp_context=multiprocessing.get_context("spawn")) as ex:
+            parts = list(ex.map(_analyze_segment, tasks))
+    else:
+        parts = [_analyze_segment(t) for t in tasks]
+    if not parts: raise ValueError("File audio vuoto")
+    flux, low_flux, rms, energies = (np.concatenate(p) for p in zip(*parts))
+
+    # Istante di ogni hop: fine dell'hop meno mezza finestra (come il ritardo compensato dal vivo)
+    hop_times = (np.arange(1, len(flux) + 1) * hop - chunk / 2) / rate
+
+    picker = OnsetDetector(1, frame_rate)
+    onset_hops = [i - 1 for i, f in enumerate(flux.tolist()) if picker.pick(f) and rms[i - 1] > onset_min_rms]
+
+    bands = BandAnalyzer(chunk, rate, frame_rate)
+    envelopes = np.zeros(energies.shape, dtype=np.uint8)
+    for i in range(len(energies)):
+        np.multiply(bands.follow(energies[i]), 255, out=envelopes[i], casting="unsafe")
+
+    period, confidence = estimate_period(flux.astype(np.float64), tempo_prior(len(flux), frame_rate, prior_bpm))
+    # I bassi decidono la fase (cassa in battere, non charleston in levare); il flusso totale aiuta senza bassi
+    strength = low_flux / (low_flux.std() or 1.0) + 0.25 * flux / (flux.std() or 1.0)
+    beat_hops = track_beats(strength, period) if period else np.zeros(0, dtype=np.intp)
+
+    analysis = AudioAnalysis(
+        digest=digest, rate=rate, chunk=chunk, hop=hop, duration=len(samples) / rate,
+        bpm=60.0 * frame_rate / period if period else 0.0, confidence=confidence,
+        beats=hop_times[beat_hops], onsets=hop_times[np.array(onset_hops, dtype=np.intp)],
+        envelopes=envelopes, band_centers=np.array(bands.centers))
+    print(f"[AUDIO] Analisi {os.path.basename(path)}: {analysis.duration:.0f}s in {time.perf_counter() - t0:.1f}s, "
+          f"{analysis.bpm:.1f} BPM, {len(analysis.beats)} beat, {len(analysis.onsets)} onset")
+    try:
+        analysis.save(cached)
+    except OSError as e:
+        print(f"[AUDIO] Errore salvataggio cache analisi: {e}")
+    return analysis
+
+class BeatGrid:
+    """
+    Orologio di playback sulla griglia pre-analizzata di una traccia: la posizione in quarti
+    si interpola tra i beat in cache, senza analisi durante lo show. La posizione nella traccia
+    viene dal MIDI Time Code se presente (traccia suonata da un player esterno), altrimenti
+    dall'istante di start(). Stessa interfaccia di lettura di MidiClock (locked, bpm, beats).
+    """
+    def __init__(self, analysis, timecode=None, offset_s=0.0, beats_per_bar=4):
+        self.analysis = analysis
+        self.times = np.asarray(analysis.beats, dtype=np.float64)
+        self.timecode = timecode
+        self.offset_s = offset_s # Timecode corrispondente all'inizio della traccia
+        self.beats_per_bar = beats_per_bar
+        self._start_ns = None
+
+    def start(self, t_ns=None, offset_s=0.0):
+        """Avvia la traccia (offset_s = punto di partenza nella traccia)."""
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        self._start_ns = t_ns - int(offset_s * 1e9)
+
+    def stop(self):
+        self._start_ns = None
+
+    @property
+    def running(self):
+        return self._start_ns is not None or bool(self.timecode and self.timecode.running)
+
+    @property
+    def locked(self):
+        return len(self.times) >= 2 and self.running
+
+    @property
+    def bpm(self):
+        return self.analysis.bpm
+
+    def seconds(self, t_ns=None):
+        """Posizione nella traccia in secondi."""
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        if self.timecode and self.timecode.running: return self.timecode.seconds(t_ns) - self.offset_s
+        if self._start_ns is None: return 0.0
+        return (t_ns - self._start_ns) / 1e9
+
+    def beats(self, t_ns=None):
+        """Posizione in quarti: interpolata tra i beat della griglia, estrapolata prima del primo e dopo l'ultimo."""
+        times = self.times
+        s = self.seconds(t_ns)
+        i = int(np.searchsorted(times, s, side="right")) - 1
+        if i < 0: return float((s - times[0]) / (times[1] - times[0]))
+        if i >= len(times) - 1: return float(i + (s - times[-1]) / (times[-1] - times[-2]))
+        return float(i + (s - times[i]) / (times[i + 1] - times[i]))
+
+    def bars(self, t_ns=None):
+        return self.beats(t_ns) / self.beats_per_bar
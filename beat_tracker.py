@@ -0,0 +1,216 @@
+import time
+import numpy as np
+
+MIN_BPM = 60.0
+MAX_BPM = 200.0
+
+def tempo_prior(n, frame_rate, prior_bpm=120.0, min_bpm=MIN_BPM, max_bpm=MAX_BPM, width=0.6):
+    """Peso log-gaussiano (in ottave attorno a prior_bpm) per ogni lag, zero fuori da min_bpm..max_bpm."""
+    lags = np.arange(n, dtype=np.float64)
+    lag_bpm = np.divide(60.0 * frame_rate, lags, out=np.zeros(n), where=lags > 0)
+    valid = (lag_bpm >= min_bpm) & (lag_bpm <= max_bpm)
+    return np.where(valid, np.exp(-0.5 * (np.log2(np.maximum(lag_bpm, 1e-9) / prior_bpm) / width) ** 2), 0.0)
+
+def estimate_period(env, prior):
+    """
+    Periodo del beat (in hop, con interpolazione parabolica) dall'autocorrelazione della curva
+    di onset 'env' pesata da 'prior'. Ritorna (periodo, confidenza) o (None, 0.0).
+    """
+    n = len(env)
+    env = env - env.mean()
+    fft_n = 1 << int(np.ceil(np.log2(2 * n))) # Zero padding: autocorrelazione lineare
+    spec = np.fft.rfft(env, fft_n)
+    acf = np.fft.irfft(spec.real ** 2 + spec.imag ** 2, fft_n)[:n]
+    if acf[0] <= 0: return None, 0.0
+    acf /= acf[0]
+    acf /= np.maximum(1.0, n - np.arange(n)) / n # Correzione per la sovrapposizione decrescente
+    
+    score = acf * prior[:n]
+    lag = int(np.argmax(score))
+    if score[lag] <= 0 or lag < 2 or lag >= n - 1: return None, 0.0
+    # Interpolazione parabolica del picco: risoluzione sotto l'hop
+    a, b, c = acf[lag - 1], acf[lag], acf[lag + 1]
+    den = a - 2 * b + c
+    return lag + (0.5 * (a - c) / den if den < 0 else 0.0), float(b)
+
+class OnsetDetector:
+    """
+    Onset detection a flusso spettrale sul modulo già calcolato da SpectrumAnalyzer.
+    Il flusso è la somma degli incrementi positivi dello spettro compresso (log) tra due hop;
+    un onset è un picco che supera la media mobile del flusso di 'k' deviazioni standard.
+    Il flusso dei primi 'low_bins' bin (cassa/basso) è tenuto anche a parte: serve a mettere
+    la fase sul colpo di cassa e non sui charleston in levare, che a pari tempo pesano di più.
+    Tutti i buffer sono preallocati: a ogni hop solo ufunc in place.
+    """
+    def __init__(self, n_bins, frame_rate, low_bins=0, compression=1.0, k=1.5, window_s=0.5, min_gap_s=0.06):
+        self.low_bins = low_bins
+        self.compression = compression # Compressione log1p(c * |X|): attenua i picchi dominanti
+        self.k = k
+        self.min_gap = max(1, int(min_gap_s * frame_rate)) # Hop minimi tra due onset
+        self._prev = np.zeros(n_bins, dtype=np.float32)
+        self._log = np.zeros(n_bins, dtype=np.float32)
+        self._diff = np.zeros(n_bins, dtype=np.float32)
+        self._hist = np.zeros(max(4, int(window_s * frame_rate)), dtype=np.float64)
+        self._pos = 0
+        self._since = self.min_gap
+        self._last = (0.0, 0.0) # Flusso degli ultimi due hop: onset sul massimo locale
+        self.flux = 0.0
+        self.low_flux = 0.0
+
+    def process(self, magnitude):
+        """Ritorna (flusso, onset) per l'hop corrente. L'onset viene segnalato con un hop di ritardo (picco)."""
+        flux = self.spectral_flux(magnitude)
+        return flux, self.pick(flux)
+
+    def spectral_flux(self, magnitude):
+        """Flusso spettrale dell'hop (aggiorna anche low_flux)."""
+        np.multiply(magnitude, self.compression, out=self._log)
+        np.log1p(self._log, out=self._log)
+        np.subtract(self._log, self._prev, out=self._diff)
+        np.maximum(self._diff, 0, out=self._diff)
+        self._prev, self._log = self._log, self._prev
+        flux = float(self._diff.sum())
+        self.low_flux = float(self._diff[:self.low_bins].sum())
+        self.flux = flux
+        return flux
+
+    def pick(self, flux):
+        """Soglia adattiva e massimo locale: True se l'hop precedente era un onset."""
+        hist = self._hist
+        threshold = hist.mean() + self.k * hist.std()
+        prev2, prev = self._last
+        onset = prev > threshold and prev >= prev2 and prev > flux and self._since >= self.min_gap
+        self._since = 0 if onset else self._since + 1
+        
+        hist[self._pos] = flux
+        self._pos = (self._pos + 1) % len(hist)
+        self._last = (prev, flux)
+        return onset
+
+class TempoTracker:
+    """
+    Stima continua di tempo e fase dal flusso spettrale (onset strength).
+    Ogni 'update_s' secondi l'autocorrelazione della curva di onset (via FFT, pesata da un
+    prior log-gaussiano attorno a 'prior_bpm') dà il periodo; un filtro a pettine su quel
+    periodo dà la fase dell'ultimo beat. La fase pubblicata viene corretta gradualmente
+    (come un PLL), così i quarti contati non saltano a ogni nuova stima.
+    Stessa interfaccia di lettura di MidiClock (locked, bpm, beats): il thread audio scrive,
+    il thread DMX legge la tupla di stato senza lock.
+    """
+    LOST_NS = 2_000_000_000 # Senza onset per 2 secondi (silenzio) il tempo non è più agganciato
+
+    def __init__(self, history_s=6.0, update_s=0.5, prior_bpm=120.0, min_confidence=0.15,
+                 phase_alpha=0.3, tempo_alpha=0.3, beats_per_bar=4):
+        self.history_s = history_s
+        self.update_s = update_s
+        self.prior_bpm = prior_bpm
+        self.min_confidence = min_confidence
+        self.phase_alpha = phase_alpha
+        self.tempo_alpha = tempo_alpha
+        self.beats_per_bar = beats_per_bar
+        self.configure(44100 / 256)
+
+    def configure(self, frame_rate, latency_s=0.0):
+        """Frequenza degli hop (Hz) e ritardo fisso dell'analisi rispetto al suono (es. mezza finestra)."""
+        self.frame_rate = frame_rate
+        self.latency_ns = int(latency_s * 1e9)
+        size = int(self.history_s * frame_rate)
+        self._env = np.zeros(size, dtype=np.float64) # Ring della curva di onset
+        self._accent = np.zeros(size, dtype=np.float64) # Ring del flusso dei bassi (fase)
+        self._pos = 0
+        self._count = 0
+        self._next_update = int(self.update_s * frame_rate)
+        self._prior = tempo_prior(size, frame_rate, self.prior_bpm)
+        self.reset()
+
+    def reset(self):
+        self._env[:] = 0
+        self._accent[:] = 0
+        self._count = 0
+        self._last_onset = 0
+        self._last_t = 0
+        self.confidence = 0.0
+        self._state = (None, 0.0, None) # (istante di riferimento ns, quarti a quell'istante, periodo ns)
+        self._last_beats = 0.0
+
+    # --- INGRESSO (thread audio) ---
+    def push(self, strength, onset, t_ns, accent=0.0):
+        """
+        Un valore della curva di onset per hop; t_ns = istante (perf_counter_ns) della fine dell'hop.
+        'accent' (flusso dei bassi) decide dove cade il beat; senza, la fase segue la curva di onset.
+        """
+        t_ns -= self.latency_ns
+        env = self._env
+        env[self._pos] = strength
+        self._accent[self._pos] = accent
+        self._pos = (self._pos + 1) % len(env)
+        self._count += 1
+        self._last_t = t_ns
+        if onset: self._last_onset = t_ns
+        if self._count >= self._next_update:
+            self._next_update = self._count + max(1, int(self.update_s * self.frame_rate))
+            if self._count >= len(env) // 2: self._estimate(t_ns)
+
+    def _estimate(self, t_ns):
+        n = min(self._count, len(self._env))
+        env = np.roll(self._env, -self._pos)[-n:] # Ordine cronologico, il più recente in coda
+        period, confidence = estimate_period(env, self._prior)
+        if period is None: return
+        self.confidence = confidence
+        if confidence < self.min_confidence: return
+        
+        # Filtro a pettine: fase dell'ultimo beat (hop fa) che somma più energia sui beat precedenti
+        accent = np.roll(self._accent, -self._pos)[-n:]
+        env = accent if accent.any() else env
+        env = env - env.mean()
+        offsets = np.arange(int(period))
+        k = np.arange(max(1, int(n // period)))
+        idx = (n - 1 - offsets[:, None] - np.rint(k * period)[None, :]).astype(np.intp)
+        idx[idx < 0] = 0
+        weights = np.power(0.8, k) # I beat più recenti contano di più
+        phase = int(np.argmax(env[idx] @ weights))
+        
+        hop_ns = 1e9 / self.frame_rate
+        measured_ns = period * hop_ns
+        beat_ns = t_ns - phase * hop_ns # Ultimo beat misurato
+        t_ref, beats_ref, period_ns = self._state
+        if t_ref is None:
+            self._state = (beat_ns, 0.0, measured_ns)
+            return
+        
+        if abs(measured_ns - period_ns) > 0.08 * period_ns: # Cambio di tempo netto: niente filtro
+            new_period = measured_ns
+        else:
+            new_period = period_ns + self.tempo_alpha * (measured_ns - period_ns)
+        current = beats_ref + (t_ns - t_ref) / period_ns
+        measured_phase = (t_ns - beat_ns) / measured_ns
+        err = (measured_phase - current + 0.5) % 1.0 - 0.5 # Errore di fase in [-0.5, 0.5) quarti
+        self._state = (t_ns, current + self.phase_alpha * err, new_period)
+
+    # --- LETTURA (qualunque thread) ---
+    @property
+    def locked(self):
+        return self._state[2] is not None and time.perf_counter_ns() - self._last_onset < self.LOST_NS
+
+    @property
+    def bpm(self):
+        period = self._state[2]
+        return 60e9 / period if period else 0.0
+
+    def position(self, t_ns):
+        """Posizione in quarti all'istante t_ns senza la protezione di monotonia (es. dal thread audio)."""
+        t_ref, beats_ref, period = self._state
+        if period is None: return 0.0
+        return beats_ref + (t_ns - t_ref) / period
+
+    def beats(self, t_ns=None):
+        """Posizione in quarti all'istante t_ns (estrapolata dall'ultima stima, mai all'indietro)."""
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        beats = self.position(t_ns)
+        if beats < self._last_beats and self._last_beats - beats < 0.25:
+            beats = self._last_beats # Correzioni di fase all'indietro: si attende invece di tornare indietro
+        self._last_beats = beats
+        return beats
+
+    def bars(self, t_ns=None):
+        return self.beats(t_ns) / self.beats_per_bar
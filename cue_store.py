@@ -0,0 +1,400 @@
+import os
+import re
+import bisect
+import collections
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+from crossfade import CrossfadeKernel
+
+CUE_DIR = "cues"
+CUE_FORMAT = "delta-zlib"
+MAGIC = b"MDXC"
+INDEX_MAGIC = b"MDXI"
+VERSION = 2 # v2: timestamp per frame, blocchi indipendenti ai keyframe, indice per il seek
+KEYFRAME_INTERVAL = 250 # Un frame completo ogni ~10s a 40Hz (ripartenza veloce e robustezza)
+LEGACY_FRAME_US = 40_000 # Cue senza timestamp (v1 e formato inline): un frame per tick da 40ms
+MAX_PENDING_FRAMES = 1500 # Coda del writer: ~37s a 40Hz di disco bloccato prima di scartare frame
+
+CUE_INTERPOLATE = "interpolate"
+CUE_HOLD = "hold"
+
+REC_KEYFRAME = 0
+REC_DELTA = 1
+
+_HEADER = struct.Struct("<4sBI")   # magic, versione, dimensione frame (n_universi x 513)
+_RECORD_V1 = struct.Struct("<BH")  # tipo, numero di canali (delta) / 0 (keyframe)
+_RECORD = struct.Struct("<BHQ")    # tipo, numero di canali, timestamp in µs dall'inizio
+_INDEX_ENTRY = struct.Struct("<QIQ") # timestamp µs, numero frame, offset nel file del keyframe
+_FOOTER = struct.Struct("<QI4s")   # durata µs, numero di voci dell'indice, magic
+
+class CueWriter:
+    """
+    Registrazione cue su disco in streaming.
+    Ogni frame è un array di byte con il suo timestamp monotono; si salvano solo i canali cambiati
+    rispetto al frame precedente (indici uint16 + valori) con un keyframe completo a intervalli
+    regolari, il tutto compresso con zlib mentre si registra: in memoria resta solo il frame precedente.
+    Ogni keyframe apre un blocco deflate indipendente (Z_FULL_FLUSH): il suo offset finisce
+    nell'indice in coda al file e il lettore può saltarci direttamente.
+    write() copia solo il frame in una coda e ritorna subito (viene chiamato dal thread DMX):
+    compressione e scrittura su disco avvengono in un thread dedicato, come in SerialBackend.
+    """
+    def __init__(self, path, frame_size):
+        self.path = path
+        self.frame_size = frame_size
+        self.frames = 0
+        self.time_us = 0 # Timestamp dell'ultimo frame scritto
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(MAGIC, VERSION, frame_size))
+        self._offset = _HEADER.size
+        self._z = zlib.compressobj(6, zlib.DEFLATED, -15) # Deflate raw: si può ripartire da un keyframe
+        self._prev = np.zeros(frame_size, dtype=np.uint8)
+        self._t0 = None
+        self.index = []
+
+        self.frames_dropped = 0 # Frame scartati a coda piena (disco troppo lento)
+        self.write_errors = 0
+        self._queue = collections.deque()
+        self._ready = threading.Event()
+        self._closing = False
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+
+    def _write(self, data):
+        if data:
+            self._file.write(data)
+            self._offset += len(data)
+
+    def write(self, frame, t_ns=None):
+        """
+        Accoda un frame (array uint8, anche multi-dimensionale: viene appiattito).
+        t_ns: istante del frame (time.perf_counter_ns), di default adesso.
+        """
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        if len(self._queue) >= MAX_PENDING_FRAMES:
+            self.frames_dropped += 1
+            return
+        self._queue.append((np.array(frame, dtype=np.uint8).reshape(-1), t_ns)) # Copia: il chiamante riusa il buffer
+        self._ready.set()
+
+    def _writer_loop(self):
+        queue = self._queue
+        while True:
+            self._ready.wait(0.5)
+            self._ready.clear()
+            while queue:
+                frame, t_ns = queue.popleft()
+                if self.write_errors: continue # File non più scrivibile: la coda si svuota e basta
+                try:
+                    self._encode(frame, t_ns)
+                except (OSError, ValueError) as e:
+                    print(f"[CUE] Errore scrittura registrazione: {e}")
+                    self.write_errors += 1
+            if self._closing and not queue: return
+
+    def _encode(self, frame, t_ns):
+        if self._t0 is None: self._t0 = t_ns
+        self.time_us = max(self.time_us, (t_ns - self._t0) // 1000)
+        
+        frame = frame[:self.frame_size]
+        if len(frame) < self.frame_size: # Universi ridotti durante la registrazione
+            frame = np.concatenate([frame, np.zeros(self.frame_size - len(frame), dtype=np.uint8)])
+        if self.frames % KEYFRAME_INTERVAL == 0:
+            self._write(self._z.flush(zlib.Z_FULL_FLUSH)) # Il file resta leggibile fino all'ultimo keyframe
+            self.index.append((self.time_us, self.frames, self._offset))
+            record = _RECORD.pack(REC_KEYFRAME, 0, self.time_us) + frame.tobytes()
+        else:
+            changed = np.flatnonzero(frame != self._prev)
+            record = _RECORD.pack(REC_DELTA, len(changed), self.time_us) + changed.astype("<u2").tobytes() + frame[changed].tobytes()
+        np.copyto(self._prev, frame)
+        self._write(self._z.compress(record))
+        self.frames += 1
+
+    @property
+    def duration_us(self):
+        """Durata della cue: ultimo timestamp + un intervallo medio tra i frame."""
+        if self.frames < 2: return self.time_us
+        return self.time_us + self.time_us // (self.frames - 1)
+
+    def close(self):
+        """Scrive i frame ancora in coda, poi indice e footer."""
+        if self._file.closed: return
+        self._closing = True
+        self._ready.set()
+        self.thread.join()
+        self._write(self._z.flush())
+        for entry in self.index:
+            self._file.write(_INDEX_ENTRY.pack(*entry))
+        self._file.write(_FOOTER.pack(self.duration_us, len(self.index), INDEX_MAGIC))
+        self._file.close()
+
+class CueReader:
+    """
+    Decodifica incrementale di una cue registrata da CueWriter: un frame alla volta.
+    time_us è il timestamp dell'ultimo frame letto; seek() riparte dal keyframe precedente.
+    Legge anche i file v1 (senza timestamp: un frame ogni 40ms, seek solo per riavvolgimento).
+    """
+    CHUNK = 16384
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        magic, self.version, self.frame_size = _HEADER.unpack(self._file.read(_HEADER.size))
+        if magic != MAGIC or self.version not in (1, VERSION):
+            self._file.close()
+            raise ValueError(f"Formato cue non supportato: {path}")
+        self.frame = np.zeros(self.frame_size, dtype=np.uint8)
+        self._record = _RECORD if self.version >= 2 else _RECORD_V1
+        self.index = []
+        self.duration_us = None # Nota dal footer, o quando si arriva in fondo
+        self._end = self._file.seek(0, os.SEEK_END)
+        if self.version >= 2: self._read_index()
+        self.rewind()
+
+    def _read_index(self):
+        if self._end < _HEADER.size + _FOOTER.size: return
+        self._file.seek(self._end - _FOOTER.size)
+        duration, count, magic = _FOOTER.unpack(self._file.read(_FOOTER.size))
+        start = self._end - _FOOTER.size - count * _INDEX_ENTRY.size
+        if magic != INDEX_MAGIC or start < _HEADER.size: return # Registrazione interrotta: niente indice
+        self._file.seek(start)
+        raw = self._file.read(count * _INDEX_ENTRY.size)
+        self.index = [_INDEX_ENTRY.unpack_from(raw, i * _INDEX_ENTRY.size) for i in range(count)]
+        self._index_times = [e[0] for e in self.index]
+        self.duration_us = duration
+        self._end = start
+
+    def _restart(self, offset, position, time_us):
+        self._file.seek(offset)
+        self._z = zlib.decompressobj(-15 if self.version >= 2 else 15)
+        self._buf = bytearray()
+        self._pos = 0 # Inizio dei dati non ancora consumati in _buf
+        self._eof = False
+        self.position = position
+        self.time_us = time_us
+
+    def rewind(self):
+        self._restart(_HEADER.size, 0, 0)
+        self.frame.fill(0)
+
+    def seek(self, time_us):
+        """Posiziona la lettura sul keyframe più vicino prima di time_us (il successivo next_frame lo ritorna)."""
+        if not self.index:
+            self.rewind()
+            return
+        i = max(0, bisect.bisect_right(self._index_times, time_us) - 1)
+        t, position, offset = self.index[i]
+        self._restart(offset, position, t)
+
+    def next_keyframe_us(self, time_us):
+        """Tempo del primo keyframe indicizzato dopo time_us (None senza indice o oltre l'ultimo)."""
+        if not self.index: return None
+        i = bisect.bisect_right(self._index_times, time_us)
+        return self._index_times[i] if i < len(self._index_times) else None
+
+    def _fill(self, size):
+        while len(self._buf) - self._pos < size and not self._eof:
+            if self._pos > self.CHUNK * 4: # Compatta di tanto in tanto invece di a ogni frame
+                del self._buf[:self._pos]
+                self._pos = 0
+            chunk = self._file.read(min(self.CHUNK, self._end - self._file.tell()))
+            if chunk:
+                self._buf += self._z.decompress(chunk)
+            else:
+                self._buf += self._z.flush()
+                self._eof = True
+        return len(self._buf) - self._pos >= size
+
+    def next_frame(self):
+        """Frame successivo (vista sul buffer interno, valida fino alla prossima chiamata) o None a fine cue."""
+        rec = self._record
+        if not self._fill(rec.size): return self._at_end()
+        fields = rec.unpack_from(self._buf, self._pos)
+        kind, count = fields[0], fields[1]
+        size = self.frame_size if kind == REC_KEYFRAME else count * 3
+        if not self._fill(rec.size + size): return self._at_end()
+        start = self._pos + rec.size
+        body = bytes(self._buf[start:start + size])
+        if kind == REC_KEYFRAME:
+            self.frame[:] = np.frombuffer(body, dtype=np.uint8)
+        elif count:
+            index = np.frombuffer(body, dtype="<u2", count=count)
+            self.frame[index] = np.frombuffer(body, dtype=np.uint8, offset=count * 2)
+        self._pos = start + size
+        self.time_us = fields[2] if len(fields) > 2 else self.position * LEGACY_FRAME_US
+        self.position += 1
+        return self.frame
+
+    def _at_end(self):
+        if self.duration_us is None and self.position:
+            last = self.time_us
+            self.duration_us = last + (last // (self.position - 1) if self.position > 1 else LEGACY_FRAME_US)
+        return None
+
+    def close(self):
+        self._file.close()
+
+class FrameListReader:
+    """Stessa interfaccia di CueReader per le cue storiche salvate inline ('data': lista di frame)."""
+    path = None
+
+    def __init__(self, frames):
+        self._frames = frames
+        self.frame_size = max((len(f) for f in frames), default=0)
+        self.frame = np.zeros(self.frame_size, dtype=np.uint8)
+        self.duration_us = len(frames) * LEGACY_FRAME_US
+        self.rewind()
+
+    def rewind(self):
+        self.position = 0
+        self.time_us = 0
+
+    def seek(self, time_us):
+        self.position = max(0, min(len(self._frames), int(time_us // LEGACY_FRAME_US)))
+        self.time_us = self.position * LEGACY_FRAME_US
+
+    def next_keyframe_us(self, time_us):
+        """Ogni frame è completo: il seek è diretto su qualunque frame."""
+        t = (int(time_us) // LEGACY_FRAME_US + 1) * LEGACY_FRAME_US
+        return t if t < self.duration_us else None
+
+    def next_frame(self):
+        if self.position >= len(self._frames): return None
+        data = self._frames[self.position]
+        self.frame.fill(0)
+        self.frame[:len(data)] = data
+        self.time_us = self.position * LEGACY_FRAME_US
+        self.position += 1
+        return self.frame
+
+    def close(self):
+        pass
+
+class CuePlayer:
+    """
+    Playback a tempo di una cue: il frame in uscita si ricava dal tempo trascorso (non dal numero
+    di tick), quindi ritardi o salti del chiamante non fanno derivare la velocità.
+    Tra due campioni interpola (crossfade) o tiene il precedente; rate scala il tempo
+    (0.5 = metà velocità, 2.0 = doppia), seek() salta a una posizione in µs.
+    Thread-safe: render() gira nel thread DMX, i comandi arrivano dalla GUI/MIDI.
+    """
+    def __init__(self, reader, mode=CUE_INTERPOLATE, rate=1.0, loop=True):
+        self.reader = reader
+        self.mode = mode
+        self.loop = loop
+        size = reader.frame_size
+        self._a = np.zeros(size, dtype=np.uint8) # Campione corrente...
+        self._b = np.zeros(size, dtype=np.uint8) # ...e successivo
+        self._t_a = None
+        self._t_b = None
+        self.out = np.zeros(size, dtype=np.uint8)
+        self.kernel = CrossfadeKernel()
+        self._lock = threading.Lock()
+        
+        self.rate = max(0.0, float(rate))
+        self._anchor_ns = None # Istante a cui corrisponde _anchor_us (None = non ancora partita)
+        self._anchor_us = 0
+        self.closed = False
+
+    def position_us(self, now_ns=None):
+        if self._anchor_ns is None: return self._anchor_us
+        if now_ns is None: now_ns = time.perf_counter_ns()
+        return self._anchor_us + (now_ns - self._anchor_ns) / 1000 * self.rate
+
+    def _reanchor(self, position_us, now_ns=None):
+        if now_ns is None: now_ns = time.perf_counter_ns()
+        self._anchor_us = position_us
+        if self._anchor_ns is not None: self._anchor_ns = now_ns
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._reanchor(self.position_us())
+            self.rate = max(0.0, float(rate))
+
+    def seek(self, position_us):
+        with self._lock:
+            self._reanchor(max(0, position_us))
+            self._t_a = None # Il prossimo render riparte dal keyframe indicizzato, senza decodificare i delta intermedi
+
+    def _load(self, buf):
+        frame = self.reader.next_frame()
+        if frame is None: return None
+        n = min(len(buf), len(frame))
+        buf[:n] = frame[:n]
+        return self.reader.time_us
+
+    def _skips_keyframe(self, pos):
+        """True se pos è oltre un keyframe successivo ai campioni caricati: conviene ripartire dall'indice."""
+        kf = self.reader.next_keyframe_us(self._t_b if self._t_b is not None else self._t_a)
+        return kf is not None and pos >= kf
+
+    def _reposition(self, pos):
+        self.reader.seek(pos)
+        self._t_a = self._load(self._a)
+        self._t_b = self._load(self._b)
+
+    def render(self, now_ns):
+        """Frame (array riutilizzato) per l'istante now_ns, o None se la cue è vuota/finita."""
+        with self._lock:
+            if self.closed: return None
+            if self._anchor_ns is None: self._anchor_ns = now_ns
+            pos = self.position_us(now_ns)
+            duration = self.reader.duration_us # None finché non si arriva in fondo (file senza indice)
+            if duration is not None and pos >= duration:
+                if not self.loop or duration <= 0: return None
+                pos %= duration
+                self._reanchor(pos, now_ns)
+            
+            if self._t_a is None or pos < self._t_a or self._skips_keyframe(pos):
+                self._reposition(pos)
+                if self._t_a is None: return None
+            
+            # Avanza fino ai due campioni che racchiudono pos (di solito zero o un passo)
+            while self._t_b is not None and self._t_b <= pos:
+                self._a, self._b = self._b, self._a
+                self._t_a = self._t_b
+                self._t_b = self._load(self._b)
+            
+            if self.mode == CUE_INTERPOLATE and self._t_b is not None and self._t_b > self._t_a:
+                prog = (pos - self._t_a) / (self._t_b - self._t_a)
+                return self.kernel.blend(self._a, self._b, prog, self.out)
+            np.copyto(self.out, self._a)
+            return self.out
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self.reader.close()
+
+def open_cue(entry):
+    """Reader per una voce di data_store['cues'] (file .mdxc o formato inline storico), o None."""
+    if "file" in entry: return CueReader(entry["file"])
+    frames = entry.get("data")
+    return FrameListReader(frames) if frames else None
+
+def cue_path(name, base_dir=CUE_DIR):
+    safe = re.sub(r"[^\w\-]+", "_", name).strip("_") or "cue"
+    return os.path.join(base_dir, f"{safe}_{int(time.time())}.mdxc")
+
+def finalize_recording(writer, name, base_dir=CUE_DIR):
+    """Chiude la registrazione, sposta il file sul nome definitivo e ritorna la voce per data_store['cues']."""
+    writer.close()
+    path = cue_path(name, base_dir)
+    os.replace(writer.path, path)
+    return {"file": path, "format": CUE_FORMAT, "frames": writer.frames, "frame_size": writer.frame_size,
+            "duration_ms": writer.duration_us // 1000}
+
+def discard_recording(writer):
+    writer.close()
+    try: os.remove(writer.path)
+    except OSError: pass
+
+def delete_cue_file(entry):
+    """Rimuove il file associato a una cue (le cue storiche con 'data' inline non hanno file)."""
+    path = entry.get("file") if isinstance(entry, dict) else None
+    if path:
+        try: os.remove(path)
+        except OSError: pass
@@ -3,113 +3,807 @@ import socket
 import threading
 import time
 import struct
+import uuid
+import numpy as np
+from artnet_discovery import ArtNetDiscovery
+from latency_trace import LatencyTracer
 
-class DMXController:
+ARTNET_PORT = 6454
+ARTDMX_HEADER_SIZE = 18
+ARTDMX_PACKET_SIZE = ARTDMX_HEADER_SIZE + 512
+ARTDMX_SEQUENCE_OFFSET = 12
+
+# sACN / E1.31 (ANSI E1.31-2018)
+SACN_PORT = 5568
+SACN_PACKET_SIZE = 638
+SACN_PRIORITY_OFFSET = 108
+SACN_SEQUENCE_OFFSET = 111
+SACN_UNIVERSE_OFFSET = 113
+SACN_DMX_OFFSET = 125 # Start code + 512 canali
+SACN_DEFAULT_PRIORITY = 100
+
+# Enttec DMX USB Pro: messaggio "Output Only Send DMX Packet Request" (label 6)
+ENTTEC_PRO_SOM = 0x7E
+ENTTEC_PRO_EOM = 0xE7
+ENTTEC_PRO_SEND_DMX = 6
+
+# Politiche di merge dei layer
+MERGE_HTP = "htp"            # Highest Takes Precedence: vince il valore più alto
+MERGE_LTP = "ltp"            # Latest Takes Precedence: vince l'ultima modifica, del layer o dei layer sotto (0 = rilascio)
+MERGE_OVERRIDE = "override"  # Sovrascrive i layer a priorità inferiore dove il valore è > 0
+
+CHANNELS_PER_UNIVERSE = 512
+MAX_UNIVERSES = 64
+
+def split_address(addr):
+    """
+    Converte un indirizzo assoluto (1-based) in (universo, canale).
+    Indirizzi 1-512 = universo 0, 513-1024 = universo 1, ecc. (compatibile con i dati esistenti).
+    Accetta anche coppie (universo, canale) / [universo, canale] già separate.
+    """
+    if isinstance(addr, (tuple, list)):
+        return int(addr[0]), int(addr[1])
+    uni, ch = divmod(int(addr) - 1, CHANNELS_PER_UNIVERSE)
+    return uni, ch + 1
+
+def join_address(universe, channel):
+    """Converte (universo, canale 1-512) nell'indirizzo assoluto."""
+    return int(universe) * CHANNELS_PER_UNIVERSE + int(channel)
+
+def frame_index(addr):
+    """Posizione di un indirizzo in un buffer di frame consecutivi da 513 byte (start code incluso)."""
+    uni, ch = split_address(addr)
+    return uni * 513 + ch
+
+class MergeEngine:
     """
-    Gestisce l'output DMX supportando sia USB-SERIAL (Enttec/OpenDMX) che ART-NET (Ethernet/Wifi).
+    Merge vettoriale dei layer DMX.
+    Tutti i layer di tutti gli universi vivono in un unico array NumPy contiguo
+    (n_layer x n_universi x 513), ordinato per priorità: il frame di tutti gli universi
+    si calcola in un solo passaggio con poche operazioni vettoriali.
     """
-    def __init__(self):
-        # Buffer Dati
-        self.output_frame = bytearray([0] * 513)
-        self.live_buffer = bytearray([0] * 513)
-        self.scene_buffer = bytearray([0] * 513)
-        self.chase_buffer = bytearray([0] * 513)
-        self.cue_buffer = bytearray([0] * 513)
+    def __init__(self, size=513, universes=1):
+        self.size = size
+        self.universes = universes
+        self.layers = [] # [(nome, politica, priorità)] in ordine di priorità crescente
+        self.index = {}
+        self.stack = np.zeros((0, universes, size), dtype=np.uint8)
         
-        # Stato Hardware
-        self.mode = "serial" # 'serial' o 'artnet'
-        self.running = True
+        # Stato per LTP, per layer: ultimo valore visto, ultimo risultato dei layer sotto e canali posseduti
+        self._alloc_ltp()
+        self._alloc_scratch()
+        self._plan = []
+        self._lock = threading.Lock() # Protegge la riallocazione dello stack durante il merge
+
+    def add_layer(self, name, policy=MERGE_HTP, priority=0):
+        """Aggiunge un layer (o ne aggiorna politica/priorità) preservandone il contenuto."""
+        if policy not in (MERGE_HTP, MERGE_LTP, MERGE_OVERRIDE):
+            raise ValueError(f"Politica di merge sconosciuta: {policy}")
+        layers = [l for l in self.layers if l[0] != name] + [(name, policy, priority)]
+        layers.sort(key=lambda l: l[2]) # sort stabile: a parità di priorità conta l'ordine di inserimento
+        self._rebuild(layers)
+
+    def remove_layer(self, name):
+        if name not in self.index: return
+        self._rebuild([l for l in self.layers if l[0] != name])
+
+    def set_universes(self, count):
+        """Cambia il numero di universi conservando il contenuto degli universi che restano."""
+        count = max(1, min(MAX_UNIVERSES, int(count)))
+        if count == self.universes: return
+        self._rebuild(self.layers, count)
+
+    def _alloc_scratch(self):
+        shape = (self.universes, self.size)
+        self._changed = np.zeros(shape, dtype=bool)
+        self._mask = np.zeros(shape, dtype=bool)
+
+    def _alloc_ltp(self):
+        self._prev = np.zeros_like(self.stack)
+        self._below = np.zeros_like(self.stack)
+        self._owns = np.zeros(self.stack.shape, dtype=bool)
+
+    def _rebuild(self, layers, universes=None):
+        """Rialloca lo stack per la nuova lista di layer, conservando il contenuto di quelli esistenti."""
+        with self._lock:
+            universes = universes or self.universes
+            keep = min(universes, self.universes)
+            stack = np.zeros((len(layers), universes, self.size), dtype=np.uint8)
+            for i, (n, _, _) in enumerate(layers):
+                if n in self.index: stack[i, :keep] = self.stack[self.index[n], :keep]
+            self.universes = universes
+            self._alloc_scratch()
+            self.layers = layers
+            self.index = {n: i for i, (n, _, _) in enumerate(layers)}
+            self.stack = stack
+            self._alloc_ltp()
+            self._build_plan()
+
+    def _build_plan(self):
+        """
+        Pre-compila la sequenza di operazioni del merge.
+        Layer HTP consecutivi (nell'ordine di priorità) diventano una sola slice dello stack,
+        ridotta con un unico np.max: nel caso standard (tutti HTP) il merge è una sola operazione.
+        """
+        plan = []
+        i = 0
+        while i < len(self.layers):
+            policy = self.layers[i][1]
+            if policy == MERGE_HTP:
+                j = i
+                while j < len(self.layers) and self.layers[j][1] == MERGE_HTP: j += 1
+                plan.append((MERGE_HTP, i, j))
+                i = j
+            else:
+                plan.append((policy, i, i + 1))
+                i += 1
+        self._plan = plan
+
+    def layer(self, name, universe=None):
+        """Vista (scrivibile) sul buffer del layer: (n_universi x 513) o il singolo universo."""
+        frames = self.stack[self.index[name]]
+        return frames if universe is None else frames[universe]
+
+    def set_layer(self, name, data):
+        """
+        Copia 'data' (bytearray, bytes, lista) nel buffer del layer.
+        I dati sono letti come frame da 513 byte consecutivi a partire dall'universo 0:
+        un frame singolo (formato storico) aggiorna l'universo 0 e azzera gli altri.
+        """
+        flat = self.stack[self.index[name]].reshape(-1) # Vista: lo stack è C-contiguo
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            src = np.frombuffer(data, dtype=np.uint8)
+        else:
+            src = np.asarray(data, dtype=np.uint8).reshape(-1)
+        n = min(len(src), len(flat))
+        flat[:n] = src[:n]
+        flat[n:] = 0
+
+    def merge(self, out):
+        """Calcola i frame finali in 'out' (array uint8 n_universi x size)."""
+        with self._lock:
+            return self._merge(out)
+
+    def _merge(self, out):
+        if not self._plan:
+            out.fill(0)
+            return out
+        
+        first = True
+        for policy, a, b in self._plan:
+            if policy == MERGE_HTP:
+                if first:
+                    np.max(self.stack[a:b], axis=0, out=out)
+                else:
+                    np.maximum(out, self.stack[a:b].max(axis=0), out=out)
+            elif policy == MERGE_LTP:
+                if first: out.fill(0)
+                # Vince l'ultima modifica: del layer o del risultato dei layer sotto (a parità, il layer).
+                # Un canale del layer tornato a 0 è rilasciato e torna ai layer sotto
+                layer, owns = self.stack[a], self._owns[a]
+                np.not_equal(out, self._below[a], out=self._mask)
+                owns[self._mask] = False
+                self._below[a] = out
+                np.not_equal(layer, self._prev[a], out=self._changed)
+                owns[self._changed] = True
+                np.equal(layer, 0, out=self._mask)
+                owns[self._mask] = False
+                self._prev[a] = layer
+                np.copyto(out, layer, where=owns)
+            else: # MERGE_OVERRIDE
+                if first: out.fill(0)
+                layer = self.stack[a]
+                np.greater(layer, 0, out=self._mask)
+                np.copyto(out, layer, where=self._mask)
+            first = False
+        out[:, 0] = 0 # Start code DMX
+        return out
+
+class FrameScheduler:
+    """
+    Scheduler a scadenze fisse per il thread di output, basato su time.perf_counter_ns.
+    Le scadenze avanzano di un periodo esatto a prescindere dal tempo di lavoro del frame,
+    quindi la cadenza media non deriva col carico. Se un frame è in ritardo si recupera
+    (il successivo parte prima); oltre max_catchup periodi di ritardo i frame persi vengono saltati.
+    """
+    def __init__(self, rate_hz=40.0, max_catchup=2, spin_ns=1_000_000):
+        self.max_catchup = max_catchup
+        self.spin_ns = spin_ns # Ultimo tratto in attesa attiva: time.sleep non è preciso al ms (Windows)
+        self.set_rate(rate_hz)
+        self.reset_stats()
+        self._deadline = None
+
+    def set_rate(self, rate_hz):
+        rate_hz = max(1.0, min(1000.0, float(rate_hz)))
+        self.rate_hz = rate_hz
+        self.period_ns = int(1_000_000_000 / rate_hz)
+        self._deadline = None # Riallinea alla prossima attesa
+
+    def reset_stats(self):
+        self.frames = 0
+        self.late_frames = 0
+        self.skipped_frames = 0
+        self.last_jitter_ns = 0
+        self.max_jitter_ns = 0
+        self._jitter_sum_ns = 0
+
+    def wait(self):
+        """Attende la prossima scadenza e aggiorna le statistiche. Ritorna il timestamp della scadenza."""
+        now = time.perf_counter_ns()
+        if self._deadline is None:
+            self._deadline = now
+        deadline = self._deadline
+        
+        remaining = deadline - now
+        if remaining > self.spin_ns:
+            time.sleep((remaining - self.spin_ns) / 1e9)
+        while time.perf_counter_ns() < deadline:
+            time.sleep(0)
+        
+        now = time.perf_counter_ns()
+        jitter = now - deadline
+        self.frames += 1
+        self.last_jitter_ns = jitter
+        self._jitter_sum_ns += jitter
+        if jitter > self.max_jitter_ns: self.max_jitter_ns = jitter
+        
+        period = self.period_ns
+        if jitter > period:
+            self.late_frames += 1
+        if jitter > period * self.max_catchup:
+            # Troppo indietro: salta i frame persi invece di inviarli tutti di fila
+            missed = jitter // period
+            self.skipped_frames += missed
+            deadline += missed * period
+        self._deadline = deadline + period
+        return deadline
+
+    def stats(self):
+        """Statistiche di temporizzazione (tempi in microsecondi)."""
+        return {
+            "rate_hz": self.rate_hz,
+            "frames": self.frames,
+            "late_frames": self.late_frames,
+            "skipped_frames": self.skipped_frames,
+            "last_jitter_us": self.last_jitter_ns / 1000,
+            "avg_jitter_us": (self._jitter_sum_ns / self.frames / 1000) if self.frames else 0.0,
+            "max_jitter_us": self.max_jitter_ns / 1000,
+        }
+
+def _layer_buffer(name):
+    """
+    Espone un layer del MergeEngine come attributo compatibile col formato storico:
+    lettura = vista sull'universo 0, assegnazione = copia (uno o più frame da 513 byte).
+    """
+    def fget(self): return self.merger.layer(name, 0)
+    def fset(self, data): self.merger.set_layer(name, data)
+    return property(fget, fset)
+
+class SendPolicy:
+    """
+    Soppressione degli universi invariati per le uscite di rete.
+    Un universo viene inviato solo se il payload è cambiato rispetto all'ultimo invio
+    (confronto vettoriale con la copia precedente) oppure allo scadere del keep-alive
+    (~1s come raccomandato da Art-Net, entro il timeout di 2.5s di E1.31).
+    """
+    def __init__(self, packet_size, keepalive=1.0, enabled=True):
+        self.packet_size = packet_size
+        self.enabled = enabled
+        self.set_keepalive(keepalive)
+        self._alloc(0)
+        self.reset_stats()
+
+    def set_keepalive(self, seconds):
+        self.keepalive_ns = int(max(0.0, float(seconds)) * 1_000_000_000)
+
+    def reset_stats(self):
+        self.packets_sent = 0
+        self.packets_saved = 0
+
+    def _alloc(self, count):
+        self._prev = np.zeros((count, 513), dtype=np.uint8)
+        self._diff = np.zeros((count, 513), dtype=bool)
+        self._last_sent = np.zeros(count, dtype=np.int64) # 0 = mai inviato: il primo frame parte sempre
+        self._all = np.arange(count)
+
+    def select(self, frames):
+        """Indici degli universi da inviare in questo frame."""
+        count = len(frames)
+        if count != len(self._prev): self._alloc(count)
+        if not self.enabled:
+            self.packets_sent += count
+            return self._all
+        
+        now = time.perf_counter_ns()
+        np.not_equal(frames, self._prev, out=self._diff)
+        send = self._diff.any(axis=1)
+        send |= (now - self._last_sent) >= self.keepalive_ns
+        idx = np.flatnonzero(send)
+        
+        self._prev[idx] = frames[idx]
+        self._last_sent[idx] = now
+        self.packets_sent += len(idx)
+        self.packets_saved += count - len(idx)
+        return idx
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "keepalive_s": self.keepalive_ns / 1e9,
+            "packets_sent": self.packets_sent,
+            "packets_saved": self.packets_saved,
+            "bytes_saved": self.packets_saved * self.packet_size,
+        }
+
+class OutputBackend:
+    """
+    Interfaccia comune delle uscite DMX.
+    Il controller calcola un solo frame mergiato (n_universi x 513) e lo passa a send()
+    di ogni backend attivo; i backend preallocano i propri buffer e li riallocano da soli
+    (nel thread di invio) quando cambia il numero di universi.
+    """
+    kind = "base"
+
+    def send(self, frames):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+class SerialBackend(OutputBackend):
+    """
+    USB-SERIAL: una sola linea DMX, esce l'universo 0.
+    La scrittura (~22ms per 513 byte a 250 kbaud con Open DMX) avviene in un thread dedicato:
+    send() copia solo il frame in un doppio buffer e ritorna subito, così merge e uscite
+    di rete non aspettano mai la UART. Se il writer non ha ancora preso il frame precedente,
+    questo viene sostituito dal nuovo e contato come scartato.
+    protocol: "open" (Open DMX, break + 513 byte) o "pro" (Enttec DMX USB Pro, label 6:
+    il widget genera da sé break e temporizzazione).
+    """
+    kind = "serial"
+
+    def __init__(self, port, protocol="open"):
+        if protocol not in ("open", "pro"):
+            raise ValueError(f"Protocollo seriale sconosciuto: {protocol}")
+        self.port = port
+        self.protocol = protocol
+        if protocol == "pro":
+            self.serial_port = serial.Serial(port, baudrate=57600, timeout=1)
+            size, self._data_offset = 513 + 5, 4
+        else:
+            self.serial_port = serial.Serial(port, baudrate=250000, stopbits=2)
+            size, self._data_offset = 513, 0
         
-        # Serial Params
-        self.serial_port = None
+        # Doppio buffer: il thread di invio riempie _buffers[_fill], il writer scrive l'altro
+        self._buffers = [bytearray(size), bytearray(size)]
+        self._views = [np.frombuffer(b, dtype=np.uint8)[self._data_offset:self._data_offset + 513] for b in self._buffers]
+        if protocol == "pro":
+            for b in self._buffers:
+                b[0:4] = bytes([ENTTEC_PRO_SOM, ENTTEC_PRO_SEND_DMX, 513 & 0xff, 513 >> 8])
+                b[-1] = ENTTEC_PRO_EOM
+        self._fill = 0
+        self._pending = False
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
         
-        # ArtNet Params
+        self.frames_submitted = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.write_errors = 0
+        
+        self.running = True
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+
+    def send(self, frames):
+        with self._lock:
+            np.copyto(self._views[self._fill], frames[0])
+            if self._pending: self.frames_dropped += 1 # Il writer è ancora sul frame precedente
+            self._pending = True
+        self.frames_submitted += 1
+        self._ready.set()
+
+    def _writer_loop(self):
+        while self.running:
+            if not self._ready.wait(0.5): continue
+            with self._lock:
+                self._ready.clear()
+                if not self._pending: continue
+                buf = self._buffers[self._fill]
+                self._fill ^= 1
+                self._pending = False
+            try:
+                if self.protocol == "open":
+                    self.serial_port.break_condition = True
+                    time.sleep(0.0001)
+                    self.serial_port.break_condition = False
+                self.serial_port.write(buf)
+                self.frames_written += 1
+            except Exception as e:
+                # print(f"Errore scrittura seriale: {e}")
+                self.write_errors += 1
+                time.sleep(0.1)
+
+    def stats(self):
+        return {
+            "protocol": self.protocol,
+            "frames_submitted": self.frames_submitted,
+            "frames_written": self.frames_written,
+            "frames_dropped": self.frames_dropped,
+            "write_errors": self.write_errors,
+        }
+
+    def close(self):
+        self.running = False
+        self._ready.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(1.0)
+        if self.serial_port: self.serial_port.close()
+
+class ArtNetBackend(OutputBackend):
+    """
+    ART-NET (ArtDMX) su UDP: un pacchetto preallocato per universo.
+    Ogni frame si copia il payload mergiato nei pacchetti con una sola np.copyto,
+    si aggiorna il byte Sequence in place e si passa a sendto sempre lo stesso buffer.
+    Con un ArtNetDiscovery collegato ogni universo va in unicast ai nodi che lo emettono;
+    gli universi senza nodi noti vanno all'IP configurato (anche broadcast).
+    """
+    kind = "artnet"
+
+    def __init__(self, ip, start_universe=0, keepalive=1.0, discovery=None):
+        self.ip = ip
+        self.discovery = discovery
+        self.start_universe = int(start_universe) # L'universo interno N esce su start_universe + N
+        self.sequence = 0
+        self.policy = SendPolicy(ARTDMX_PACKET_SIZE, keepalive)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # UDP
-        self.artnet_ip = "127.0.0.1"
-        self.artnet_universe = 0
-        self.artnet_header = bytearray()
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self._alloc(0)
+
+    def _alloc(self, count):
+        packets = bytearray(count * ARTDMX_PACKET_SIZE)
+        mv = memoryview(packets)
+        self.packets = [mv[u * ARTDMX_PACKET_SIZE:(u + 1) * ARTDMX_PACKET_SIZE] for u in range(count)]
+        self._packets_np = np.frombuffer(packets, dtype=np.uint8).reshape(count, ARTDMX_PACKET_SIZE)
+        self._payload = self._packets_np[:, ARTDMX_HEADER_SIZE:]
         self._build_artnet_header()
 
+    def _build_artnet_header(self):
+        """Pre-calcola l'header Art-Net fisso di ogni universo direttamente nei pacchetti preallocati."""
+        for u, packet in enumerate(self.packets):
+            # Header ID "Art-Net" + 0x00
+            header = b'Art-Net\x00'
+            # OpCode Output (0x5000) Little Endian -> 0x00 0x50
+            header += b'\x00\x50' 
+            # Proto Version (14) -> 0x00 0x0e
+            header += b'\x00\x0e'
+            # Sequence (0) & Physical (0)
+            header += b'\x00\x00'
+            # Universe (Little Endian)
+            header += struct.pack('<H', self.start_universe + u)
+            # Length (512) Big Endian -> 0x02 0x00
+            header += b'\x02\x00'
+            packet[:ARTDMX_HEADER_SIZE] = header
+
+    def stats(self):
+        return self.policy.stats()
+
+    def send(self, frames):
+        if len(frames) != len(self.packets): self._alloc(len(frames))
+        send_idx = self.policy.select(frames)
+        if not len(send_idx): return
+        np.copyto(self._payload, frames[:, 1:])
+        # Sequence 1-255 (0 = sequenza disabilitata per il ricevitore)
+        self.sequence = self.sequence % 255 + 1
+        self._packets_np[:, ARTDMX_SEQUENCE_OFFSET] = self.sequence
+        default = (self.ip, ARTNET_PORT)
+        routes = self.discovery.routes if self.discovery else None
+        for u in send_idx:
+            packet = self.packets[u]
+            dests = routes.get(self.start_universe + u) if routes else None
+            if dests:
+                for dest in dests: self.socket.sendto(packet, dest)
+            else:
+                self.socket.sendto(packet, default)
+
+    def close(self):
+        self.socket.close()
+
+class SACNBackend(OutputBackend):
+    """
+    Streaming ACN (E1.31) su UDP, multicast (239.255.hi.lo per universo) o unicast se è indicato un IP.
+    Pacchetti preallocati per universo: a ogni frame cambiano solo dati e sequence number.
+    """
+    kind = "sacn"
+
+    def __init__(self, start_universe=1, ip=None, priority=SACN_DEFAULT_PRIORITY,
+                 source_name="MIDI-DMX Pro", interface_ip=None, ttl=8, keepalive=1.0):
+        self.start_universe = max(1, int(start_universe)) # E1.31: universi validi 1-63999
+        self.ip = ip or None # None = multicast
+        self.default_priority = int(priority)
+        self.priorities = {} # {universo_interno: priorità 0-200}
+        self.source_name = source_name
+        self.cid = uuid.uuid4().bytes # Component Identifier della sorgente
+        self.sequence = 0
+        self.policy = SendPolicy(SACN_PACKET_SIZE, keepalive)
+        
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        if interface_ip:
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface_ip))
+        self._alloc(0)
+
+    @staticmethod
+    def multicast_address(universe):
+        return f"239.255.{(universe >> 8) & 0xff}.{universe & 0xff}"
+
+    def _alloc(self, count):
+        packets = bytearray(count * SACN_PACKET_SIZE)
+        mv = memoryview(packets)
+        self.packets = [mv[u * SACN_PACKET_SIZE:(u + 1) * SACN_PACKET_SIZE] for u in range(count)]
+        self._packets_np = np.frombuffer(packets, dtype=np.uint8).reshape(count, SACN_PACKET_SIZE)
+        self._dmx = self._packets_np[:, SACN_DMX_OFFSET:]
+        self.destinations = []
+        for u, packet in enumerate(self.packets):
+            universe = self.start_universe + u
+            packet[:SACN_DMX_OFFSET] = self._build_header(universe, self.priorities.get(u, self.default_priority))
+            self.destinations.append((self.ip or self.multicast_address(universe), SACN_PORT))
+
+    def _build_header(self, universe, priority):
+        """Header E1.31 completo (Root + Framing + DMP layer) fino allo start code escluso."""
+        name = self.source_name.encode("utf-8")[:63].ljust(64, b"\x00")
+        # Root Layer
+        h = struct.pack("!HH12s", 0x0010, 0x0000, b"ASC-E1.17\x00\x00\x00")
+        h += struct.pack("!HI16s", 0x7000 | (SACN_PACKET_SIZE - 16), 0x00000004, self.cid)
+        # Framing Layer
+        h += struct.pack("!HI64sBHBBH", 0x7000 | (SACN_PACKET_SIZE - 38), 0x00000002, name,
+                         priority, 0, 0, 0, universe)
+        # DMP Layer
+        h += struct.pack("!HBBHHH", 0x7000 | (SACN_PACKET_SIZE - 115), 0x02, 0xa1, 0x0000, 0x0001, 513)
+        return h
+
+    def set_priority(self, universe, priority):
+        """Priorità (0-200) di un universo interno, aggiornata in place nel pacchetto."""
+        priority = max(0, min(200, int(priority)))
+        self.priorities[universe] = priority
+        if universe < len(self.packets):
+            self._packets_np[universe, SACN_PRIORITY_OFFSET] = priority
+
+    def stats(self):
+        return self.policy.stats()
+
+    def send(self, frames):
+        if len(frames) != len(self.packets): self._alloc(len(frames))
+        send_idx = self.policy.select(frames)
+        if not len(send_idx): return
+        np.copyto(self._dmx, frames) # Start code + 512 canali
+        self.sequence = (self.sequence + 1) & 0xff
+        self._packets_np[:, SACN_SEQUENCE_OFFSET] = self.sequence
+        for u in send_idx:
+            self.socket.sendto(self.packets[u], self.destinations[u])
+
+    def close(self):
+        self.socket.close()
+
+class DMXController:
+    """
+    Gestisce l'output DMX: un frame mergiato per tutti gli universi, inviato a uno o più
+    backend contemporaneamente (USB-SERIAL Enttec/OpenDMX, ART-NET, sACN/E1.31).
+    """
+    # Layer standard (accesso compatibile: dmx.live_buffer[ch] = val / dmx.scene_buffer = bytearray(...))
+    live_buffer = _layer_buffer("live")
+    scene_buffer = _layer_buffer("scene")
+    chase_buffer = _layer_buffer("chase")
+    cue_buffer = _layer_buffer("cue")
+
+    def __init__(self, universes=1, frame_rate=40):
+        # Layer di merge (tutti HTP di default, come in origine)
+        self.merger = MergeEngine(513, universes)
+        for name in ("live", "scene", "chase", "cue"):
+            self.merger.add_layer(name, MERGE_HTP)
+        
+        # Buffer Dati (pool preallocato: un frame da 513 byte per universo)
+        self._alloc_output()
+        
+        # Stato Hardware
+        self.backends = [] # Uscite attive, tutte alimentate dallo stesso frame
+        self.discovery = None # ArtNetDiscovery (opzionale)
+        self.frame_hooks = []  # fn(t_ns) chiamate nel thread di invio prima del merge
+        self.output_hooks = [] # fn(frames, t_ns) chiamate dopo il merge, prima dell'invio
+        self.latency = LatencyTracer() # Latenza ingresso -> uscita (scritture segnalate dagli ingressi)
+        self.running = True
+        self.scheduler = FrameScheduler(frame_rate)
+
         # Avvia Thread
         self.thread = threading.Thread(target=self._send_loop, daemon=True)
         self.thread.start()
 
-    def _build_artnet_header(self):
-        """Pre-calcola l'header Art-Net fisso per efficienza."""
-        # Header ID "Art-Net" + 0x00
-        header = b'Art-Net\x00'
-        # OpCode Output (0x5000) Little Endian -> 0x00 0x50
-        header += b'\x00\x50' 
-        # Proto Version (14) -> 0x00 0x0e
-        header += b'\x00\x0e'
-        # Sequence (0) & Physical (0)
-        header += b'\x00\x00'
-        # Universe (Little Endian)
-        header += struct.pack('<H', self.artnet_universe)
-        # Length (512) Big Endian -> 0x02 0x00
-        header += b'\x02\x00'
-        self.artnet_header = header
-
-    def connect_serial(self, port):
-        """Connette via USB Seriale"""
-        self.mode = "serial"
+    def _alloc_output(self):
+        """(Ri)alloca il pool dei frame di uscita per il numero di universi corrente."""
+        count = self.merger.universes
+        self.output_frames = bytearray(count * 513)
+        self.output = np.frombuffer(self.output_frames, dtype=np.uint8).reshape(count, 513) # Vista senza copia
+        self.output_frame = memoryview(self.output_frames)[0:513] # Universo 0 (GUI, seriale)
+
+    @property
+    def universe_count(self):
+        return self.merger.universes
+
+    def set_universe_count(self, count):
+        """Imposta il numero di universi gestiti (pool e layer vengono riallocati una sola volta)."""
+        self.merger.set_universes(count)
+        if self.merger.universes != len(self.output):
+            self._alloc_output()
+
+    def set_frame_rate(self, rate_hz):
+        """Frequenza di refresh dell'output (es. 30/40/44 Hz)."""
+        self.scheduler.set_rate(rate_hz)
+
+    def get_timing_stats(self):
+        """Frame in ritardo/saltati e jitter del thread di output."""
+        return self.scheduler.stats()
+
+    def get_latency_stats(self):
+        """Percentili di latenza MIDI -> DMX (arrivo, scrittura nel buffer, invio del frame)."""
+        return self.latency.stats()
+
+    def export_latency_trace(self, path):
+        return self.latency.export_chrome_trace(path)
+
+    def add_layer(self, name, policy=MERGE_HTP, priority=0):
+        """Registra un nuovo layer di merge (es. effetti, override manuali) senza toccare il ciclo di invio."""
+        self.merger.add_layer(name, policy, priority)
+        return self.merger.layer(name)
+
+    def layer_frames(self, name):
+        """Vista scrivibile (n_universi x 513) su un layer: il playback ci scrive senza copie intermedie."""
+        return self.merger.layer(name)
+
+    def set_channel(self, layer, address, value):
+        """Scrive un canale di un layer. address: assoluto (int) o (universo, canale)."""
+        uni, ch = split_address(address)
+        if 0 <= uni < self.merger.universes and 1 <= ch <= CHANNELS_PER_UNIVERSE:
+            self.merger.stack[self.merger.index[layer], uni, ch] = value
+
+    def get_output(self, address):
+        """Valore in uscita di un canale. address: assoluto (int) o (universo, canale)."""
+        uni, ch = split_address(address)
+        if 0 <= uni < len(self.output) and 1 <= ch <= CHANNELS_PER_UNIVERSE:
+            return int(self.output[uni, ch])
+        return 0
+
+    def snapshot(self):
+        """Canali in uscita diversi da zero, come {indirizzo_assoluto: valore} su tutti gli universi."""
+        out = self.output
+        unis, chans = np.nonzero(out[:, 1:])
+        return {join_address(u, c + 1): int(out[u, c + 1]) for u, c in zip(unis, chans)}
+
+    # --- BACKEND ---
+    def add_frame_hook(self, fn, post=False):
+        """
+        Registra una funzione eseguita a ogni frame nel thread di invio, con il timestamp
+        della scadenza del frame (perf_counter_ns). post=True: riceve anche il frame mergiato
+        (sola lettura). Le liste sono sostituite in blocco, il ciclo non prende lock.
+        """
+        if post: self.output_hooks = self.output_hooks + [fn]
+        else: self.frame_hooks = self.frame_hooks + [fn]
+
+    def remove_frame_hook(self, fn):
+        self.frame_hooks = [h for h in self.frame_hooks if h != fn]
+        self.output_hooks = [h for h in self.output_hooks if h != fn]
+
+    def _run_hooks(self, hooks, *args):
+        for hook in hooks:
+            try:
+                hook(*args)
+            except Exception as e:
+                print(f"Errore hook DMX: {e}")
+
+    def add_backend(self, backend):
+        """Attiva un backend di output, sostituendo quello dello stesso tipo se presente."""
+        old = [b for b in self.backends if b.kind == backend.kind]
+        self.backends = [b for b in self.backends if b.kind != backend.kind] + [backend]
+        for b in old: b.close()
+        return backend
+
+    def remove_backend(self, kind):
+        old = [b for b in self.backends if b.kind == kind]
+        self.backends = [b for b in self.backends if b.kind != kind]
+        for b in old: b.close()
+
+    def get_backend(self, kind):
+        for b in self.backends:
+            if b.kind == kind: return b
+        return None
+
+    def get_send_stats(self):
+        """Statistiche di invio per backend (pacchetti/byte risparmiati, frame seriali scartati, ...)."""
+        return {b.kind: b.stats() for b in self.backends}
+
+    def set_keepalive(self, seconds):
+        """Intervallo di refresh degli universi invariati per tutte le uscite di rete."""
+        for b in self.backends:
+            if hasattr(b, "policy"): b.policy.set_keepalive(seconds)
+
+    @property
+    def mode(self):
+        """Tipi di backend attivi (es. 'artnet+sacn')."""
+        return "+".join(b.kind for b in self.backends)
+
+    def connect_serial(self, port, protocol="open"):
+        """Connette via USB Seriale (protocol: 'open' = Open DMX, 'pro' = Enttec DMX USB Pro)"""
         try:
-            if self.serial_port and self.serial_port.is_open:
-                self.serial_port.close()
-            self.serial_port = serial.Serial(port, baudrate=250000, stopbits=2)
+            self.remove_backend(SerialBackend.kind) # Libera la porta prima di riaprirla
+            self.add_backend(SerialBackend(port, protocol))
             return True
         except Exception as e:
             print(f"Errore Seriale: {e}")
             return False
 
-    def connect_artnet(self, ip, universe):
-        """Configura output Art-Net"""
-        self.mode = "artnet"
-        self.artnet_ip = ip
-        self.artnet_universe = int(universe)
-        self._build_artnet_header() # Ricostruisce header col nuovo universo
+    def connect_artnet(self, ip, universe, count=None):
+        """Configura output Art-Net (count = numero di universi consecutivi da inviare)"""
+        if count: self.set_universe_count(int(count))
+        self.add_backend(ArtNetBackend(ip, universe, discovery=self.discovery))
         return True
 
+    def start_artnet_discovery(self, poll_address="255.255.255.255", **kwargs):
+        """Avvia la discovery dei nodi Art-Net: l'output instrada ogni universo ai nodi che lo emettono."""
+        if self.discovery is None:
+            try:
+                self.discovery = ArtNetDiscovery(poll_address, **kwargs)
+            except OSError as e:
+                print(f"Errore discovery Art-Net: {e}")
+                return None
+            self.discovery.start()
+        backend = self.get_backend(ArtNetBackend.kind)
+        if backend: backend.discovery = self.discovery
+        return self.discovery
+
+    def stop_artnet_discovery(self):
+        if self.discovery is None: return
+        backend = self.get_backend(ArtNetBackend.kind)
+        if backend: backend.discovery = None
+        self.discovery.stop()
+        self.discovery = None
+
+    def connect_sacn(self, universe=1, ip=None, priority=SACN_DEFAULT_PRIORITY, count=None):
+        """Configura output sACN/E1.31 (ip vuoto = multicast)"""
+        try:
+            if count: self.set_universe_count(int(count))
+            self.add_backend(SACNBackend(universe, ip, priority))
+            return True
+        except Exception as e:
+            print(f"Errore sACN: {e}")
+            return False
+
     def _send_loop(self):
-        """Ciclo di invio a 40Hz (25ms)"""
-        seq_count = 0
+        """Ciclo di invio a frequenza fissa (default 40Hz), cadenzato dal FrameScheduler"""
         while self.running:
+            t_ns = self.scheduler.wait()
+            if self.frame_hooks: self._run_hooks(self.frame_hooks, t_ns)
             try:
-                # 1. Calcolo HTP
-                for i in range(1, 513):
-                    self.output_frame[i] = max(
-                        self.live_buffer[i], 
-                        self.scene_buffer[i], 
-                        self.chase_buffer[i], 
-                        self.cue_buffer[i]
-                    )
-                
-                # 2. Invio Hardware
-                if self.mode == "serial" and self.serial_port and self.serial_port.is_open:
-                    self.serial_port.break_condition = True
-                    time.sleep(0.0001)
-                    self.serial_port.break_condition = False
-                    self.serial_port.write(self.output_frame)
-
-                elif self.mode == "artnet":
-                    # Costruzione pacchetto ArtDMX
-                    # Aggiorna Sequence (opzionale ma consigliato)
-                    seq_byte = seq_count.to_bytes(1, 'big')
-                    # Ricostruiamo al volo solo le parti dinamiche se necessario, 
-                    # ma per velocità usiamo l'header pre-calcolato e i dati (dal byte 1 al 512)
-                    packet = self.artnet_header + self.output_frame[1:]
-                    
-                    self.socket.sendto(packet, (self.artnet_ip, 6454))
-                    
-                    seq_count = (seq_count + 1) % 256
-                
-                time.sleep(0.025) # ~40 FPS
-                
+                # 1. Merge vettoriale dei layer (HTP/LTP/Override)
+                out = self.output
+                self.merger.merge(out)
             except Exception as e:
-                # print(f"Errore loop: {e}")
-                time.sleep(0.1)
+                # print(f"Errore merge: {e}")
+                continue
+            if self.output_hooks: self._run_hooks(self.output_hooks, out, t_ns)
+            
+            # 2. Invio Hardware: ogni backend riceve lo stesso frame, un errore non blocca gli altri
+            for backend in self.backends:
+                try:
+                    backend.send(out)
+                except Exception as e:
+                    # print(f"Errore {backend.kind}: {e}")
+                    pass
+            self.latency.frame_sent()
 
     def stop(self):
         self.running = False
-        if self.serial_port: self.serial_port.close()
-        if self.socket: self.socket.close()
\ No newline at end of file
+        self.stop_artnet_discovery()
+        for b in self.backends: b.close()
+        self.backends = []
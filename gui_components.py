@@ -1,7 +1,7 @@
 from PyQt6.QtWidgets import (QLabel, QFrame, QDialog, QVBoxLayout, 
                              QListWidget, QGridLayout, QLineEdit, QPushButton,
                              QHBoxLayout, QSpinBox, QTableWidget, QTableWidgetItem,
-                             QHeaderView, QComboBox, QMessageBox, QSlider, QColorDialog)
+                             QHeaderView, QComboBox, QMessageBox, QSlider, QColorDialog, QCheckBox)
 from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6.QtGui import QIntValidator, QColor
 
@@ -69,6 +69,22 @@ class ChaseCreatorDialog(QDialog):
         self.t_fade = QLineEdit("500")
         self.t_fade.setValidator(QIntValidator(0, 60000))
         time_layout.addWidget(self.t_fade, 1, 1)
+        time_layout.addWidget(QLabel("Curva di Fade:"), 2, 0)
+        self.fade_curve = QComboBox()
+        self.fade_curve.addItem("Lineare", "linear"); self.fade_curve.addItem("S-Curve", "s-curve"); self.fade_curve.addItem("Esponenziale", "exp")
+        time_layout.addWidget(self.fade_curve, 2, 1)
+        self.chk_dither = QCheckBox("Dithering (fade lenti più fluidi)")
+        time_layout.addWidget(self.chk_dither, 3, 0, 1, 2)
+        time_layout.addWidget(QLabel("Sincronizzazione:"), 4, 0)
+        self.sync_mode = QComboBox()
+        self.sync_mode.addItem("Libera (ms)", "free"); self.sync_mode.addItem("MIDI Clock - Quarti", "beat")
+        self.sync_mode.addItem("MIDI Clock - Battute", "bar"); self.sync_mode.addItem("MIDI Time Code", "timecode")
+        self.sync_mode.addItem("Audio - Quarti (BPM stimati)", "audio")
+        self.sync_mode.addItem("Griglia traccia - Quarti", "grid")
+        time_layout.addWidget(self.sync_mode, 4, 1)
+        time_layout.addWidget(QLabel("Quarti/Battute per step:"), 5, 0)
+        self.sync_beats = QSpinBox(); self.sync_beats.setRange(1, 64)
+        time_layout.addWidget(self.sync_beats, 5, 1)
         layout.addLayout(time_layout)
         self.btn_confirm = QPushButton("CONFERMA E CREA CHASE")
         self.btn_confirm.setFixedHeight(35)
@@ -84,6 +100,7 @@ class FixtureCreatorDialog(QDialog):
         form = QHBoxLayout()
         form.addWidget(QLabel("Nome:")); self.name_input = QLineEdit(); form.addWidget(self.name_input)
         form.addWidget(QLabel("Start Address:")); self.addr_spin = QSpinBox(); self.addr_spin.setRange(1, 512); form.addWidget(self.addr_spin)
+        form.addWidget(QLabel("Uni:")); self.uni_spin = QSpinBox(); self.uni_spin.setRange(0, 63); form.addWidget(self.uni_spin)
         layout.addLayout(form)
         layout.addWidget(QLabel("<b>Definizione Canali:</b>"))
         self.table = QTableWidget(); self.table.setColumnCount(2); self.table.setHorizontalHeaderLabels(["Offset", "Funzione"])
@@ -106,7 +123,8 @@ class FixtureCreatorDialog(QDialog):
         btn_cancel = QPushButton("ANNULLA"); btn_cancel.clicked.connect(self.reject)
         dlg_btns.addWidget(btn_cancel); dlg_btns.addWidget(btn_ok)
         layout.addLayout(dlg_btns)
-        self.channel_types = ["Red", "Green", "Blue", "White", "Amber", "UV", "Dimmer", "Strobe", "Pan", "Tilt", "Speed", "Macro", "Other"]
+        self.channel_types = ["Red", "Green", "Blue", "White", "Amber", "UV", "Dimmer", "Dimmer Fine", "Strobe",
+                              "Pan", "Pan Fine", "Tilt", "Tilt Fine", "Speed", "Macro", "Other"]
         self.load_preset(["Red", "Green", "Blue"])
 
     def add_row(self, type_sel="Other"):
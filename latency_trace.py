@@ -0,0 +1,94 @@
+import json
+import time
+import numpy as np
+
+class LatencyTracer:
+    """
+    Tracciamento della latenza MIDI -> DMX per evento: arrivo nel callback MIDI, scrittura nel
+    layer e trasmissione del frame che la contiene (ritorno dei send dei backend).
+    written() e frame_sent() vengono chiamati solo dal thread di invio DMX: niente lock.
+    Gli ultimi 'capacity' eventi restano in un ring buffer NumPy preallocato.
+    """
+    STAGES = ("arrival", "write", "sent")
+
+    def __init__(self, capacity=4096, log_interval=10.0, enabled=True):
+        self.enabled = enabled
+        self.log_interval = log_interval # Secondi tra due righe di log (0 = niente log)
+        self._ring = np.zeros((capacity, 3), dtype=np.int64)
+        self._codes = np.zeros(capacity, dtype=np.int32)
+        self._count = 0 # Eventi completati in totale
+        self._pending = [] # (codice, arrivo, scrittura) in attesa del prossimo frame
+        self._last_log_ns = time.perf_counter_ns()
+        self._logged = 0
+
+    def reset(self):
+        self._count = 0
+        self._pending = []
+        self._logged = 0
+
+    def written(self, code, t_arrival_ns, t_write_ns=None):
+        """Un evento MIDI è stato scritto nel buffer del layer."""
+        if not self.enabled: return
+        if t_write_ns is None: t_write_ns = time.perf_counter_ns()
+        self._pending.append((code, t_arrival_ns, t_write_ns))
+
+    def frame_sent(self, t_sent_ns=None):
+        """Il frame corrente è stato consegnato ai backend: chiude gli eventi in attesa."""
+        if self._pending:
+            if t_sent_ns is None: t_sent_ns = time.perf_counter_ns()
+            ring, size = self._ring, len(self._ring)
+            for code, t_arrival, t_write in self._pending:
+                i = self._count % size
+                ring[i, 0] = t_arrival
+                ring[i, 1] = t_write
+                ring[i, 2] = t_sent_ns
+                self._codes[i] = code
+                self._count += 1
+            self._pending = []
+
+        if self.log_interval and self._count != self._logged:
+            now = time.perf_counter_ns()
+            if now - self._last_log_ns >= self.log_interval * 1e9:
+                self._last_log_ns = now
+                self._logged = self._count
+                st = self.stats()["total_ms"]
+                print(f"[LATENCY] MIDI->DMX n={st['count']} p50={st['p50']:.2f}ms p95={st['p95']:.2f}ms p99={st['p99']:.2f}ms max={st['max']:.2f}ms")
+
+    def _samples(self):
+        n = min(self._count, len(self._ring))
+        if self._count <= len(self._ring): return self._ring[:n], self._codes[:n]
+        i = self._count % len(self._ring) # Ordine cronologico
+        return np.roll(self._ring, -i, axis=0), np.roll(self._codes, -i)
+
+    @staticmethod
+    def _percentiles(values_ns):
+        if not len(values_ns): return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+        p50, p95, p99 = np.percentile(values_ns, (50, 95, 99)) / 1e6
+        return {"count": int(len(values_ns)), "p50": float(p50), "p95": float(p95), "p99": float(p99),
+                "max": float(values_ns.max() / 1e6)}
+
+    def stats(self):
+        """Percentili (ms) degli ultimi eventi: arrivo->scrittura, scrittura->invio e totale."""
+        samples, _ = self._samples()
+        return {
+            "input_to_write_ms": self._percentiles(samples[:, 1] - samples[:, 0]),
+            "write_to_wire_ms": self._percentiles(samples[:, 2] - samples[:, 1]),
+            "total_ms": self._percentiles(samples[:, 2] - samples[:, 0]),
+        }
+
+    def export_chrome_trace(self, path):
+        """Salva gli eventi nel formato Chrome Trace (chrome://tracing, Perfetto)."""
+        samples, codes = self._samples()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "MIDI -> buffer"}},
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": 2, "args": {"name": "buffer -> wire"}},
+        ]
+        for (t_arrival, t_write, t_sent), code in zip(samples.tolist(), codes.tolist()):
+            args = {"code": code}
+            events.append({"name": "midi_in", "ph": "X", "pid": 1, "tid": 1, "ts": t_arrival / 1000,
+                           "dur": (t_write - t_arrival) / 1000, "args": args})
+            events.append({"name": "dmx_out", "ph": "X", "pid": 1, "tid": 2, "ts": t_write / 1000,
+                           "dur": (t_sent - t_write) / 1000, "args": args})
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return len(samples)
@@ -2,21 +2,39 @@ import sys
 import serial.tools.list_ports
 import mido
 from PyQt6.QtWidgets import (
-    QApplication, QMainWindow, QMenu, QInputDialog, QMessageBox, QColorDialog
+    QApplication, QMainWindow, QMenu, QInputDialog, QMessageBox, QColorDialog, QFileDialog
 )
 from PyQt6.QtGui import QColor, QAction, QFont
-from PyQt6.QtCore import QTimer, Qt
+from PyQt6.QtCore import QTimer, Qt, QThread, pyqtSignal
 
 # MODULI INTERNI
-from dmx_engine import DMXController
+from dmx_engine import DMXController, join_address
 from playback_engine import PlaybackEngine
 from midi_manager import MidiManager
 from audio_engine import AudioReactor # NUOVO
+from audio_bands import BandMapper
+import audio_offline
 import data_manager
+import cue_store
 from gui_components import ChaseCreatorDialog, FixtureCreatorDialog, FXGeneratorDialog
 from ui_builder import UIBuilder
 from fx_utils import FXUtils
 
+class AnalysisWorker(QThread):
+    """Analisi offline della traccia fuori dal thread della GUI (può durare secondi)."""
+    done = pyqtSignal(str, object) # Percorso, AudioAnalysis
+    failed = pyqtSignal(str)
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def run(self):
+        try:
+            self.done.emit(self.path, audio_offline.analyze_file(self.path))
+        except Exception as e:
+            self.failed.emit(str(e))
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -24,25 +42,28 @@ class MainWindow(QMainWindow):
         # 1. Dati
         self.data_store = {
             "scenes": {}, "chases": {}, "cues": {}, 
-            "show": [], "rem": {}, "map": {}, "groups": {},
+            "show": [], "rem": {}, "map": {}, "groups": {}, "audio_map": {},
             "fixtures": {}, 
             "globals": {"chase_speed": 127, "chase_fade": 127} 
         }
         self.selected_ch = set()
         self.current_active_group = None 
+        self._midi_shown = None
+        self._analysis_worker = None # AnalysisWorker della traccia dello show
 
         # 2. Motori
         self.dmx = DMXController()
         self.playback = PlaybackEngine(self.dmx, self.data_store)
         self.midi = MidiManager(self.playback, self.dmx, self.data_store)
-        self.audio = AudioReactor() # MOTORE AUDIO
+        self.audio = AudioReactor(self.playback.audio_tempo) # MOTORE AUDIO (tempo/fase -> chase)
+        self.audio_bands = BandMapper(self.dmx, self.data_store, self.audio) # Bande -> gruppi nel thread DMX
+        self.audio_bands.start()
         
         # 3. Segnali
         self.midi.selected_channels = self.selected_ch
         self.playback.state_changed.connect(self._update_list_visual_selection)
         self.midi.learn_status_changed.connect(self.on_learn_status_change)
         self.midi.request_ui_refresh.connect(self.update_ui_from_engine) 
-        self.midi.new_midi_message.connect(self.update_midi_label)
         
         # Segnale Audio
         self.audio.data_processed.connect(self.on_audio_data)
@@ -56,12 +77,14 @@ class MainWindow(QMainWindow):
         self.ui_builder = UIBuilder()
         self.ui_builder.setup_ui(self)
         self.refresh_audio_devices() # Popola combo audio
+        for i, fc in enumerate(self.audio.band_centers()):
+            self.band_combo.addItem(f"{i + 1}: {fc:.0f} Hz" if fc < 1000 else f"{i + 1}: {fc / 1000:.1f} kHz", i)
         
         self.load_data()
 
         # 6. Loop
         self.timer_ui = QTimer(); self.timer_ui.timeout.connect(self.update_ui_frame); self.timer_ui.start(33)
-        self.timer_engine = QTimer(); self.timer_engine.timeout.connect(self.playback.tick); self.timer_engine.start(40) 
+        self.playback.start() # Tick nel thread DMX, non più su un QTimer della GUI
 
     # --- AUDIO LOGIC ---
     def refresh_audio_devices(self):
@@ -70,12 +93,42 @@ class MainWindow(QMainWindow):
         for idx, name in devices:
             self.audio_combo.addItem(f"{idx}: {name}", idx)
 
+    def load_soundtrack(self):
+        """Analizza (o legge dalla cache) la traccia dello show: chase 'grid' e trigger seguono la sua griglia."""
+        if self._analysis_worker and self._analysis_worker.isRunning(): return # Analisi già in corso
+        path, _ = QFileDialog.getOpenFileName(self, "Traccia dello show", "", "WAV (*.wav)")
+        if not path: return
+        self.btn_grid.setEnabled(False); self.btn_grid.setText("ANALISI...")
+        worker = self._analysis_worker = AnalysisWorker(path)
+        worker.done.connect(self._soundtrack_ready)
+        worker.failed.connect(self._soundtrack_failed)
+        worker.start()
+
+    def _soundtrack_failed(self, error):
+        grid = self.playback.grid # La griglia precedente resta valida
+        self.btn_grid.setText(f"▶ GRIGLIA {grid.bpm:.1f} BPM" if grid else "▶ GRIGLIA"); self.btn_grid.setEnabled(grid is not None)
+        QMessageBox.critical(self, "Errore", f"Analisi traccia fallita: {error}")
+
+    def _soundtrack_ready(self, path, analysis):
+        track = self.data_store.setdefault("soundtrack", {})
+        track["file"] = path
+        self.playback.set_grid(audio_offline.BeatGrid(analysis, self.playback.timecode, track.get("tc_offset", 0.0)),
+                               track.get("triggers", []))
+        self.btn_grid.setEnabled(True); self.btn_grid.setChecked(False)
+        self.btn_grid.setText(f"▶ GRIGLIA {analysis.bpm:.1f} BPM")
+        self.save_data()
+
+    def toggle_grid(self):
+        if self.btn_grid.isChecked(): self.playback.start_grid()
+        else: self.playback.stop_grid()
+
     def toggle_audio_engine(self):
         if self.btn_audio_start.isChecked():
             idx = self.audio_combo.currentData()
             if idx is not None:
                 self.audio.set_device(idx)
                 self.audio.start()
+                self.audio_bands.release()
                 self.btn_audio_start.setText("STOP LISTENING")
                 self.btn_audio_start.setStyleSheet("background-color: #2ecc71; color: black; font-weight: bold;")
         else:
@@ -86,7 +139,20 @@ class MainWindow(QMainWindow):
     def on_gain_change(self, val):
         self.audio.gain = val / 10.0
 
-    def on_audio_data(self, is_beat, vol, spectrum):
+    def map_band_to_group(self):
+        """Mappa la banda scelta sui canali del gruppo selezionato (di nuovo = rimuove la mappatura)."""
+        name = self.current_active_group
+        if not name:
+            QMessageBox.information(self, "Audio", "Seleziona prima un gruppo")
+            return
+        audio_map = self.data_store.setdefault("audio_map", {})
+        band = self.band_combo.currentData()
+        if audio_map.get(name, {}).get("band") == band: del audio_map[name]
+        else: audio_map[name] = {"band": band, "lo": 0, "hi": 255}
+        self.audio_bands.release()
+        self.save_data()
+
+    def on_audio_data(self, is_beat, vol, bands):
         # UI Updates
         self.prog_vol.setValue(vol)
         if is_beat:
@@ -107,15 +173,22 @@ class MainWindow(QMainWindow):
     # --- CONNESSIONI ---
     def connect_serial(self):
         port = self.dmx_combo.currentText()
-        if port and self.dmx.connect_serial(port):
+        if port and self.dmx.connect_serial(port, self.dmx_proto.currentData()):
             QMessageBox.information(self, "OK", f"Connesso USB: {port}")
             self.setWindowTitle("MIDI-DMX Pro [USB]")
 
     def connect_artnet(self):
-        if self.dmx.connect_artnet(self.art_ip.text(), self.art_uni.text()):
+        if self.chk_artnet_discovery.isChecked(): self.dmx.start_artnet_discovery()
+        else: self.dmx.stop_artnet_discovery()
+        if self.dmx.connect_artnet(self.art_ip.text(), self.art_uni.text(), self.art_count.text() or 1):
             QMessageBox.information(self, "OK", "Art-Net Connected")
             self.setWindowTitle("MIDI-DMX Pro [ARTNET]")
 
+    def connect_sacn(self):
+        if self.dmx.connect_sacn(self.sacn_uni.text() or 1, self.sacn_ip.text().strip(), self.sacn_prio.text() or 100):
+            QMessageBox.information(self, "OK", "sACN Connected")
+            self.setWindowTitle(f"MIDI-DMX Pro [{self.dmx.mode.upper()}]")
+
     def connect_midi(self):
         err = self.midi.open_port(self.midi_combo.currentText())
         if not err:
@@ -124,6 +197,12 @@ class MainWindow(QMainWindow):
         else:
             QMessageBox.critical(self, "Errore", str(err))
 
+    def connect_midi_output(self):
+        if self.midi_out_combo.currentIndex() == 0:
+            self.midi.close_output(); return
+        err = self.midi.open_output(self.midi_out_combo.currentText())
+        if err: QMessageBox.critical(self, "Errore", str(err))
+
     # --- FX WIZARD ---
     def open_fx_wizard(self):
         selected_fixtures = [i.text() for i in self.f_list.selectedItems()]
@@ -158,7 +237,7 @@ class MainWindow(QMainWindow):
             for f in selected_fixtures:
                 fdata = self.data_store["fixtures"].get(f)
                 if isinstance(fdata, int): fdata = {"addr": fdata, "profile": ["Red", "Green", "Blue"]}
-                if fdata: fix_data_list.append(fdata)
+                if fdata: fix_data_list.append(dict(fdata, addr=join_address(fdata.get("uni", 0), fdata["addr"])))
             
             # Genera step
             new_steps = FXUtils.generate_steps(fix_data_list, fx_type, steps, spread, palette)
@@ -183,18 +262,22 @@ class MainWindow(QMainWindow):
 
     # --- CORE ---
     def action_blackout(self):
-        self.show_step_timer.stop(); self.playback.stop_all()
+        self.show_step_timer.stop(); self.playback.stop_all(); self.btn_rec.setText("● REC")
+        self.audio_bands.blackout() # Le bande restano spente finché non si manda di nuovo uscita
         self.f_slider.setValue(0); self.f_input.setText("0"); self.f_label.setText("LIVE: 0 | 0%")
         self.show_list_widget.clearSelection()
 
     def update_ui_frame(self):
-        mapped_ids = {ch for ids in self.data_store["map"].values() for ch in ids}
-        mapped_remotes = []
-        for val in self.data_store["rem"].values():
-            if isinstance(val, list):
-                for v in val: 
-                    if ":" in v: mapped_remotes.append(v.split(":")[1])
-            elif ":" in val: mapped_remotes.append(val.split(":")[1])
+        # Mappature già decodificate nella tabella di dispatch MIDI
+        mapped_ids = self.midi.dispatch.mapped_channels
+        mapped_remotes = self.midi.dispatch.mapped_names
+        
+        # Monitor MIDI: il testo si formatta qui, al refresh, non per ogni messaggio ricevuto
+        if self.midi.last_message is not self._midi_shown:
+            self._midi_shown = self.midi.last_message
+            self.update_midi_label(self.midi.monitor_text())
+            st = self.midi.get_input_stats()
+            self.lbl_midi_monitor.setToolTip(f"Ricevuti: {st['received']} | Applicati: {st['applied']} | Fusi: {st['coalesced']} | Non mappati: {st['unmapped']} | Clock: {self.playback.clock.bpm:.1f} BPM | Audio: {self.playback.audio_tempo.bpm:.1f} BPM | Latenza p95: {self.dmx.get_latency_stats()['total_ms']['p95']:.1f}ms")
 
         for lst in [self.s_list, self.ch_list, self.cue_list, self.g_list, self.f_list]:
             for row in range(lst.count()):
@@ -209,9 +292,10 @@ class MainWindow(QMainWindow):
     def fader_moved(self, val):
         self.f_label.setText(f"LIVE: {val} | {int(val/2.55)}%")
         if not self.f_input.hasFocus(): self.f_input.setText(str(val))
+        if val and self.selected_ch: self.audio_bands.release()
         for ch in self.selected_ch:
-            self.dmx.live_buffer[ch] = val
-            self.cells[ch-1].update_view(val, True, False, force=True)
+            self.dmx.set_channel("live", ch, val)
+            if ch <= 512: self.cells[ch-1].update_view(val, True, False, force=True)
 
     def manual_fader_input(self):
         try:
@@ -230,6 +314,8 @@ class MainWindow(QMainWindow):
     def on_speed_change(self, val):
         self.data_store["globals"]["chase_speed"] = val
         self.lbl_speed.setText(f"HOLD: {int(val/127*100)}%")
+    def on_stack_mode_change(self, state):
+        self.data_store["globals"]["stack_mode"] = self.chk_stack_mode.isChecked()
     def on_fade_change(self, val):
         self.data_store["globals"]["chase_fade"] = val
         self.lbl_fade.setText(f"FADE: {int(val/127*100)}%")
@@ -242,9 +328,9 @@ class MainWindow(QMainWindow):
     def create_fixture_action(self):
         dlg = FixtureCreatorDialog(self)
         if dlg.exec():
-            name = dlg.name_input.text(); addr = dlg.addr_spin.value(); profile = dlg.get_profile()
+            name = dlg.name_input.text(); addr = dlg.addr_spin.value(); uni = dlg.uni_spin.value(); profile = dlg.get_profile()
             if name and profile:
-                self.data_store["fixtures"][name] = {"addr": addr, "profile": profile}
+                self.data_store["fixtures"][name] = {"addr": addr, "uni": uni, "profile": profile}
                 self.f_list.addItem(name); self.save_data()
 
     def on_fixture_selection_change(self):
@@ -254,7 +340,7 @@ class MainWindow(QMainWindow):
             data = self.data_store["fixtures"].get(item.text())
             if not data: continue
             if isinstance(data, int): start = data; prof = ["Red", "Green", "Blue"]
-            else: start = data["addr"]; prof = data["profile"]
+            else: start = join_address(data.get("uni", 0), data["addr"]); prof = data["profile"]
             for i, p in enumerate(prof):
                 self.selected_ch.add(start + i)
                 if p in ["Red", "Green", "Blue", "Dimmer"]: has_color = True
@@ -274,7 +360,7 @@ class MainWindow(QMainWindow):
             data = self.data_store["fixtures"].get(item.text())
             if not data: continue
             if isinstance(data, int): start=data; prof=["Red","Green","Blue"]
-            else: start=data["addr"]; prof=data["profile"]
+            else: start=join_address(data.get("uni", 0), data["addr"]); prof=data["profile"]
             for i, p in enumerate(prof):
                 v = -1
                 if p=="Red": v=r
@@ -282,9 +368,9 @@ class MainWindow(QMainWindow):
                 elif p=="Blue": v=b
                 elif p=="Dimmer": v=255
                 elif p=="White": v=0
-                if v>=0 and start+i<=512:
-                    self.dmx.live_buffer[start+i] = v
-                    self.cells[start+i-1].update_view(v, True, False, force=True)
+                if v>=0:
+                    self.dmx.set_channel("live", start+i, v)
+                    if start+i<=512: self.cells[start+i-1].update_view(v, True, False, force=True)
 
     def create_group_action(self):
         if not self.selected_ch: return
@@ -301,7 +387,7 @@ class MainWindow(QMainWindow):
 
     # --- SAVE/LOAD/REC ---
     def save_scene_action(self):
-        snap = {str(i): self.dmx.output_frame[i] for i in range(1, 513) if self.dmx.output_frame[i] > 0}
+        snap = {str(addr): v for addr, v in self.dmx.snapshot().items()} # Tutti gli universi, indirizzi assoluti
         name, ok = QInputDialog.getText(self, "Salva", "Nome Scena:")
         if ok and name: self.data_store["scenes"][name] = snap; self.s_list.addItem(name); self.save_data()
 
@@ -312,7 +398,9 @@ class MainWindow(QMainWindow):
             if steps:
                 name, ok = QInputDialog.getText(self, "Nuovo", "Nome Chase:")
                 if ok and name:
-                    self.data_store["chases"][name] = {"steps": steps, "h": int(dlg.t_hold.text()), "f": int(dlg.t_fade.text())}
+                    self.data_store["chases"][name] = {"steps": steps, "h": int(dlg.t_hold.text()), "f": int(dlg.t_fade.text()),
+                                                       "curve": dlg.fade_curve.currentData(), "dither": dlg.chk_dither.isChecked(),
+                                                       "sync": dlg.sync_mode.currentData(), "beats": dlg.sync_beats.value()}
                     self.ch_list.addItem(name); self.save_data()
 
     def add_to_show(self, t, n):
@@ -347,10 +435,13 @@ class MainWindow(QMainWindow):
 
     def toggle_rec(self):
         if self.playback.is_recording_cue:
-            self.playback.is_recording_cue = False; self.btn_rec.setText("● REC")
+            writer = self.playback.stop_recording(); self.btn_rec.setText("● REC")
             n, ok = QInputDialog.getText(self, "Salva", "Nome Cue:")
-            if ok and n: self.data_store["cues"][n] = {"data": self.playback.recorded_stream}; self.cue_list.addItem(n); self.save_data()
-        else: self.playback.recorded_stream = []; self.playback.is_recording_cue = True; self.btn_rec.setText("STOP")
+            if ok and n:
+                cue_store.delete_cue_file(self.data_store["cues"].get(n))
+                self.data_store["cues"][n] = cue_store.finalize_recording(writer, n); self.cue_list.addItem(n); self.save_data()
+            else: cue_store.discard_recording(writer)
+        else: self.playback.start_recording(); self.btn_rec.setText("STOP")
 
     # --- MIDI & CONTEXT ---
     def reset_all_midi_channels(self):
@@ -381,9 +472,15 @@ class MainWindow(QMainWindow):
         if not i: return
         m = QMenu(); m.addAction("Mappa MIDI").triggered.connect(lambda: self.midi.toggle_learn(f"{t}:{i.text()}"))
         if t not in ["grp", "fix"]: m.addAction("Add to Show").triggered.connect(lambda: self.add_to_show(t, i.text()))
-        m.addAction("Delete").triggered.connect(lambda: [w.takeItem(w.row(i)), self.data_store[{"sc":"scenes","ch":"chases","cue":"cues","grp":"groups","fix":"fixtures"}[t]].pop(i.text(),None), self.save_data()])
+        m.addAction("Delete").triggered.connect(lambda: self._delete_resource(w, i, t))
         m.exec(w.mapToGlobal(p))
 
+    def _delete_resource(self, w, i, t):
+        w.takeItem(w.row(i))
+        entry = self.data_store[{"sc":"scenes","ch":"chases","cue":"cues","grp":"groups","fix":"fixtures"}[t]].pop(i.text(), None)
+        if t == "cue": cue_store.delete_cue_file(entry)
+        self.save_data()
+
     def show_manager_context_menu(self, p):
         i = self.show_list_widget.itemAt(p)
         if i: QMenu().addAction("Remove").triggered.connect(lambda: [self.data_store["show"].pop(self.show_list_widget.row(i)), self.refresh_show_list_widget(), self.save_data()]); QMenu().exec(self.show_list_widget.mapToGlobal(p))
@@ -409,17 +506,20 @@ class MainWindow(QMainWindow):
     def on_learn_status_change(self, l, t): self.btn_learn.setText("WAIT..." if l else "LEARN"); self.btn_learn.setStyleSheet(f"background: {'#c0392b' if l else '#2c3e50'}; color: white;")
     
     def _update_list_visual_selection(self):
-        for i in range(self.s_list.count()):
-            item = self.s_list.item(i); item.setSelected(item.text() == self.playback.active_sc)
-        for i in range(self.ch_list.count()):
-            item = self.ch_list.item(i); item.setSelected(item.text() == self.playback.active_ch)
-        for i in range(self.cue_list.count()):
-            item = self.cue_list.item(i); item.setSelected(item.text() == self.playback.active_cue)
-
-    def save_data(self): data_manager.save_studio_data(self.data_store)
+        if self.playback.state["playbacks"]: self.audio_bands.release() # Uscita di nuovo attiva dopo il blackout
+        for lst, kind in ((self.s_list, "sc"), (self.ch_list, "ch"), (self.cue_list, "cue")):
+            active = set(self.playback.active_names(kind))
+            for i in range(lst.count()):
+                item = lst.item(i); item.setSelected(item.text() in active)
+
+    def save_data(self):
+        self.midi.rebuild_dispatch() # Ogni modifica di map/rem/gruppi passa da qui
+        self.audio_bands.rebuild()
+        data_manager.save_studio_data(self.data_store)
     def load_data(self):
         d = data_manager.load_studio_data()
-        if d: self.data_store.update(d); self.refresh_show_list_widget()
+        if d: self.data_store.update(d); self.refresh_show_list_widget(); self.midi.rebuild_dispatch(); self.audio_bands.rebuild()
+        self.chk_stack_mode.setChecked(bool(self.data_store["globals"].get("stack_mode", False)))
         self.s_list.addItems(self.data_store.get("scenes", {}).keys())
         self.ch_list.addItems(self.data_store.get("chases", {}).keys())
         self.cue_list.addItems(self.data_store.get("cues", {}).keys())
@@ -1,21 +1,324 @@
+import time
+import threading
+import collections
 import mido
+import numpy as np
 from PyQt6.QtCore import QObject, pyqtSignal
+from dmx_engine import frame_index, split_address, join_address, CHANNELS_PER_UNIVERSE
+
+# Codici interi delle sorgenti mappabili: tipo << 14 | numero (le mappature sono omni: canale MIDI
+# ignorato, tranne il pitchbend dove il numero è proprio il canale)
+MIDI_CC = 0    # 'cc_N'     CC a 7 bit
+MIDI_NOTE = 1  # 'note_N'
+MIDI_CC14 = 2  # 'cc14_N'   coppia MSB (CC N, 0-31) / LSB (CC N+32) a 14 bit
+MIDI_PB = 3    # 'pb_C'     pitchbend del canale C (14 bit)
+MIDI_NRPN = 4  # 'nrpn_N'   parametro NRPN N (CC 99/98 + data entry CC 6/38, 14 bit)
+
+_KEY_KINDS = {"cc": MIDI_CC, "note": MIDI_NOTE, "cc14": MIDI_CC14, "pb": MIDI_PB, "nrpn": MIDI_NRPN}
+_KIND_LIMITS = {MIDI_CC: 127, MIDI_NOTE: 127, MIDI_CC14: 31, MIDI_PB: 15, MIDI_NRPN: 16383}
+
+FINE_SUFFIX = " Fine" # Canale LSB di una coppia a 16 bit nel profilo fixture (es. "Pan" + "Pan Fine")
+
+def midi_code(sig_key):
+    """'cc_12' / 'note_60' / 'cc14_1' / 'pb_0' / 'nrpn_300' (chiavi di data['map'] e data['rem']) -> codice intero, o None."""
+    kind, _, num = str(sig_key).rpartition("_")
+    kind = _KEY_KINDS.get(kind)
+    if kind is None or not num.isdigit() or int(num) > _KIND_LIMITS[kind]: return None
+    return (kind << 14) | int(num)
+
+def format_message(msg):
+    """Testo per il monitor MIDI (calcolato solo quando la GUI lo mostra)."""
+    debug_parts = [msg.type]
+    if hasattr(msg, 'channel'): debug_parts.append(f"Ch:{msg.channel}")
+    if hasattr(msg, 'control'): debug_parts.append(f"CC:{msg.control}")
+    if hasattr(msg, 'note'): debug_parts.append(f"Note:{msg.note}")
+    if hasattr(msg, 'value'): debug_parts.append(f"Val:{msg.value}")
+    if hasattr(msg, 'pitch'): debug_parts.append(f"Pitch:{msg.pitch}")
+    return " ".join(debug_parts)
+
+def fine_channels(fixtures):
+    """{canale coarse: canale fine} (indirizzi assoluti) dalle coppie 'X' / 'X Fine' dei profili fixture."""
+    pairs = {}
+    for data in fixtures.values():
+        if not isinstance(data, dict): continue
+        start = join_address(data.get("uni", 0), data["addr"])
+        profile = data.get("profile", [])
+        for i, p in enumerate(profile):
+            if not p.endswith(FINE_SUFFIX): continue
+            base = p[:-len(FINE_SUFFIX)]
+            for j in range(i - 1, -1, -1): # Il coarse più vicino prima del fine
+                if profile[j] == base:
+                    pairs[start + j] = start + i
+                    break
+    return pairs
+
+def _frame_positions(channels):
+    index = []
+    for ch in channels:
+        try:
+            if 1 <= split_address(ch)[1] <= CHANNELS_PER_UNIVERSE: index.append(frame_index(ch))
+        except (TypeError, ValueError): pass
+    return np.array(sorted(set(index)), dtype=np.intp)
+
+class ChannelTarget:
+    """
+    Canali di destinazione già convertiti in posizioni nel frame piatto (n_universi x 513) del layer live.
+    I canali coarse con un canale 'Fine' nel profilo fixture ricevono il valore a 16 bit (MSB + LSB).
+    """
+    __slots__ = ("index", "coarse", "fine")
+
+    def __init__(self, channels, fine_map):
+        absolute = set()
+        for ch in channels:
+            try: absolute.add(join_address(*split_address(ch)))
+            except (TypeError, ValueError): pass
+        pairs = sorted((c, fine_map[c]) for c in absolute if c in fine_map)
+        paired = {c for c, _ in pairs} | {f for _, f in pairs}
+        self.index = _frame_positions(absolute - paired)
+        self.coarse = _frame_positions([c for c, _ in pairs])
+        self.fine = _frame_positions([f for _, f in pairs])
+        if len(self.coarse) != len(self.fine): # Coppie fuori range: restano a 8 bit
+            self.index = _frame_positions(absolute - {f for _, f in pairs})
+            self.coarse = self.fine = _frame_positions([])
+
+    def __bool__(self):
+        return bool(len(self.index) or len(self.coarse))
+
+    def read(self, live):
+        """Valore a 16 bit del primo canale (per il feedback verso il controller), o None."""
+        size = len(live)
+        if len(self.coarse) and self.coarse[0] < size and self.fine[0] < size:
+            return (int(live[self.coarse[0]]) << 8) | int(live[self.fine[0]])
+        if len(self.index) and self.index[0] < size:
+            return int(live[self.index[0]]) * 257
+        return None
+
+    def write(self, live, val8, val16):
+        size = len(live)
+        index = self.index
+        if len(index):
+            if index[-1] >= size: index = index[index < size] # Universi non attivi
+            live[index] = val8
+        if len(self.coarse):
+            ok = (self.coarse < size) & (self.fine < size)
+            live[self.coarse[ok]] = val16 >> 8
+            live[self.fine[ok]] = val16 & 0xff
+
+class MidiTarget:
+    """Destinazione remota già decodificata ('tipo:nome'), con i canali dei gruppi."""
+    __slots__ = ("kind", "name", "channels")
+
+    def __init__(self, full_target, groups, fine_map):
+        self.kind, _, self.name = str(full_target).partition(":")
+        self.channels = ChannelTarget(groups.get(self.name, []), fine_map) if self.kind == "grp" else None
+
+class MidiDispatch:
+    """
+    Tabella di dispatch compilata da data['map'] e data['rem']: codice -> (canali diretti, target).
+    Costruita una volta per modifica delle mappature, non a ogni messaggio.
+    """
+    __slots__ = ("entries", "discrete", "mapped_channels", "mapped_names")
+
+    def __init__(self, data):
+        groups = data.get("groups", {})
+        fine_map = fine_channels(data.get("fixtures", {}))
+        collected = {}
+        for sig_key, channels in data.get("map", {}).items():
+            code = midi_code(sig_key)
+            if code is None: continue
+            collected.setdefault(code, [[], []])[0].extend(channels)
+        for sig_key, targets in data.get("rem", {}).items():
+            code = midi_code(sig_key)
+            if code is None: continue
+            if not isinstance(targets, list): targets = [targets]
+            collected.setdefault(code, [[], []])[1].extend(MidiTarget(t, groups, fine_map) for t in targets)
+        
+        self.entries = {}
+        for code, (channels, targets) in collected.items():
+            direct = ChannelTarget(channels, fine_map)
+            self.entries[code] = (direct if direct else None, tuple(targets))
+        # Sorgenti con trigger (scene/chase/cue): ogni pressione conta, non si fondono nella raffica
+        self.discrete = frozenset(code for code, (_, targets) in self.entries.items()
+                                  if code >> 14 == MIDI_NOTE or any(t.kind in ("sc", "ch", "cue") for t in targets))
+        
+        # Per la GUI (evidenziazione di canali e liste mappati)
+        self.mapped_channels = {join_address(*split_address(ch)) for chans in data.get("map", {}).values() for ch in chans}
+        self.mapped_names = {t.name for _, targets in self.entries.values() for t in targets}
+
+_MESSAGES_PER_KIND = {MIDI_CC: 1, MIDI_NOTE: 1, MIDI_CC14: 2, MIDI_PB: 1, MIDI_NRPN: 4}
+
+def quantize(kind, val16):
+    """Valore a 16 bit -> risoluzione della sorgente sul controller (per il confronto dei diff)."""
+    if kind == MIDI_NOTE: return 127 if val16 >= 32768 else 0
+    if kind == MIDI_CC: return val16 >> 9
+    return val16 >> 2 # 14 bit
+
+class MidiFeedback:
+    """
+    Uscita MIDI di feedback verso il controller (LED di griglie tipo APC, fader motorizzati).
+    Un thread dedicato ricalcola a 'rate_hz' lo stato desiderato di ogni sorgente mappata
+    (playback attive, valori globali, posizione dei canali) e invia solo ciò che è cambiato
+    rispetto all'ultimo invio. Un token bucket limita i messaggi al secondo: quello che non
+    rientra nel budget resta nel diff e parte al giro successivo, la porta non si satura mai.
+    """
+    def __init__(self, port, midi_manager, rate_hz=30, max_messages_per_s=500, channel=0):
+        self.port = port
+        self.midi = midi_manager
+        self.rate_hz = rate_hz
+        self.max_messages_per_s = max_messages_per_s
+        self.channel = channel # Canale MIDI di uscita (le mappature in ingresso sono omni)
+
+        self._sent = {} # {codice: valore quantizzato già presente sul controller}
+        self._tokens = float(max_messages_per_s) / rate_hz
+        self.messages_sent = 0
+        self.messages_deferred = 0
+
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def seen(self, code, val16):
+        """Valore appena ricevuto dal controller: ce l'ha già, non va rimandato indietro."""
+        kind = code >> 14
+        if kind != MIDI_NOTE: self._sent[code] = quantize(kind, val16)
+
+    def resync(self):
+        """Dimentica lo stato inviato: al prossimo giro si rimanda tutto (es. controller ricollegato)."""
+        self._sent = {}
+
+    def desired_state(self):
+        """{codice: valore a 16 bit} per tutte le sorgenti mappate."""
+        engine, dmx, data = self.midi.engine, self.midi.dmx, self.midi.data
+        active = {(kind, name) for _, kind, name, _, _ in engine.state["playbacks"]}
+        live = dmx.layer_frames("live").reshape(-1)
+        globals_ = data.get("globals", {})
+        state = {}
+        for code, (channels, targets) in self.midi.dispatch.entries.items():
+            value = channels.read(live) if channels is not None else None
+            lit = None
+            for t in targets:
+                if t.kind in ("sc", "ch", "cue"):
+                    lit = lit or (t.kind, t.name) in active
+                elif t.kind == "global" and t.name in globals_:
+                    value = int(globals_[t.name]) * 257
+                elif t.kind == "grp" and value is None:
+                    value = t.channels.read(live)
+            if lit is not None: value = 65535 if lit else 0 # LED: stato della playback
+            if value is not None: state[code] = value
+        return state
+
+    def _messages(self, code, q):
+        kind, num, ch = code >> 14, code & 0x3fff, self.channel
+        if kind == MIDI_NOTE:
+            return [mido.Message('note_on', channel=ch, note=num, velocity=q)]
+        if kind == MIDI_CC:
+            return [mido.Message('control_change', channel=ch, control=num, value=q)]
+        if kind == MIDI_CC14:
+            return [mido.Message('control_change', channel=ch, control=num, value=q >> 7),
+                    mido.Message('control_change', channel=ch, control=num + 32, value=q & 0x7f)]
+        if kind == MIDI_PB:
+            return [mido.Message('pitchwheel', channel=num, pitch=q - 8192)]
+        return [mido.Message('control_change', channel=ch, control=99, value=num >> 7),
+                mido.Message('control_change', channel=ch, control=98, value=num & 0x7f),
+                mido.Message('control_change', channel=ch, control=6, value=q >> 7),
+                mido.Message('control_change', channel=ch, control=38, value=q & 0x7f)]
+
+    def update(self):
+        """Un giro di feedback: diff rispetto all'ultimo invio, nei limiti del budget."""
+        budget_max = float(self.max_messages_per_s) / self.rate_hz * 2 # Piccolo burst consentito
+        self._tokens = min(budget_max, self._tokens + float(self.max_messages_per_s) / self.rate_hz)
+        sent = self._sent
+        for code, val16 in self.desired_state().items():
+            kind = code >> 14
+            q = quantize(kind, val16)
+            if sent.get(code) == q: continue
+            cost = _MESSAGES_PER_KIND[kind]
+            if self._tokens < cost:
+                self.messages_deferred += 1
+                continue
+            for msg in self._messages(code, q):
+                self.port.send(msg)
+            self._tokens -= cost
+            self.messages_sent += cost
+            sent[code] = q
+
+    def _loop(self):
+        period = 1.0 / self.rate_hz
+        while self.running:
+            t0 = time.perf_counter()
+            try:
+                self.update()
+            except Exception as e:
+                print(f"[MIDI] Errore feedback: {e}")
+            time.sleep(max(0.0, period - (time.perf_counter() - t0)))
+
+    def stats(self):
+        return {"messages_sent": self.messages_sent, "messages_deferred": self.messages_deferred}
+
+    def close(self):
+        self.running = False
+        if self.thread.is_alive(): self.thread.join(1.0)
+        try: self.port.close()
+        except Exception: pass
 
 class MidiManager(QObject):
+    """
+    Ingresso MIDI. Il callback di mido non applica nulla: accoda (codice, valore) in una deque e
+    ritorna. Lo stadio di ingresso gira nel thread DMX a ogni frame: i CC della stessa raffica
+    vengono fusi nell'ultimo valore per controllo, le note si applicano tutte in ordine.
+    request_ui_refresh viene emesso al massimo ui_refresh_hz volte al secondo.
+    """
     learn_status_changed = pyqtSignal(bool, str)
     request_ui_refresh = pyqtSignal()
-    new_midi_message = pyqtSignal(str)
     
-    def __init__(self, playback_engine, dmx_ctrl, data_store):
+    def __init__(self, playback_engine, dmx_ctrl, data_store, ui_refresh_hz=15):
         super().__init__()
         self.engine = playback_engine
+        self.clock = playback_engine.clock       # MIDI Clock -> tempo/fase dei chase
+        self.timecode = playback_engine.timecode # MIDI Time Code
         self.dmx = dmx_ctrl
         self.data = data_store
         
         self.input_port = None
+        self.feedback = None # MidiFeedback sulla porta di uscita (opzionale)
         self.is_learning = False
         self.learn_target = None
         self.selected_channels = set()
+        self._learn_msb = None # CC 0-31 in attesa del LSB durante il learn
+        self._mapped = False
+        self._t_rx = 0
+        
+        self.last_message = None # Ultimo messaggio (il testo del monitor si formatta solo alla lettura)
+        self.dispatch = MidiDispatch(data_store)
+        
+        # Stadio di ingresso (coda svuotata a ogni frame nel thread DMX)
+        self._queue = collections.deque()
+        self._cc_state = [[0] * 32 + [-1, 0] for _ in range(16)] # Per canale: valori 14 bit CC 0-31, parametro NRPN, data entry
+        self.ui_refresh_hz = ui_refresh_hz
+        self._ui_dirty = False
+        self._last_ui_ns = 0
+        self.reset_input_stats()
+        self.dmx.add_frame_hook(self._process_input)
+
+    def reset_input_stats(self):
+        self.received = 0   # Messaggi CC/nota/pitchbend ricevuti
+        self.unmapped = 0   # ...di cui senza mappatura
+        self.applied = 0    # Valori effettivamente applicati dopo la fusione dei CC
+        self.coalesced = 0  # Valori continui scartati perché superati da un valore più recente nello stesso frame
+        self.ui_refreshes = 0
+
+    def get_input_stats(self):
+        """Messaggi ricevuti vs applicati: la differenza sono i CC fusi nella stessa raffica."""
+        return {"received": self.received, "unmapped": self.unmapped, "applied": self.applied,
+                "coalesced": self.coalesced, "ui_refreshes": self.ui_refreshes}
+
+    def rebuild_dispatch(self):
+        """Da chiamare dopo ogni modifica di map/rem/groups: la nuova tabella sostituisce la vecchia in blocco."""
+        self.dispatch = MidiDispatch(self.data)
+
+    def monitor_text(self):
+        msg = self.last_message
+        return format_message(msg) if msg is not None else None
 
     def open_port(self, name):
         try:
@@ -29,98 +332,201 @@ class MidiManager(QObject):
             print(f"[MIDI] ERRORE CONNESSIONE: {err_msg}")
             return err_msg
 
+    def open_output(self, name, **kwargs):
+        """Apre la porta di uscita per il feedback (LED/fader). Ritorna None o il messaggio di errore."""
+        try:
+            self.close_output()
+            self.feedback = MidiFeedback(mido.open_output(name), self, **kwargs)
+            print(f"[MIDI] Feedback attivo su: {name}")
+            return None
+        except Exception as e:
+            print(f"[MIDI] ERRORE USCITA: {e}")
+            return str(e)
+
+    def close_output(self):
+        if self.feedback:
+            self.feedback.close()
+            self.feedback = None
+
     def toggle_learn(self, target="chans"):
         self.is_learning = not self.is_learning
         self.learn_target = target if self.is_learning else None
+        self._learn_msb = None
         self.learn_status_changed.emit(self.is_learning, self.learn_target)
 
+    def _sync_message(self, msg, t, t_ns):
+        """Messaggi di sincronizzazione: applicati subito, con il timestamp di arrivo."""
+        if t == 'clock': self.clock.clock(t_ns)
+        elif t == 'quarter_frame': self.timecode.quarter_frame(msg.frame_type, msg.frame_value, t_ns)
+        elif t == 'start': self.clock.start()
+        elif t == 'stop': self.clock.stop()
+        elif t == 'continue': self.clock.resume()
+        elif t == 'songpos': self.clock.song_position(msg.pos)
+        elif t == 'sysex':
+            data = msg.data # Full frame MTC: F0 7F <dev> 01 01 hh mm ss ff F7
+            if len(data) >= 8 and data[0] == 0x7f and data[2] == 0x01 and data[3] == 0x01:
+                self.timecode.full_frame(data[4], data[5], data[6], data[7], t_ns)
+        else:
+            return False
+        return True
+
     def _callback(self, msg):
-        # DEBUG LOG
-        try:
-            debug_parts = [msg.type]
-            if hasattr(msg, 'channel'): debug_parts.append(f"Ch:{msg.channel}")
-            if hasattr(msg, 'control'): debug_parts.append(f"CC:{msg.control}")
-            if hasattr(msg, 'note'): debug_parts.append(f"Note:{msg.note}")
-            if hasattr(msg, 'value'): debug_parts.append(f"Val:{msg.value}")
-            self.new_midi_message.emit(" ".join(debug_parts))
-        except: pass
-
-        sig_key = None
-        if msg.type == 'control_change': sig_key = f"cc_{msg.control}"
-        elif msg.type in ['note_on', 'note_off']: sig_key = f"note_{msg.note}"
+        t_ns = time.perf_counter_ns()
+        t = msg.type
+        if t == 'clock' or t == 'quarter_frame': # Realtime: non passano dal monitor né dalla coda
+            self._sync_message(msg, t, t_ns)
+            return
+        self.last_message = msg
+        if self._sync_message(msg, t, t_ns): return
+        
+        self._mapped = False
+        self._t_rx = t_ns
+        if t == 'control_change':
+            v = msg.value
+            self._event((MIDI_CC << 14) | msg.control, int(v * 2.007), v * 65535 // 127, v > 64)
+            if msg.control < 64 or msg.control >= 96: self._high_res_cc(msg.channel, msg.control, v)
+        elif t == 'note_on' or t == 'note_off':
+            trigger = t == 'note_on' and msg.velocity > 0
+            self._event((MIDI_NOTE << 14) | msg.note, 255 if trigger else 0, 65535 if trigger else 0, trigger)
+        elif t == 'pitchwheel':
+            self._event14((MIDI_PB << 14) | msg.channel, msg.pitch + 8192)
+        else:
+            return
         
-        if not sig_key: return
-
         # --- LEARNING MODE (MODIFICATO PER MULTI-MAPPING) ---
         if self.is_learning:
-            if self.learn_target == "chans":
-                # Mappatura canali diretti (Grid) - Questa resta esclusiva per semplicità
-                self.data["map"][sig_key] = list(self.selected_channels)
-            else:
-                # Mappatura Remota (Scene, Chase, Global) - SUPPORTO LISTE
-                if sig_key in self.data["rem"]:
-                    current = self.data["rem"][sig_key]
-                    # Se è già una lista, aggiungi. Se è stringa, converti in lista.
-                    if isinstance(current, list):
-                        if self.learn_target not in current:
-                            current.append(self.learn_target)
-                    elif current != self.learn_target:
-                        self.data["rem"][sig_key] = [current, self.learn_target]
+            self._learn_message(msg, t)
+            return
+        self.received += 1
+        if not self._mapped: self.unmapped += 1
+
+    def _high_res_cc(self, channel, cc, v):
+        """Coppie MSB/LSB a 14 bit e NRPN (stato per canale MIDI)."""
+        state = self._cc_state[channel]
+        if cc < 32:
+            state[cc] = v << 7 # Il MSB azzera il LSB
+            self._event14((MIDI_CC14 << 14) | cc, state[cc])
+        elif cc < 64:
+            state[cc - 32] = (state[cc - 32] & 0x3f80) | v
+            self._event14((MIDI_CC14 << 14) | (cc - 32), state[cc - 32])
+        elif cc == 99: state[32] = (v << 7) | (state[32] & 0x7f)                # NRPN MSB
+        elif cc == 98: state[32] = (state[32] & 0x3f80) | v                     # NRPN LSB
+        elif cc == 101 or cc == 100: state[32] = -1                              # RPN: niente NRPN
+        if (cc == 6 or cc == 38) and state[32] >= 0:
+            if cc == 6: state[33] = v << 7
+            else: state[33] = (state[33] & 0x3f80) | v
+            self._event14((MIDI_NRPN << 14) | state[32], state[33])
+
+    def _event14(self, code, v14):
+        val16 = v14 * 65535 // 16383
+        self._event(code, val16 >> 8, val16, v14 >= 8192)
+
+    def _event(self, code, val8, val16, trigger):
+        if self.is_learning or code not in self.dispatch.entries: return
+        self._mapped = True
+        self._queue.append((code, val8, val16, trigger, self._t_rx))
+
+    def _learn_message(self, msg, t):
+        """
+        In learn vince la sorgente a risoluzione più alta: un CC 0-31 (MSB) resta in attesa del
+        messaggio successivo; se è il suo LSB si mappa la coppia a 14 bit, altrimenti il CC a 7 bit.
+        """
+        if t == 'pitchwheel': return self._learn(f"pb_{msg.channel}")
+        if t != 'control_change': return self._learn(f"note_{msg.note}")
+        
+        cc, pending = msg.control, self._learn_msb
+        nrpn = self._cc_state[msg.channel][32]
+        if cc in (98, 99, 100, 101): return # Selezione parametro (N)RPN: si aspetta il data entry
+        if (cc == 6 or cc == 38) and nrpn >= 0: return self._learn(f"nrpn_{nrpn}")
+        if cc < 32:
+            if pending == cc: return self._learn(f"cc_{cc}") # MSB ripetuto senza LSB: controller a 7 bit
+            self._learn_msb = cc
+            return
+        if pending is not None:
+            return self._learn(f"cc14_{pending}" if cc == pending + 32 else f"cc_{pending}")
+        self._learn(f"cc_{cc}")
+
+    def _process_input(self, t_ns):
+        """Hook del thread DMX: applica i messaggi arrivati dall'ultimo frame."""
+        queue = self._queue
+        if queue:
+            latest = {}
+            discrete = self.dispatch.discrete
+            while queue:
+                event = queue.popleft()
+                code = event[0]
+                if code in discrete:
+                    self._apply(*event) # Note e trigger: applicati in ordine, nessun fronte perso
                 else:
-                    # Nuova mappatura
-                    self.data["rem"][sig_key] = self.learn_target
-            
-            self.is_learning = False
-            self.learn_status_changed.emit(False, None)
+                    if code in latest: self.coalesced += 1
+                    latest[code] = event # Fader/canali: conta solo l'ultimo valore della raffica
+            for event in latest.values():
+                self._apply(*event)
+        
+        if self._ui_dirty and t_ns - self._last_ui_ns >= 1_000_000_000 // max(1, self.ui_refresh_hz):
+            self._ui_dirty = False
+            self._last_ui_ns = t_ns
+            self.ui_refreshes += 1
             self.request_ui_refresh.emit()
-            return
 
+    def _apply(self, code, raw_val, val16, trigger, t_rx):
         # --- EXECUTION MODE ---
+        entry = self.dispatch.entries.get(code)
+        if entry is None: return
+        self.applied += 1
+        self.dmx.latency.written(code, t_rx)
+        feedback = self.feedback
+        if feedback: feedback.seen(code, val16) # Il controller mostra già questo valore
+        channels, targets = entry
+        needs_refresh = False
+        live = self.dmx.layer_frames("live").reshape(-1)
 
         # 1. Direct Channel Mapping
-        if sig_key in self.data["map"]:
-            val = int(msg.value * 2.007) if msg.type == 'control_change' else (255 if msg.type=='note_on' and msg.velocity>0 else 0)
-            for ch in self.data["map"][sig_key]:
-                self.dmx.live_buffer[ch] = val
-            self.request_ui_refresh.emit()
+        if channels is not None:
+            channels.write(live, raw_val, val16)
+            needs_refresh = True
 
-        # 2. Remote Triggers (Gestione Liste)
-        if sig_key in self.data["rem"]:
-            # Normalizza tutto a lista per iterare facilmente
-            targets = self.data["rem"][sig_key]
-            if not isinstance(targets, list):
-                targets = [targets]
-
-            needs_refresh = False
+        # 2. Remote Triggers
+        for target in targets:
+            t_type = target.kind
+            if t_type == "grp":
+                target.channels.write(live, raw_val, val16)
+                needs_refresh = True
             
-            for full_target in targets:
-                target = full_target.split(":", 1)
-                t_type, t_name = target[0], target[1]
-                
-                # Calcolo valore raw
-                raw_val = 0
-                if msg.type == 'control_change':
-                    raw_val = int(msg.value * 2.007)
-                elif msg.type == 'note_on' and msg.velocity > 0:
-                    raw_val = 255
-
-                # Esecuzione in base al tipo
-                if t_type == "grp":
-                    group_chans = self.data["groups"].get(t_name, [])
-                    for ch in group_chans:
-                        self.dmx.live_buffer[ch] = raw_val
+            elif t_type == "global":
+                if target.name in self.data["globals"]:
+                    self.data["globals"][target.name] = raw_val
                     needs_refresh = True
-                
-                elif t_type == "global":
-                    if t_name in self.data["globals"]:
-                        self.data["globals"][t_name] = raw_val
-                        needs_refresh = True
-
-                # Trigger standard (solo se superano soglia o note on)
-                elif (msg.type == 'note_on' and msg.velocity > 0) or (msg.type == 'control_change' and msg.value > 64):
-                    if t_type == "sc": self.engine.toggle_scene(t_name)
-                    elif t_type == "ch": self.engine.toggle_chase(t_name)
-                    elif t_type == "cue": self.engine.toggle_cue(t_name)
-            
-            if needs_refresh:
-                self.request_ui_refresh.emit()
\ No newline at end of file
+
+            # Trigger standard (solo se superano soglia o note on)
+            elif trigger:
+                if t_type == "sc": self.engine.toggle_scene(target.name)
+                elif t_type == "ch": self.engine.toggle_chase(target.name)
+                elif t_type == "cue": self.engine.toggle_cue(target.name)
+        
+        if needs_refresh:
+            self._ui_dirty = True
+
+    def _learn(self, sig_key):
+        self._learn_msb = None
+        if self.learn_target == "chans":
+            # Mappatura canali diretti (Grid) - Questa resta esclusiva per semplicità
+            self.data["map"][sig_key] = list(self.selected_channels)
+        else:
+            # Mappatura Remota (Scene, Chase, Global) - SUPPORTO LISTE
+            if sig_key in self.data["rem"]:
+                current = self.data["rem"][sig_key]
+                # Se è già una lista, aggiungi. Se è stringa, converti in lista.
+                if isinstance(current, list):
+                    if self.learn_target not in current:
+                        current.append(self.learn_target)
+                elif current != self.learn_target:
+                    self.data["rem"][sig_key] = [current, self.learn_target]
+            else:
+                # Nuova mappatura
+                self.data["rem"][sig_key] = self.learn_target
+        
+        self.rebuild_dispatch()
+        self.is_learning = False
+        self.learn_status_changed.emit(False, None)
+        self.request_ui_refresh.emit()
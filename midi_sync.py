@@ -0,0 +1,186 @@
+import time
+
+PPQN = 24 # MIDI Clock: 24 impulsi per quarto
+MTC_RATES = (24.0, 25.0, 29.97, 30.0) # Codice rate nel quarter frame 7 / full frame
+
+# Sincronizzazione dei chase
+SYNC_FREE = "free"         # Tempo libero (hold/fade in ms)
+SYNC_BEAT = "beat"         # Uno step ogni 'beats' quarti del MIDI Clock
+SYNC_BAR = "bar"           # Uno step ogni 'beats' battute
+SYNC_TIMECODE = "timecode" # Posizione del chase ricavata dal MIDI Time Code
+SYNC_AUDIO = "audio"       # Uno step ogni 'beats' quarti del tempo stimato dall'audio (beat_tracker)
+SYNC_GRID = "grid"         # Uno step ogni 'beats' quarti della griglia pre-analizzata della traccia (audio_offline)
+
+class MidiClock:
+    """
+    Tracker di tempo e fase del MIDI Clock (24 ppqn), Start/Stop/Continue e Song Position.
+    Gli impulsi arrivano con il jitter del driver/USB: un filtro alpha-beta stima l'istante
+    dell'ultimo impulso e il periodo, così la fase si può leggere per qualunque istante
+    (es. la scadenza del frame DMX) senza seguire il jitter dei singoli messaggi.
+    Lo stato è una tupla sostituita in blocco: il thread MIDI scrive, il thread DMX legge senza lock.
+    """
+    LOCK_TICKS = PPQN # Impulsi di media prima di passare al filtro
+    LOST_NS = 500_000_000 # Senza impulsi per mezzo secondo il clock si considera perso
+
+    def __init__(self, alpha=0.05, beta=0.002, beats_per_bar=4):
+        self.alpha = alpha
+        self.beta = beta
+        self.beats_per_bar = beats_per_bar
+        self.reset()
+
+    def reset(self):
+        self.running = False
+        self._ticks = -1       # Posizione (in impulsi) dell'ultimo impulso ricevuto: il prossimo è _ticks + 1
+        self._t_first = None
+        self._count = 0        # Impulsi ricevuti dall'aggancio
+        self._t_est = None     # Istante stimato dell'ultimo impulso (ns)
+        self._period = None    # Periodo stimato tra impulsi (ns)
+        self._last_rx = 0
+        self._state = (False, -1, None, None)
+        self._last_beats = 0.0
+
+    def _publish(self):
+        self._state = (self.running, self._ticks, self._t_est, self._period)
+
+    # --- INGRESSO (thread MIDI) ---
+    def clock(self, t_ns=None):
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        if self._t_est is not None and t_ns - self._last_rx > self.LOST_NS:
+            self._t_first = None # Clock ripartito dopo una pausa: riaggancio
+        self._last_rx = t_ns
+        if self.running: self._ticks += 1
+
+        if self._t_first is None:
+            self._t_first = t_ns
+            self._count = 0
+            self._t_est = t_ns
+        elif self._count < self.LOCK_TICKS or self._period is None:
+            # Aggancio: periodo medio dal primo impulso
+            self._count += 1
+            self._period = (t_ns - self._t_first) / self._count
+            self._t_est = t_ns
+        else:
+            predicted = self._t_est + self._period
+            err = t_ns - predicted
+            if abs(err) > self._period * 4: # Salto di tempo o impulsi persi: riaggancio
+                self._t_first = t_ns
+                self._count = 0
+                self._t_est = t_ns
+            else:
+                self._t_est = predicted + self.alpha * err
+                self._period += self.beta * err
+        self._publish()
+
+    def start(self):
+        """Start: il prossimo impulso è il primo quarto del brano."""
+        self._ticks = -1
+        self._last_beats = 0.0
+        self.running = True
+        self._publish()
+
+    def stop(self):
+        self.running = False
+        self._publish()
+
+    def resume(self):
+        """Continue: riprende dalla posizione corrente."""
+        self.running = True
+        self._publish()
+
+    def song_position(self, sixteenths):
+        """Song Position Pointer (in sedicesimi = 6 impulsi): il prossimo impulso cade sulla posizione."""
+        self._ticks = sixteenths * 6 - 1 # Da fermo come in corsa: clock() avanza prima di usarla
+        self._last_beats = 0.0
+        self._publish()
+
+    # --- LETTURA (qualunque thread) ---
+    @property
+    def locked(self):
+        """True se c'è un tempo stimato e il clock sta arrivando."""
+        return self._state[3] is not None and time.perf_counter_ns() - self._last_rx < self.LOST_NS
+
+    @property
+    def bpm(self):
+        period = self._state[3]
+        return 60e9 / (period * PPQN) if period else 0.0
+
+    def beats(self, t_ns=None):
+        """Posizione in quarti all'istante t_ns (interpolata tra gli impulsi, mai all'indietro)."""
+        running, ticks, t_est, period = self._state
+        if not running: return (ticks + 1) / PPQN # Da fermo: posizione da cui riprende il Continue
+        if period is None or ticks < 0: return max(0, ticks) / PPQN
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        frac = min(2.0, (t_ns - t_est) / period) # Se il clock si ferma non si estrapola all'infinito
+        beats = max(0.0, (ticks + frac) / PPQN)
+        if beats < self._last_beats and self._last_beats - beats < 0.5 / PPQN:
+            beats = self._last_beats # Correzioni del filtro sotto il mezzo impulso: fase monotona
+        self._last_beats = beats
+        return beats
+
+    def bars(self, t_ns=None):
+        return self.beats(t_ns) / self.beats_per_bar
+
+class MtcDecoder:
+    """
+    Decodifica MIDI Time Code (quarter frame e full frame SysEx) in una posizione in secondi.
+    La differenza tra timecode e orologio locale viene filtrata, quindi la posizione letta
+    all'istante del frame DMX è continua anche se i quarter frame arrivano con jitter.
+    """
+    LOST_NS = 250_000_000 # Oltre 1/4 di secondo senza quarter frame il timecode è fermo
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self._pieces = [0] * 8
+        self._seen = 0
+        self.fps = 25.0
+        self._offset = None # Timecode (s) - orologio locale (s)
+        self._position = 0.0 # Ultima posizione nota (timecode fermo)
+        self._last_rx = 0
+
+    def quarter_frame(self, frame_type, frame_value, t_ns=None):
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        self._pieces[frame_type] = frame_value & 0x0f
+        self._seen |= 1 << frame_type
+        self._last_rx = t_ns
+        if frame_type != 7 or self._seen != 0xff: return
+
+        p = self._pieces
+        frames = p[0] | (p[1] << 4)
+        seconds = p[2] | (p[3] << 4)
+        minutes = p[4] | (p[5] << 4)
+        hours = p[6] | ((p[7] & 0x1) << 4)
+        self.fps = MTC_RATES[(p[7] >> 1) & 0x3]
+        # Il timecode completo descrive l'inizio della sequenza: sono passati 2 frame per riceverla
+        position = hours * 3600 + minutes * 60 + seconds + (frames + 2) / self.fps
+        self._track(position, t_ns)
+
+    def full_frame(self, hours_byte, minutes, seconds, frames, t_ns=None):
+        """Full frame (locate): posizione assoluta, timecode fermo."""
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        self.fps = MTC_RATES[(hours_byte >> 5) & 0x3]
+        self._position = (hours_byte & 0x1f) * 3600 + minutes * 60 + seconds + frames / self.fps
+        self._offset = None
+        self._seen = 0
+
+    def _track(self, position, t_ns):
+        local = t_ns / 1e9
+        offset = position - local
+        if self._offset is None or abs(offset - self._offset) > 0.1: # Primo aggancio o salto
+            self._offset = offset
+        else:
+            self._offset += self.alpha * (offset - self._offset)
+        self._position = position
+
+    @property
+    def running(self):
+        return self._offset is not None and time.perf_counter_ns() - self._last_rx < self.LOST_NS
+
+    def seconds(self, t_ns=None):
+        """Posizione del timecode in secondi all'istante t_ns."""
+        offset = self._offset
+        if offset is None or not self.running: return self._position
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        return t_ns / 1e9 + offset
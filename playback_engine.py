@@ -1,7 +1,172 @@
+import os
 import time
+import threading
+import itertools
+import collections
+import numpy as np
 from PyQt6.QtCore import QObject, pyqtSignal
+from dmx_engine import frame_index
+from crossfade import CrossfadeKernel, FADE_LINEAR
+from midi_sync import MidiClock, MtcDecoder, SYNC_FREE, SYNC_BEAT, SYNC_BAR, SYNC_TIMECODE, SYNC_AUDIO, SYNC_GRID
+from beat_tracker import TempoTracker
+import cue_store
+
+STACK_LAYER = "stack"
+_EMPTY_INDEX = np.zeros(0, dtype=np.intp)
+
+class CompiledScene:
+    """Scena pronta per il playback: frame denso (n_universi x 513) + indice sparso dei canali usati."""
+    __slots__ = ("source", "size", "frame", "flat", "index", "values")
+
+    def __init__(self, source, universes):
+        self.source = source # dict originale, per riconoscere una scena sostituita
+        self.size = len(source)
+        self.frame = np.zeros((universes, 513), dtype=np.uint8)
+        self.flat = self.frame.reshape(-1)
+        used = []
+        for k, v in source.items():
+            i = frame_index(k)
+            if i < len(self.flat):
+                self.flat[i] = v
+                used.append(i)
+        self.index = np.array(sorted(used), dtype=np.intp) # Posizioni nel frame piatto
+        self.values = self.flat[self.index]
+
+class SceneCache:
+    """
+    Cache delle scene compilate, costruite alla prima richiesta.
+    Una voce viene ricompilata se la scena è stata sostituita (dict diverso o di lunghezza diversa)
+    o se cambia il numero di universi; tutta la cache si svuota se data_store["scenes"]
+    viene rimpiazzato (es. caricamento dati). invalidate() forza la ricompilazione.
+    """
+    def __init__(self, data_store):
+        self.data = data_store
+        self._scenes = None
+        self._cache = {}
+        self._empty = {}
+
+    def get(self, name, universes):
+        scenes = self.data["scenes"]
+        if scenes is not self._scenes:
+            self._cache.clear()
+            self._scenes = scenes
+        
+        source = scenes.get(name)
+        if source is None:
+            self._cache.pop(name, None)
+            return self._empty_scene(universes)
+        
+        entry = self._cache.get(name)
+        if entry is None or entry.source is not source or entry.size != len(source) or len(entry.frame) != universes:
+            entry = CompiledScene(source, universes)
+            self._cache[name] = entry
+        return entry
+
+    def _empty_scene(self, universes):
+        entry = self._empty.get(universes)
+        if entry is None:
+            entry = self._empty[universes] = CompiledScene({}, universes)
+        return entry
+
+    def invalidate(self, name=None):
+        if name is None: self._cache.clear()
+        else: self._cache.pop(name, None)
+
+class Playback:
+    """
+    Una playback indipendente dello stack (scena, chase o cue) con priorità e master propri.
+    Produce un'uscita sparsa: posizioni nel frame piatto (n_universi x 513) e valori.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, kind, name, priority=0, master=255):
+        self.id = next(Playback._ids)
+        self.kind = kind # 'sc', 'ch', 'cue'
+        self.name = name
+        self.priority = priority
+        self.master = master
+        
+        self.start_ms = time.perf_counter_ns() // 1_000_000 # Stesso orologio delle scadenze dei frame DMX
+        self.time_offset = 0 # Offset per forzare avanzamento manuale/audio nei chase
+        self.player = None # CuePlayer (solo cue)
+        
+        self.kernel = CrossfadeKernel()
+        self._pair = (None, None, _EMPTY_INDEX) # Ultima coppia di step e unione dei loro canali
+        self._values = np.zeros(0, dtype=np.uint8)
+
+    def union_index(self, sc_a, sc_b):
+        """Canali usati da almeno uno dei due step (ricalcolato solo al cambio di step)."""
+        a, b, index = self._pair
+        if a is not sc_a or b is not sc_b:
+            index = np.union1d(sc_a.index, sc_b.index)
+            self._pair = (sc_a, sc_b, index)
+        return index
+
+    def values_buffer(self, size):
+        if len(self._values) != size: self._values = np.zeros(size, dtype=np.uint8)
+        return self._values
+
+    def close(self):
+        if self.player:
+            self.player.close()
+            self.player = None
+
+class PlaybackStack:
+    """
+    Merge delle playback attive in un unico layer del DMXController.
+    Ogni playback contribuisce (indici, valori, priorità, master); il merge è un solo passaggio
+    vettoriale sui canali attivi: chiave = priorità * 256 + valore scalato col master, ridotta con
+    np.maximum.at per canale. Vince la priorità più alta, a parità di priorità vale HTP.
+    Il costo cresce con i canali attivi, non con (numero di playback x 512).
+    """
+    MAX_PRIORITY = 1000
+
+    def __init__(self):
+        self._keys = np.zeros(0, dtype=np.int32)
+        self._touched = _EMPTY_INDEX
+
+    def merge(self, parts, out):
+        """parts: [(indici, valori, priorità, master)]; out: vista piatta sul layer."""
+        if len(self._keys) != len(out):
+            self._keys = np.full(len(out), -1, dtype=np.int32)
+            self._touched = _EMPTY_INDEX
+            out.fill(0)
+        
+        if not parts:
+            touched = _EMPTY_INDEX
+        elif len(parts) == 1:
+            index, values, _, master = parts[0]
+            touched = index
+            out[index] = values if master >= 255 else (values.astype(np.uint16) * master // 255)
+        else:
+            index = np.concatenate([p[0] for p in parts])
+            keys = np.concatenate([
+                (values.astype(np.int32) * max(0, min(255, master)) // 255) + (max(0, min(self.MAX_PRIORITY, prio)) << 8)
+                for _, values, prio, master in parts
+            ])
+            key_buf = self._keys
+            np.maximum.at(key_buf, index, keys)
+            touched = np.unique(index)
+            out[touched] = key_buf[touched] & 0xff
+            key_buf[touched] = -1
+        
+        # Azzera solo i canali non più usati (niente passaggio per zero sui canali che restano attivi)
+        if len(self._touched):
+            out[np.setdiff1d(self._touched, touched, assume_unique=True)] = 0
+        self._touched = touched
+
+    def clear(self, out):
+        out.fill(0)
+        self._touched = _EMPTY_INDEX
 
 class PlaybackEngine(QObject):
+    """
+    Motore di playback. Il tick gira nel thread di invio DMX, un frame di calcolo per ogni frame
+    inviato (start()), quindi il timing non dipende dal carico della GUI.
+    GUI e MIDI non toccano lo stato direttamente: i comandi vanno in una coda (deque, append e
+    popleft atomici senza lock) svuotata all'inizio di ogni frame. La GUI legge 'state', una
+    fotografia immutabile sostituita a ogni cambiamento, e riceve state_changed (queued).
+    """
     state_changed = pyqtSignal() 
 
     def __init__(self, dmx_ctrl, data_store):
@@ -9,41 +174,131 @@ class PlaybackEngine(QObject):
         self.dmx = dmx_ctrl
         self.data = data_store
         
-        self.active_sc = None
-        self.active_ch = None
-        self.active_cue = None
+        # Playback attive: modificate solo nel thread del motore, lista sostituita in blocco
+        self.playbacks = []
+        self.commands = collections.deque()
+        self.state = {"playbacks": (), "recording": False}
+        self.running = False
+        self._frame_ns = None # Scadenza del frame in corso: i comandi vedono lo stesso istante del render
+        self.stack = PlaybackStack()
+        self.dmx.add_layer(STACK_LAYER)
         
-        self.fade_start_ch = 0
-        self.play_idx_cue = 0
         self.is_recording_cue = False
-        self.recorded_stream = []
+        self.recorder = None # CueWriter: la registrazione va su disco in streaming
+        self._rec_lock = threading.Lock()
+        
+        self.scenes = SceneCache(data_store)
         
-        # Offset per forzare avanzamento manuale/audio nei chase
-        self.chase_time_offset = 0
+        # Riferimenti di tempo esterni (alimentati da MidiManager e AudioReactor)
+        self.clock = MidiClock()
+        self.timecode = MtcDecoder()
+        self.audio_tempo = TempoTracker()
+        self.grid = None # BeatGrid della traccia analizzata offline (audio_offline)
+        self._grid_triggers = () # (quarto, tipo, nome) ordinati
+        self._grid_beat = None
 
-    def tick(self):
-        if self.is_recording_cue:
-            self.recorded_stream.append(list(self.dmx.output_frame))
-            return
+    # --- THREAD DEL MOTORE ---
+    def start(self):
+        """Aggancia il tick al ciclo di invio DMX (stesso thread, stessa cadenza)."""
+        if self.running: return
+        self.running = True
+        self.dmx.add_frame_hook(self._engine_frame)
 
-        if self.active_ch:
-            chase_config = self.data["chases"].get(self.active_ch)
-            if chase_config:
-                self._process_chase(chase_config)
-
-        if self.active_cue:
-            cue_data = self.data["cues"].get(self.active_cue, {}).get("data", [])
-            if cue_data:
-                if self.play_idx_cue < len(cue_data):
-                    self.dmx.cue_buffer = bytearray(cue_data[self.play_idx_cue])
-                    self.play_idx_cue += 1
-                else:
-                    self.play_idx_cue = 0
-
-    def _process_chase(self, config):
-        steps = config["steps"]
-        if not steps: return
+    def stop(self):
+        self.running = False
+        self.dmx.remove_frame_hook(self._engine_frame)
+
+    def post(self, fn, *args):
+        """Accoda un comando: viene eseguito nel thread del motore prima del prossimo tick."""
+        if self.running: self.commands.append((fn, args))
+        else: fn(*args) # Motore fermo: esecuzione diretta
+
+    def _engine_frame(self, t_ns):
+        self._frame_ns = t_ns
+        commands = self.commands
+        while commands:
+            fn, args = commands.popleft()
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Errore comando playback: {e}")
+        self.tick(t_ns)
+
+    def _publish(self):
+        self.state = {
+            "playbacks": tuple((pb.id, pb.kind, pb.name, pb.priority, pb.master) for pb in self.playbacks),
+            "recording": self.is_recording_cue,
+        }
+        self.state_changed.emit()
+
+    # --- STATO (letto dalla fotografia, compatibile con la selezione singola della GUI) ---
+    def _last_active(self, kind):
+        for _, k, name, _, _ in reversed(self.state["playbacks"]):
+            if k == kind: return name
+        return None
+
+    @property
+    def active_sc(self): return self._last_active("sc")
+    @property
+    def active_ch(self): return self._last_active("ch")
+    @property
+    def active_cue(self): return self._last_active("cue")
 
+    def active_names(self, kind):
+        return [name for _, k, name, _, _ in self.state["playbacks"] if k == kind]
+
+    # --- TICK ---
+    def tick(self, t_ns=None):
+        """Calcola il frame delle playback per l'istante t_ns (scadenza del frame DMX)."""
+        if self.is_recording_cue: return # La registrazione avviene nel thread DMX (_record_frame)
+        if t_ns is None: t_ns = time.perf_counter_ns()
+        if self._grid_triggers: self._run_grid_triggers(t_ns)
+
+        universes = self.dmx.universe_count
+        parts = []
+        for pb in self.playbacks:
+            if pb.master <= 0: continue
+            if pb.kind == "sc":
+                res = self._render_scene(pb, universes)
+            elif pb.kind == "ch":
+                res = self._render_chase(pb, universes, t_ns)
+            elif pb.player:
+                res = self._render_cue(pb.player, universes, t_ns)
+            else:
+                res = None
+            if res is not None and len(res[0]):
+                parts.append((res[0], res[1], pb.priority, pb.master))
+        
+        self.stack.merge(parts, self.dmx.layer_frames(STACK_LAYER).reshape(-1))
+
+    def _render_scene(self, pb, universes):
+        sc = self.scenes.get(pb.name, universes)
+        return sc.index, sc.values
+
+    def _chase_position(self, pb, config, cycle_total, n_steps, t_ns):
+        """(indice step, tempo nello step in ms) secondo la sincronizzazione del chase."""
+        sync = config.get("sync", SYNC_FREE)
+        if sync == SYNC_BEAT or sync == SYNC_BAR: source = self.clock
+        elif sync == SYNC_AUDIO: source = self.audio_tempo # Gli step seguono la fase stimata, non i singoli colpi
+        elif sync == SYNC_GRID: source = self.grid
+        else: source = None
+        if source is not None and source.locked:
+            # Confini degli step agganciati ai quarti/battute della sorgente, hold/fade in proporzione
+            step_beats = max(1, config.get("beats", 1)) * (source.beats_per_bar if sync == SYNC_BAR else 1)
+            pos = source.beats(t_ns) / step_beats
+            idx = int(pos) % n_steps
+            return idx, (pos - int(pos)) * cycle_total
+        
+        if sync == SYNC_TIMECODE and self.timecode.running:
+            elapsed = self.timecode.seconds(t_ns) * 1000 # Stessa posizione per lo stesso timecode
+        else:
+            # Tempo assoluto + offset (per sync audio)
+            elapsed = t_ns // 1_000_000 - pb.start_ms + pb.time_offset
+        elapsed %= cycle_total * n_steps
+        return int(elapsed // cycle_total), elapsed % cycle_total
+
+    def _chase_timing(self, config):
+        """(hold, fade, durata dello step) in ms con i master Speed/Fade applicati."""
         base_hold = config["h"]
         base_fade = config["f"]
         
@@ -59,80 +314,232 @@ class PlaybackEngine(QObject):
         
         cycle_total = hold_ms + fade_ms
         if cycle_total == 0: cycle_total = 1
-        
-        # Tempo assoluto + offset (per sync audio)
-        now_ms = int(time.time() * 1000)
-        elapsed = (now_ms - self.fade_start_ch + self.chase_time_offset) % (cycle_total * len(steps))
-        
-        idx = elapsed // cycle_total
-        t_in_step = elapsed % cycle_total
+        return hold_ms, fade_ms, cycle_total
+
+    def _render_chase(self, pb, universes, t_ns):
+        config = self.data["chases"].get(pb.name)
+        if not config: return None
+        steps = config["steps"]
+        if not steps: return None
+
+        hold_ms, fade_ms, cycle_total = self._chase_timing(config)
+        idx, t_in_step = self._chase_position(pb, config, cycle_total, len(steps), t_ns)
         
         if idx >= len(steps): idx = 0
 
-        sc_a = self.data["scenes"].get(steps[idx], {})
-        sc_b = self.data["scenes"].get(steps[(idx + 1) % len(steps)], {})
+        sc_a = self.scenes.get(steps[idx], universes)
+        sc_b = self.scenes.get(steps[(idx + 1) % len(steps)], universes)
         
-        buf = bytearray([0] * 513)
-        for i in range(1, 513):
-            val_a = sc_a.get(str(i), 0)
-            if t_in_step < hold_ms:
-                buf[i] = val_a
-            else:
-                val_b = sc_b.get(str(i), 0)
-                if fade_ms > 0:
-                    prog = (t_in_step - hold_ms) / fade_ms
-                else:
-                    prog = 1
-                buf[i] = int(val_a + (val_b - val_a) * prog)
-        self.dmx.chase_buffer = buf
+        if t_in_step < hold_ms:
+            return sc_a.index, sc_a.values
+        
+        if fade_ms > 0:
+            prog = (t_in_step - hold_ms) / fade_ms
+        else:
+            prog = 1
+        index = pb.union_index(sc_a, sc_b)
+        out = pb.values_buffer(len(index))
+        pb.kernel.blend(sc_a.flat[index], sc_b.flat[index], prog, out,
+                        config.get("curve", FADE_LINEAR), config.get("dither", False))
+        return index, out
+
+    def _render_cue(self, player, universes, t_ns):
+        frame = player.render(t_ns)
+        if frame is None: return None
+        frame = frame[:universes * 513]
+        index = np.flatnonzero(frame)
+        return index, frame[index]
+
+    def _open_cue(self, name):
+        entry = self.data["cues"].get(name)
+        if not entry: return None
+        try:
+            reader = cue_store.open_cue(entry)
+        except (OSError, ValueError) as e:
+            print(f"Errore apertura cue {name}: {e}")
+            return None
+        if reader is None: return None
+        return cue_store.CuePlayer(reader, entry.get("mode", cue_store.CUE_INTERPOLATE), entry.get("rate", 1.0))
+
+    def set_cue_rate(self, pb_id, rate):
+        """Velocità di riproduzione di una cue attiva (1.0 = tempo reale)."""
+        pb = self.get_playback(pb_id)
+        if pb and pb.player: pb.player.set_rate(rate) # CuePlayer è thread-safe, niente coda
+
+    def seek_cue(self, pb_id, seconds):
+        pb = self.get_playback(pb_id)
+        if pb and pb.player: pb.player.seek(int(seconds * 1_000_000))
+
+    # --- REGISTRAZIONE ---
+    def start_recording(self):
+        """Avvia la registrazione cue (file temporaneo, rinominato da cue_store.finalize_recording)."""
+        old = self.stop_recording()
+        if old: cue_store.discard_recording(old)
+        path = os.path.join(cue_store.CUE_DIR, "_recording.mdxc")
+        self.recorder = cue_store.CueWriter(path, self.dmx.universe_count * 513)
+        self.is_recording_cue = True
+        self.dmx.add_frame_hook(self._record_frame, post=True)
+        self.post(self._publish)
+
+    def _record_frame(self, frames, t_ns):
+        """Hook del thread DMX: accoda il frame mergiato (con la sua scadenza) al writer della cue."""
+        with self._rec_lock:
+            if self.recorder: self.recorder.write(frames, t_ns)
+
+    def stop_recording(self):
+        """Ferma la registrazione e ritorna il CueWriter (da finalizzare o scartare)."""
+        self.dmx.remove_frame_hook(self._record_frame)
+        with self._rec_lock:
+            writer, self.recorder = self.recorder, None
+        if self.is_recording_cue:
+            self.is_recording_cue = False
+            self.post(self._publish)
+        return writer
+
+    # --- COMANDI (da GUI/MIDI: accodati ed eseguiti nel thread del motore) ---
+    def _new_playback(self, kind, name, priority=None, master=None):
+        config = {}
+        if kind == "ch": config = self.data["chases"].get(name, {})
+        elif kind == "cue": config = self.data["cues"].get(name, {})
+        if priority is None: priority = config.get("prio", 0)
+        if master is None: master = config.get("master", 255)
+        pb = Playback(kind, name, priority, master)
+        if kind == "cue": pb.player = self._open_cue(name)
+        return pb
+
+    def _add_playback(self, pb):
+        self.playbacks = self.playbacks + [pb]
+        self._publish()
+
+    def start_playback(self, kind, name, priority=None, master=None):
+        """Avvia una playback nello stack, in parallelo a quelle già attive. Ritorna la Playback."""
+        pb = self._new_playback(kind, name, priority, master)
+        self.post(self._add_playback, pb)
+        return pb
+
+    def _keep_playbacks(self, keep):
+        """Sostituisce la lista delle playback attive chiudendo quelle rimosse."""
+        removed = [pb for pb in self.playbacks if pb not in keep]
+        self.playbacks = keep
+        for pb in removed: pb.close()
+
+    def _stop_playback(self, pb_id):
+        self._keep_playbacks([pb for pb in self.playbacks if pb.id != pb_id])
+        self._publish()
+
+    def stop_playback(self, pb_id):
+        self.post(self._stop_playback, pb_id)
+
+    def get_playback(self, pb_id):
+        for pb in self.playbacks:
+            if pb.id == pb_id: return pb
+        return None
+
+    def _set_playback(self, pb_id, attr, value):
+        pb = self.get_playback(pb_id)
+        if pb:
+            setattr(pb, attr, value)
+            self._publish()
+
+    def set_playback_master(self, pb_id, level):
+        self.post(self._set_playback, pb_id, "master", max(0, min(255, int(level))))
+
+    def set_playback_priority(self, pb_id, priority):
+        self.post(self._set_playback, pb_id, "priority", int(priority))
+
+    def _toggle(self, kind, name):
+        """
+        Toggle dalla GUI/MIDI. Di default è esclusivo per tipo (comportamento storico: una scena,
+        un chase e una cue alla volta); con globals['stack_mode'] attivo le playback si sommano.
+        """
+        running = [pb for pb in self.playbacks if pb.kind == kind and pb.name == name]
+        if running:
+            self._keep_playbacks([pb for pb in self.playbacks if pb not in running])
+            self._publish()
+            return
+        if not self.data.get("globals", {}).get("stack_mode", False):
+            self._keep_playbacks([pb for pb in self.playbacks if pb.kind != kind])
+        self._add_playback(self._new_playback(kind, name))
+
+    def _next_step(self):
+        now_ns = self._frame_ns if self.running and self._frame_ns is not None else time.perf_counter_ns()
+        for pb in self.playbacks:
+            if pb.kind != "ch": continue
+            config = self.data["chases"].get(pb.name)
+            if not config or config.get("sync", SYNC_FREE) != SYNC_FREE: continue # Gli altri seguono il proprio tempo
+            # Quanto manca alla fine dello step corrente: il chase salta esattamente all'inizio del prossimo
+            cycle_total = self._chase_timing(config)[2]
+            elapsed = now_ns // 1_000_000 - pb.start_ms + pb.time_offset
+            pb.time_offset += cycle_total - elapsed % cycle_total
+
+    # --- GRIGLIA DELLA TRACCIA (analisi offline) ---
+    def set_grid(self, grid, triggers=()):
+        """
+        Imposta la griglia dei beat di una traccia (BeatGrid) e i trigger da eseguire sui beat:
+        [{"beat": quarto, "kind": "sc"/"ch"/"cue", "name": nome}]. Nessuna analisi durante lo show.
+        """
+        triggers = tuple(sorted((float(t["beat"]), t["kind"], t["name"]) for t in triggers))
+        self.post(self._set_grid, grid, triggers)
+
+    def _set_grid(self, grid, triggers):
+        if self.grid: self.grid.stop()
+        self.grid = grid
+        self._grid_triggers = triggers
+        self._grid_beat = None
+
+    def start_grid(self, offset_s=0.0):
+        """Avvia la traccia dal punto offset_s (senza MIDI Time Code)."""
+        self.post(self._start_grid, offset_s)
+
+    def _start_grid(self, offset_s):
+        if not self.grid: return
+        self.grid.start(offset_s=offset_s)
+        self._grid_beat = None
+
+    def stop_grid(self):
+        self.post(self._stop_grid)
+
+    def _stop_grid(self):
+        if self.grid: self.grid.stop()
+
+    def _run_grid_triggers(self, t_ns):
+        grid = self.grid
+        if not grid or not grid.locked:
+            self._grid_beat = None
+            return
+        beat = grid.beats(t_ns)
+        last = self._grid_beat
+        self._grid_beat = beat
+        if last is None: last = beat - 1e-6 # Appena avviata: scatta anche un trigger sul quarto corrente
+        elif beat < last: return # Riposizionamento all'indietro (timecode): niente trigger
+        for b, kind, name in self._grid_triggers:
+            if b > beat: break
+            if b > last and not any(pb.kind == kind and pb.name == name for pb in self.playbacks):
+                self._toggle(kind, name)
 
     def force_next_step_signal(self):
-        """Fa avanzare immediatamente il chase allo step successivo"""
-        if self.active_ch:
-            chase_config = self.data["chases"].get(self.active_ch)
-            if chase_config:
-                # Calcoliamo quanto manca alla fine dello step corrente e aggiungiamolo all'offset
-                # Per semplicità, aggiungiamo un tempo fisso grande quanto basta per saltare uno step medio
-                self.chase_time_offset += 200 # ms, salto empirico
-                # Nota: Una logica perfetta richiederebbe calcoli complessi sul ciclo attuale, 
-                # ma questo basta per dare l'effetto "colpo" a tempo di musica.
+        """Fa avanzare immediatamente i chase attivi allo step successivo"""
+        self.post(self._next_step)
 
     def toggle_scene(self, name):
-        if self.active_sc == name:
-            self.active_sc = None
-            self.dmx.scene_buffer = bytearray([0] * 513)
-        else:
-            self.active_sc = name
-            buf = bytearray([0] * 513)
-            for k, v in self.data["scenes"].get(name, {}).items():
-                buf[int(k)] = v
-            self.dmx.scene_buffer = buf
-        self.state_changed.emit()
+        self.post(self._toggle, "sc", name)
 
     def toggle_chase(self, name):
-        if self.active_ch == name:
-            self.active_ch = None
-            self.dmx.chase_buffer = bytearray([0] * 513)
-        else:
-            self.active_ch = name
-            self.fade_start_ch = int(time.time() * 1000)
-            self.chase_time_offset = 0 # Reset offset
-        self.state_changed.emit()
+        self.post(self._toggle, "ch", name)
 
     def toggle_cue(self, name):
-        if self.active_cue == name:
-            self.active_cue = None
-            self.dmx.cue_buffer = bytearray([0] * 513)
-        else:
-            self.active_cue = name
-            self.play_idx_cue = 0
-        self.state_changed.emit()
+        self.post(self._toggle, "cue", name)
 
-    def stop_all(self):
-        self.active_sc = self.active_ch = self.active_cue = None
-        self.is_recording_cue = False
+    def _stop_all(self):
+        self._keep_playbacks([])
+        self.stack.clear(self.dmx.layer_frames(STACK_LAYER).reshape(-1))
         self.dmx.live_buffer = bytearray([0] * 513)
         self.dmx.scene_buffer = bytearray([0] * 513)
         self.dmx.chase_buffer = bytearray([0] * 513)
         self.dmx.cue_buffer = bytearray([0] * 513)
-        self.state_changed.emit()
\ No newline at end of file
+        self._publish()
+
+    def stop_all(self):
+        writer = self.stop_recording()
+        if writer: cue_store.discard_recording(writer)
+        self.post(self._stop_all)
@@ -0,0 +1,26 @@
+from midi_sync import MidiClock, PPQN
+
+def _clocks(clock, t_ns, count, period=20_833_333):
+    for _ in range(count):
+        clock.clock(t_ns)
+        t_ns += period
+    return t_ns
+
+def test_song_position_then_continue_lands_on_position():
+    clock = MidiClock()
+    t = _clocks(clock, 1_000_000_000, 30) # Clock che arriva da fermo (aggancio del tempo)
+    clock.song_position(8) # 8 sedicesimi = 2 quarti
+    assert clock.beats() == 2.0
+    clock.resume()
+    clock.clock(t)
+    assert clock._ticks == 8 * 6
+    assert clock.beats(t) == 2.0
+
+def test_start_lands_on_zero():
+    clock = MidiClock()
+    t = _clocks(clock, 1_000_000_000, 30)
+    clock.start()
+    clock.clock(t)
+    assert clock._ticks == 0
+    _clocks(clock, t + 20_833_333, PPQN)
+    assert clock._ticks == PPQN
@@ -53,19 +53,38 @@ class UIBuilder:
         mw.dmx_combo = QComboBox()
         try: mw.dmx_combo.addItems([p.device for p in serial.tools.list_ports.comports()])
         except: pass
+        mw.dmx_proto = QComboBox(); mw.dmx_proto.addItem("Open DMX", "open"); mw.dmx_proto.addItem("Enttec DMX USB Pro", "pro")
         btn_ser = QPushButton("CONNETTI SERIALE"); btn_ser.clicked.connect(mw.connect_serial)
-        l_ser.addWidget(QLabel("Porta DMX:")); l_ser.addWidget(mw.dmx_combo); l_ser.addWidget(btn_ser)
+        l_ser.addWidget(QLabel("Porta DMX:")); l_ser.addWidget(mw.dmx_combo); l_ser.addWidget(mw.dmx_proto); l_ser.addWidget(btn_ser)
         mw.hw_tabs.addTab(t_ser, "USB DMX")
         
         # ArtNet
         t_art = QWidget(); l_art = QVBoxLayout(t_art)
         row_ip = QHBoxLayout()
         mw.art_ip = QLineEdit("127.0.0.1"); mw.art_uni = QLineEdit("0"); mw.art_uni.setFixedWidth(30)
+        mw.art_count = QLineEdit("1"); mw.art_count.setFixedWidth(30); mw.art_count.setValidator(QIntValidator(1, 64))
+        mw.art_count.setToolTip("Numero di universi consecutivi da inviare")
         row_ip.addWidget(QLabel("IP:")); row_ip.addWidget(mw.art_ip); row_ip.addWidget(QLabel("Uni:")); row_ip.addWidget(mw.art_uni)
+        row_ip.addWidget(QLabel("N:")); row_ip.addWidget(mw.art_count)
+        mw.chk_artnet_discovery = QCheckBox("Auto-discovery nodi (ArtPoll)")
+        mw.chk_artnet_discovery.setToolTip("Invia ogni universo in unicast ai nodi trovati; l'IP resta il fallback")
         btn_art = QPushButton("ATTIVA ART-NET"); btn_art.clicked.connect(mw.connect_artnet)
-        l_art.addLayout(row_ip); l_art.addWidget(btn_art)
+        l_art.addLayout(row_ip); l_art.addWidget(mw.chk_artnet_discovery); l_art.addWidget(btn_art)
         mw.hw_tabs.addTab(t_art, "ART-NET")
 
+        # sACN (E1.31)
+        t_sacn = QWidget(); l_sacn = QVBoxLayout(t_sacn)
+        row_sacn = QHBoxLayout()
+        mw.sacn_ip = QLineEdit(); mw.sacn_ip.setPlaceholderText("Multicast"); mw.sacn_ip.setToolTip("Vuoto = multicast")
+        mw.sacn_uni = QLineEdit("1"); mw.sacn_uni.setFixedWidth(35); mw.sacn_uni.setValidator(QIntValidator(1, 63999))
+        row_sacn.addWidget(QLabel("IP:")); row_sacn.addWidget(mw.sacn_ip); row_sacn.addWidget(QLabel("Uni:")); row_sacn.addWidget(mw.sacn_uni)
+        row_prio = QHBoxLayout()
+        mw.sacn_prio = QLineEdit("100"); mw.sacn_prio.setFixedWidth(35); mw.sacn_prio.setValidator(QIntValidator(0, 200))
+        row_prio.addWidget(QLabel("Priorità:")); row_prio.addWidget(mw.sacn_prio); row_prio.addStretch()
+        btn_sacn = QPushButton("ATTIVA sACN"); btn_sacn.clicked.connect(mw.connect_sacn)
+        l_sacn.addLayout(row_sacn); l_sacn.addLayout(row_prio); l_sacn.addWidget(btn_sacn)
+        mw.hw_tabs.addTab(t_sacn, "sACN")
+
         # AUDIO TAB (NUOVO)
         t_aud = QWidget(); l_aud = QVBoxLayout(t_aud); l_aud.setContentsMargins(5,5,5,5)
         mw.audio_combo = QComboBox() # Popolato dal main
@@ -83,6 +102,14 @@ class UIBuilder:
         h_vis.addWidget(QLabel("Vol:")); h_vis.addWidget(mw.prog_vol); h_vis.addWidget(mw.ind_beat)
         l_aud.addLayout(h_vis)
         
+        h_track = QHBoxLayout()
+        btn_track = QPushButton("TRACCIA..."); btn_track.setToolTip("Analisi offline di un WAV: griglia dei beat in cache")
+        btn_track.clicked.connect(mw.load_soundtrack)
+        mw.btn_grid = QPushButton("▶ GRIGLIA"); mw.btn_grid.setCheckable(True); mw.btn_grid.setEnabled(False)
+        mw.btn_grid.clicked.connect(mw.toggle_grid)
+        h_track.addWidget(btn_track); h_track.addWidget(mw.btn_grid)
+        l_aud.addLayout(h_track)
+        
         mw.hw_tabs.addTab(t_aud, "AUDIO FX")
         left.addWidget(mw.hw_tabs)
         
@@ -94,6 +121,13 @@ class UIBuilder:
         btn_m = QPushButton("OK"); btn_m.setFixedWidth(40); btn_m.clicked.connect(mw.connect_midi)
         midi_box.addWidget(QLabel("MIDI:")); midi_box.addWidget(mw.midi_combo); midi_box.addWidget(btn_m)
         left.addLayout(midi_box)
+        midi_out_box = QHBoxLayout()
+        mw.midi_out_combo = QComboBox(); mw.midi_out_combo.addItem("(nessun feedback)")
+        try: mw.midi_out_combo.addItems(mido.get_output_names())
+        except: pass
+        btn_mo = QPushButton("OK"); btn_mo.setFixedWidth(40); btn_mo.clicked.connect(mw.connect_midi_output)
+        midi_out_box.addWidget(QLabel("OUT:")); midi_out_box.addWidget(mw.midi_out_combo); midi_out_box.addWidget(btn_mo)
+        left.addLayout(midi_out_box)
         mw.lbl_midi_monitor = QLabel("DISCONNECTED")
         mw.lbl_midi_monitor.setStyleSheet("color: #666; font-size: 11px; border: 1px solid #333; padding: 2px;")
         mw.lbl_midi_monitor.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -115,6 +149,12 @@ class UIBuilder:
         l_react.addWidget(mw.chk_beat_chase)
         mw.chk_vol_dimmer = QCheckBox("VOLUME -> Master Dimmer"); mw.chk_vol_dimmer.setToolTip("Volume controlla Fader Live")
         l_react.addWidget(mw.chk_vol_dimmer)
+        band_box = QHBoxLayout()
+        mw.band_combo = QComboBox() # Popolato dal main (bande dell'analizzatore)
+        btn_band = QPushButton("-> GRUPPO"); btn_band.setToolTip("Banda -> canali del gruppo selezionato (di nuovo per rimuovere)")
+        btn_band.clicked.connect(mw.map_band_to_group)
+        band_box.addWidget(QLabel("Banda:")); band_box.addWidget(mw.band_combo); band_box.addWidget(btn_band)
+        l_react.addLayout(band_box)
         left.addWidget(react_box)
         
         left.addSpacing(5)
@@ -140,6 +180,7 @@ class UIBuilder:
         t_sc = QWidget(); l_sc = QVBoxLayout(t_sc); l_sc.setContentsMargins(2,2,2,2)
         btn_ss = QPushButton("SALVA SCENA"); btn_ss.clicked.connect(mw.save_scene_action)
         mw.s_list = QListWidget(); mw.s_list.itemClicked.connect(lambda i: mw.playback.toggle_scene(i.text()))
+        mw.s_list.setSelectionMode(QAbstractItemView.SelectionMode.MultiSelection) # Selezione = playback attive (stack)
         mw.s_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         mw.s_list.customContextMenuRequested.connect(lambda p: mw.show_context_menu(mw.s_list, p, "sc"))
         l_sc.addWidget(btn_ss); l_sc.addWidget(mw.s_list); mw.sg_tabs.addTab(t_sc, "SCENE")
@@ -187,6 +228,7 @@ class UIBuilder:
         r_btns.addWidget(b_man); r_btns.addWidget(b_wiz); right.addLayout(r_btns)
         
         mw.ch_list = QListWidget(); mw.ch_list.setFixedHeight(120)
+        mw.ch_list.setSelectionMode(QAbstractItemView.SelectionMode.MultiSelection)
         mw.ch_list.itemClicked.connect(lambda i: mw.playback.toggle_chase(i.text()))
         mw.ch_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         mw.ch_list.customContextMenuRequested.connect(lambda p: mw.show_context_menu(mw.ch_list, p, "ch"))
@@ -206,6 +248,10 @@ class UIBuilder:
         mw.sl_fade.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         mw.sl_fade.customContextMenuRequested.connect(lambda p: mw.show_slider_context(p, "chase_fade"))
         l_spd.addWidget(mw.sl_fade)
+        mw.chk_stack_mode = QCheckBox("STACK: scene/chase/cue multiple")
+        mw.chk_stack_mode.setToolTip("Attivando una playback non si spegne quella dello stesso tipo già attiva")
+        mw.chk_stack_mode.stateChanged.connect(mw.on_stack_mode_change)
+        l_spd.addWidget(mw.chk_stack_mode)
         right.addWidget(spd_box)
         
         right.addWidget(QLabel("<b>5. CUES</b>"))
@@ -213,6 +259,7 @@ class UIBuilder:
         mw.btn_rec.setStyleSheet("color: #e74c3c; font-weight: bold; background-color: #222;")
         right.addWidget(mw.btn_rec)
         mw.cue_list = QListWidget(); mw.cue_list.setFixedHeight(120)
+        mw.cue_list.setSelectionMode(QAbstractItemView.SelectionMode.MultiSelection)
         mw.cue_list.itemClicked.connect(lambda i: mw.playback.toggle_cue(i.text()))
         mw.cue_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         mw.cue_list.customContextMenuRequested.connect(lambda p: mw.show_context_menu(mw.cue_list, p, "cue"))